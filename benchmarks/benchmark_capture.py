@@ -0,0 +1,185 @@
+"""
+Measures the CPU cost per frame of the capture path up to motion detection:
+
+  legacy      cap.read() decodes every frame, cv2.resize + detect_motion() as in
+              the original main loop
+  grabber     FrameGrabber retrieving and decoding every frame, MotionDetector
+              on the full frame (before the grab/retrieve split)
+  grab-only   FrameGrabber that only grabs the frames beyond --fps
+  compressed  MJPEG frames kept compressed, motion on a reduced-size decode,
+              full decode only for frames with motion (what main.py does now)
+
+The pipeline takes --fps frames per second (as with the governor's capture
+rate); frames with motion are decoded in full, as for person detection.
+
+    python3 benchmark_capture.py --source 1 --resolution 1280 720 --fps 10
+    python3 benchmark_capture.py --source recording_mjpeg.avi
+    python3 benchmark_capture.py --source synthetic     # records an MJPEG clip first
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+import psutil
+from capture_image import (open_video_source, CameraSource, SyntheticVideoSource, FrameGrabber, MotionDetector,
+                           detect_motion)
+
+MODES = ["legacy", "grabber", "grab-only", "compressed"]
+MOTION_DETECTION_RESOLUTION = (320, 240)
+
+
+def record_synthetic(path, resolution, fps, seconds):
+    """Writes the synthetic test pattern, with sensor-like noise, as an MJPEG AVI."""
+    width, height = resolution
+    source = SyntheticVideoSource(width, height, fps, realtime=False)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    noise = np.random.randint(0, 12, (8, height, width, 3), dtype=np.uint8)
+    for index in range(int(fps * seconds)):
+        _, frame = source.read()
+        writer.write(cv2.add(frame, noise[index % len(noise)]))
+    writer.release()
+
+
+def run_legacy(cap, args, stop_event, counts):
+    """The original main loop: decode every frame, resize, compare with the previous frame."""
+    interval = 1.0 / args.fps if args.fps else 0.0
+    next_frame = 0.0
+    previous = None
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        counts['grabbed'] += 1
+        if time.monotonic() < next_frame:
+            continue
+        next_frame = time.monotonic() + interval
+        counts['processed'] += 1
+        low_res = cv2.resize(frame, MOTION_DETECTION_RESOLUTION)
+        if previous is not None and detect_motion(previous, low_res):
+            counts['motion'] += 1
+        previous = low_res
+
+
+def run_grabber(cap, args, stop_event, counts, decode_fps, preview):
+    """capture_stage + motion_stage of main.py on a FrameGrabber."""
+    grabber = FrameGrabber(cap, decode_fps=decode_fps).start()
+    motion_detector = MotionDetector(MOTION_DETECTION_RESOLUTION)
+    interval = 1.0 / args.fps if args.fps else 0.0
+    last_seq = -1
+    last_capture = 0.0
+    try:
+        while not stop_event.is_set() and not grabber.failed.is_set():
+            delay = last_capture + interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            frame = grabber.wait_for_frame(last_seq, timeout=0.5)
+            if frame is None:
+                continue
+            last_capture = time.monotonic()
+            last_seq = frame.seq
+            counts['processed'] += 1
+            image = frame.preview(MOTION_DETECTION_RESOLUTION) if preview else frame.image
+            if motion_detector.detect_regions(image, frame_size=frame.size)[0]:
+                counts['motion'] += 1
+                frame.image  # Decoded in full for person detection
+    finally:
+        grabber.stop()
+        counts['grabbed'] = grabber.frames_grabbed
+        counts['retrieved'] = grabber.frames_retrieved
+
+
+def open_source(args, compressed):
+    if args.source.isdigit():
+        return CameraSource(int(args.source), resolution=args.resolution, fps=args.source_fps, compressed=compressed)
+    return open_video_source(args.source, loop=True, realtime=True, compressed=compressed)
+
+
+def measure(mode, args):
+    compressed = mode == "compressed"
+    cap = open_source(args, compressed)
+    if not cap.isOpened():
+        raise SystemExit(f"Can not open {args.source}")
+    if compressed and not getattr(cap, "compressed", False):
+        print(f"{args.source} does not deliver MJPEG frames; 'compressed' decodes them like 'grab-only'")
+    counts = {'grabbed': 0, 'retrieved': 0, 'processed': 0, 'motion': 0}
+    stop_event = threading.Event()
+    if mode == "legacy":
+        target, extra = run_legacy, ()
+    else:
+        decode_fps = args.fps if mode in ("grab-only", "compressed") else None
+        target, extra = run_grabber, (decode_fps, compressed)
+    thread = threading.Thread(target=target, args=(cap, args, stop_event, counts) + extra)
+
+    process = psutil.Process()
+    cpu_before = process.cpu_times()
+    started = time.monotonic()
+    thread.start()
+    time.sleep(args.seconds)
+    stop_event.set()
+    thread.join()
+    elapsed = time.monotonic() - started
+    cpu_after = process.cpu_times()
+    cap.release()
+
+    cpu_ms = (cpu_after.user - cpu_before.user + cpu_after.system - cpu_before.system) * 1000.0
+    return {
+        "cpu_percent": cpu_ms / 10.0 / elapsed,
+        "cpu_ms_per_frame": cpu_ms / max(counts['grabbed'], 1),
+        "cpu_ms_per_processed": cpu_ms / max(counts['processed'], 1),
+        "source_fps": counts['grabbed'] / elapsed,
+        "processed_fps": counts['processed'] / elapsed,
+        "retrieved": counts['retrieved'] / max(counts['grabbed'], 1) if mode != "legacy" else 1.0,
+        "motion_frames": counts['motion'],
+    }
+
+
+def print_table(results):
+    rows = [
+        ("CPU (% of one core)", "cpu_percent"),
+        ("CPU per captured frame (ms)", "cpu_ms_per_frame"),
+        ("CPU per processed frame (ms)", "cpu_ms_per_processed"),
+        ("source FPS", "source_fps"),
+        ("processed FPS", "processed_fps"),
+        ("frames retrieved", "retrieved"),
+        ("frames with motion", "motion_frames"),
+    ]
+    print(f"{'':<30}" + "".join(f"{mode:>12}" for mode in results))
+    for name, key in rows:
+        print(f"{name:<30}" + "".join(f"{round(results[mode][key], 2):>12}" for mode in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="synthetic", help="camera index, MJPEG video file or 'synthetic'")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[640, 480], help="capture or synthetic size")
+    parser.add_argument("--source-fps", type=float, default=30.0, help="capture or synthetic frame rate")
+    parser.add_argument("--fps", type=float, default=10.0, help="frames per second taken by the pipeline (0: all)")
+    parser.add_argument("--seconds", type=float, default=20.0, help="run time per mode")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    temp_dir = None
+    try:
+        if args.source == "synthetic":
+            temp_dir = tempfile.mkdtemp(prefix="capture-")
+            args.source = os.path.join(temp_dir, "synthetic_mjpeg.avi")
+            record_synthetic(args.source, args.resolution, args.source_fps, 10)
+        elif args.source.isdigit():
+            cap = open_source(args, compressed=True)
+            print(f"Camera mode: {cap.mode}, compressed frames: {cap.compressed}")
+            cap.release()
+        results = {mode: measure(mode, args) for mode in args.modes}
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+    print(f"\n{args.source}, pipeline at {args.fps:.0f} FPS, {args.seconds:.0f} s per mode, "
+          f"{psutil.cpu_count()} CPUs")
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Checks the HOG prescreen cascade against running SSD on every motion frame
+of a recorded clip: how many SSD calls each prescreen threshold avoids and
+how many SSD person detections it would have missed (recall).
+
+    python3 benchmark_cascade.py --clip recording.mp4 --thresholds -1.0 -0.5 0.0 0.5
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from capture_image import open_video_source, detect_motion
+from detection import DetectionEngine, HogPrescreen
+
+MOTION_DETECTION_RESOLUTION = (320, 240)
+
+
+def motion_frames(source, limit, every_frame=False):
+    """Yields the full-resolution frames that would be sent to detection."""
+    cap = open_video_source(source, realtime=False)
+    previous = None
+    count = 0
+    while count < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        low_res = cv2.resize(frame, MOTION_DETECTION_RESOLUTION)
+        if every_frame or (previous is not None and detect_motion(previous, low_res)):
+            count += 1
+            yield frame
+        previous = low_res
+    cap.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=200, help="maximum number of motion frames to check")
+    parser.add_argument("--every-frame", action="store_true", help="check every frame, not only motion frames")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[-1.0, -0.5, 0.0, 0.5])
+    args = parser.parse_args()
+
+    engine = DetectionEngine()
+    # Score with the lowest threshold once; higher thresholds are a filter on that score
+    prescreen = HogPrescreen(threshold=min(args.thresholds))
+
+    ssd_positive = []
+    scores = []
+    prescreen_time = 0.0
+    for frame in motion_frames(args.clip, args.frames, args.every_frame):
+        person_detected, _ = engine.detect(frame)
+        started = time.perf_counter()
+        score = prescreen.score(frame)
+        prescreen_time += time.perf_counter() - started
+        ssd_positive.append(person_detected)
+        scores.append(np.inf if score is None else score)  # Too small to score: always sent to SSD
+
+    if not scores:
+        print("No motion frames found in the clip.")
+        return
+    ssd_positive = np.array(ssd_positive)
+    scores = np.array(scores)
+    print(f"{len(scores)} frames checked, {int(ssd_positive.sum())} with a person according to SSD, "
+          f"prescreen avg {1000.0 * prescreen_time / len(scores):.1f} ms/frame")
+    for threshold in sorted(args.thresholds):
+        passed = scores >= threshold
+        avoided = 100.0 * np.mean(~passed)
+        recall = np.mean(passed[ssd_positive]) if ssd_positive.any() else 1.0
+        print(f"threshold {threshold:+.2f}: SSD calls avoided {avoided:5.1f}%   recall vs SSD {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares the original per-frame detect_person() with DetectionEngine on a
+benchmark clip and reports CPU throughput and latency percentiles.
+
+    python3 benchmark_detection.py --clip clip.mp4 --frames 100
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from torchvision.models.detection import ssd300_vgg16
+from capture_image import open_video_source
+from detection import DetectionEngine, load_ssd_model
+
+
+def legacy_detect_person(model, frame, confidence_threshold=0.5):
+    """The detect_person() implementation this benchmark is measured against."""
+    image_tensor = torch.from_numpy(frame).permute(2, 0, 1).float().unsqueeze(0) / 255.0
+    predictions = model(image_tensor)[0]
+    for label, score in zip(predictions['labels'], predictions['scores']):
+        if label == 1 and score > confidence_threshold:
+            return True, predictions
+    return False, predictions
+
+
+def load_frames(source, count):
+    cap = open_video_source(source, loop=True, realtime=False)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def summarize(name, latencies, frame_count, elapsed):
+    latencies_ms = np.array(latencies) * 1000.0
+    print(f"{name:<24} {frame_count / elapsed:7.2f} frames/s   "
+          f"p50 {np.percentile(latencies_ms, 50):8.1f} ms   p95 {np.percentile(latencies_ms, 95):8.1f} ms")
+
+
+def run(frames, batch_sizes, model):
+    torch.set_grad_enabled(True)  # The legacy path ran with autograd enabled
+    legacy_detect_person(model, frames[0])  # Warm-up
+    latencies = []
+    started = time.perf_counter()
+    for frame in frames:
+        t0 = time.perf_counter()
+        legacy_detect_person(model, frame)
+        latencies.append(time.perf_counter() - t0)
+    summarize("detect_person (legacy)", latencies, len(frames), time.perf_counter() - started)
+
+    engine = DetectionEngine(model=model, device="cpu", max_batch_size=max(batch_sizes))
+    engine.detect_batch(frames[:1])  # Warm-up
+    for batch_size in batch_sizes:
+        latencies = []
+        started = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            batch = frames[i:i + batch_size]
+            t0 = time.perf_counter()
+            engine.detect_batch(batch)
+            # Every frame in the batch waits for the whole batch
+            latencies.extend([time.perf_counter() - t0] * len(batch))
+        summarize(f"DetectionEngine batch={batch_size}", latencies, len(frames), time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file, camera index or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    parser.add_argument("--no-pretrained", action="store_true", help="use random weights (no download)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.no_pretrained:
+        model = ssd300_vgg16(pretrained=False, pretrained_backbone=False).eval()
+    else:
+        model = load_ssd_model()
+
+    frames = load_frames(args.clip, args.frames)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} from {args.clip}, "
+          f"{torch.get_num_threads()} CPU threads")
+    run(frames, args.batch_sizes, model)
+
+
+if __name__ == "__main__":
+    main()
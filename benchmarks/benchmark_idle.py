@@ -0,0 +1,115 @@
+"""
+Measures the idle mode of main.py: CPU used while the system is stopped and
+while it runs, and the Stop and Start transitions (Start to the first frame
+through motion detection, against RESUME_TARGET_MS).
+
+main.main() runs on a thread with the Bot API replaced by the local
+FakeBotAPI; the benchmark presses Start and Stop by setting the idle mode
+events, as the Telegram buttons do.
+
+    python3 benchmark_idle.py --source synthetic --cycles 5 --idle 20 --active 10
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import psutil
+
+
+def cpu_percent_over(process, seconds):
+    """CPU used by this process over the next seconds, in percent of one core."""
+    before = process.cpu_times()
+    time.sleep(seconds)
+    after = process.cpu_times()
+    return 100.0 * (after.user - before.user + after.system - before.system) / seconds
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def run(args):
+    # Imported here: importing main imports torch and every pipeline module
+    import main
+    import send_telegram
+    from send_telegram import AsyncTelegramSender
+    from fake_bot_api import FakeBotAPI
+    from message_log import MessageLog
+    from idle_mode import system_active_event, image_detection_paused, exit_event
+    from event_store import event_store
+
+    work_dir = tempfile.mkdtemp(prefix="idle-")
+    api = FakeBotAPI()
+    try:
+        url = api.start(port=args.port)
+        send_telegram.sender = AsyncTelegramSender(token="idle", api_url=url).start()
+        send_telegram.message_log = MessageLog(os.path.join(work_dir, "message_ids.log"))
+        event_store.path = os.path.join(work_dir, "events.db")
+        event_store.media_dir = os.path.join(work_dir, "media")
+        main.CAMERA_SOURCES = [(args.name, args.source)]
+        main.GOVERNOR_ENABLED = False  # Same settings in every cycle
+        main.initialize_idle_mode = lambda: None  # The benchmark presses the buttons
+        main.DETECTION_ISOLATED = False  # CPU is measured for this process only
+
+        main.detection_engine.load()  # Not part of the measured cycles
+        thread = threading.Thread(target=main.main, name="main")
+        thread.start()
+        # The system starts paused: wait for main() to release the cameras
+        if not wait_for(lambda: main.suspend_latency.processed >= 1, 60):
+            raise SystemExit("main() did not reach idle mode")
+
+        process = psutil.Process()
+        idle_cpu, active_cpu, idle_threads, active_threads = [], [], [], []
+        for cycle in range(args.cycles):
+            idle_threads.append(process.num_threads())
+            idle_cpu.append(cpu_percent_over(process, args.idle))
+
+            starts = main.resume_latency.processed
+            image_detection_paused.clear()
+            system_active_event.set()
+            if not wait_for(lambda: main.resume_latency.processed > starts, 30):
+                print(f"Cycle {cycle + 1}: no frame processed within 30 s of Start")
+            active_threads.append(process.num_threads())
+            active_cpu.append(cpu_percent_over(process, args.active))
+
+            stops = main.suspend_latency.processed
+            system_active_event.clear()
+            image_detection_paused.set()
+            wait_for(lambda: main.suspend_latency.processed > stops, 30)
+
+        exit_event.set()
+        thread.join()
+        stops = main.suspend_latency.snapshot()
+        starts = main.resume_latency.snapshot()
+        print(f"\n{args.cycles} cycles, {args.idle:.0f} s idle and {args.active:.0f} s active each, "
+              f"{psutil.cpu_count()} CPUs")
+        print(f"CPU idle     {sum(idle_cpu) / len(idle_cpu):6.1f}%   ({min(idle_threads)} threads)")
+        print(f"CPU active   {sum(active_cpu) / len(active_cpu):6.1f}%   ({max(active_threads)} threads)")
+        print(f"Stop  -> released           avg {stops['avg_latency_ms']:6.0f} ms   max {stops['max_latency_ms']:6.0f} ms")
+        print(f"Start -> first frame        avg {starts['avg_latency_ms']:6.0f} ms   max {starts['max_latency_ms']:6.0f} ms"
+              f"   ({starts['emitted']} of {starts['processed']} within {main.RESUME_TARGET_MS} ms)")
+    finally:
+        api.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="synthetic", help="camera index, video file or 'synthetic'")
+    parser.add_argument("--name", default="camera", help="camera name")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=20.0, help="seconds stopped per cycle")
+    parser.add_argument("--active", type=float, default=10.0, help="seconds running per cycle")
+    parser.add_argument("--port", type=int, default=8099, help="port of the fake Bot API")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Compares person detection in the main process (DetectionCascade on a
+DetectionEngine, as before) with detection in the DetectionWorker process:
+end-to-end detection throughput, and how quickly the main process still
+answers a command while detection runs.
+
+--streams threads call detect() on frames of the clip for --seconds, as the
+detection stages of main.py do. Meanwhile a probe thread wakes up every
+--probe-interval ms, like the Telegram listener polling for a command, and
+encodes a small JPEG reply; its lateness plus the reply time is the command
+latency. With --kill-after the worker is killed during the run to measure
+how long detection takes to recover.
+
+    python3 benchmark_isolation.py --clip synthetic --streams 2 --seconds 30
+    python3 benchmark_isolation.py --torch-threads 2 --affinity 2 3 --kill-after 10
+    python3 benchmark_isolation.py --no-pretrained    # random weights, no download
+"""
+import argparse
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+import psutil
+from capture_image import open_video_source
+
+MODES = ["in-process", "worker"]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def probe_commands(stop_event, interval, latencies):
+    """Wakes up every interval seconds and answers a command with a small JPEG."""
+    reply = np.random.randint(0, 255, (240, 320, 3), dtype=np.uint8)
+    due = time.monotonic() + interval
+    while not stop_event.is_set():
+        time.sleep(max(0.0, due - time.monotonic()))
+        cv2.imencode(".jpg", reply)
+        latencies.append((time.monotonic() - due) * 1000.0)
+        due += interval
+        if due < time.monotonic():
+            due = time.monotonic() + interval  # Missed wake-ups count once
+
+
+def run_mode(mode, frames, args, weights_file):
+    import detection
+    from detection import DetectionEngine, DetectionCascade
+    from detection_worker import DetectionWorker
+
+    if mode == "worker":
+        detector = DetectionWorker(cpu_affinity=set(args.affinity) if args.affinity else None,
+                                   torch_threads=args.torch_threads, weights_file=weights_file,
+                                   cascade_enabled=args.cascade)
+    else:
+        if weights_file:
+            detection.SSD_WEIGHTS_FILE = weights_file
+        if args.torch_threads:
+            import torch
+            torch.set_num_threads(args.torch_threads)
+        detector = DetectionCascade(DetectionEngine(device="cpu", lazy=True), enabled=args.cascade)
+    started = time.perf_counter()
+    if mode == "worker":
+        detector.load()
+    else:
+        detector.engine.load()
+    load_seconds = time.perf_counter() - started
+
+    counts = [0] * args.streams
+    errors = []
+    results = {"mode": mode, "load_s": load_seconds}
+    stop_event = threading.Event()
+    recovered = threading.Event()
+    killed_at = [None]
+
+    def stream(index):
+        position = index
+        while not stop_event.is_set():
+            frame = frames[position % len(frames)]
+            position += args.streams
+            try:
+                detector.detect(frame, args.threshold)
+            except Exception as e:
+                errors.append(str(e))
+                time.sleep(0.1)
+                continue
+            counts[index] += 1
+            if killed_at[0] is not None and not recovered.is_set():
+                results["recovery_s"] = time.monotonic() - killed_at[0]
+                recovered.set()
+
+    latencies = []
+    threads = [threading.Thread(target=stream, args=(i,), daemon=True) for i in range(args.streams)]
+    threads.append(threading.Thread(target=probe_commands, daemon=True,
+                                    args=(stop_event, args.probe_interval / 1000.0, latencies)))
+    process = psutil.Process()
+    cpu_before = process.cpu_times()
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        if args.kill_after is not None and mode == "worker":
+            time.sleep(args.kill_after)
+            killed_at[0] = time.monotonic()
+            os.kill(detector._process.pid, signal.SIGKILL)
+        time.sleep(max(0.0, args.seconds - (time.monotonic() - started)))
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+    cpu_after = process.cpu_times()
+
+    results.update({
+        "detections_per_s": sum(counts) / elapsed,
+        "errors": len(errors),
+        "command_p50_ms": percentile(latencies, 50),
+        "command_p95_ms": percentile(latencies, 95),
+        "command_max_ms": max(latencies) if latencies else 0.0,
+        "main_cpu_percent": 100.0 * (cpu_after.user - cpu_before.user
+                                     + cpu_after.system - cpu_before.system) / elapsed,
+        "main_rss_mb": process.memory_info().rss / (1024 * 1024),
+    })
+    if mode == "worker":
+        results["worker_rss_mb"] = detector.worker_rss()
+        detector.stop()
+    else:
+        detector.engine.unload()
+    return results
+
+
+def print_table(results):
+    rows = [
+        ("model load (s)", "load_s"),
+        ("detections/s", "detections_per_s"),
+        ("detection errors", "errors"),
+        ("command latency p50 (ms)", "command_p50_ms"),
+        ("command latency p95 (ms)", "command_p95_ms"),
+        ("command latency max (ms)", "command_max_ms"),
+        ("main process CPU (%)", "main_cpu_percent"),
+        ("main process RSS (MB)", "main_rss_mb"),
+        ("worker RSS (MB)", "worker_rss_mb"),
+        ("recovery after kill (s)", "recovery_s"),
+    ]
+    print(f"{'':<28}" + "".join(f"{result['mode']:>14}" for result in results))
+    for name, key in rows:
+        values = [result.get(key) for result in results]
+        print(f"{name:<28}" + "".join(f"{'-' if v is None else round(v, 2):>14}" for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file, camera index or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=30, help="frames of the clip to cycle through")
+    parser.add_argument("--streams", type=int, default=2, help="threads calling detect(), like the detection stages")
+    parser.add_argument("--seconds", type=float, default=30.0, help="run time per mode")
+    parser.add_argument("--threshold", type=float, default=0.5, help="SSD confidence threshold")
+    parser.add_argument("--cascade", action="store_true", help="run the HOG prescreen before SSD")
+    parser.add_argument("--probe-interval", type=float, default=100.0, help="command probe period (ms)")
+    parser.add_argument("--torch-threads", type=int, default=None, help="torch threads for detection")
+    parser.add_argument("--affinity", type=int, nargs="+", default=None, help="cores of the worker process")
+    parser.add_argument("--kill-after", type=float, default=None, help="kill the worker after this many seconds")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--no-pretrained", action="store_true", help="use random weights (no download)")
+    args = parser.parse_args()
+
+    cap = open_video_source(args.clip, loop=True, realtime=False)
+    frames = [cap.read()[1] for _ in range(args.frames)]
+    cap.release()
+
+    temp_dir = None
+    weights_file = None
+    try:
+        if args.no_pretrained:
+            # Random weights saved as the cached weights file, so both modes load the same model
+            import torch
+            from torchvision.models.detection import ssd300_vgg16
+            temp_dir = tempfile.mkdtemp(prefix="weights-")
+            weights_file = os.path.join(temp_dir, "ssd300_vgg16.pth")
+            torch.save(ssd300_vgg16(pretrained=False, pretrained_backbone=False).state_dict(), weights_file)
+        results = [run_mode(mode, frames, args, weights_file) for mode in args.modes]
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+    height, width = frames[0].shape[:2]
+    print(f"\n{len(frames)} frames of {width}x{height} from {args.clip}, {args.streams} streams, "
+          f"{args.seconds:.0f} s per mode, {psutil.cpu_count()} CPUs")
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Cost of storing one message ID as the number of stored IDs grows: the
+original message_ids.json rewrite compared with the append-only MessageLog.
+
+    python3 benchmark_message_log.py --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from message_log import MessageLog
+
+
+def store_message_id_json(path, message_id):
+    """The original store_message_id: read the whole list, append, rewrite."""
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            message_ids = json.load(f)
+    else:
+        message_ids = []
+    message_ids.append(message_id)
+    with open(path, 'w') as f:
+        json.dump(message_ids, f)
+
+
+def time_appends(append, start_id, count):
+    timings = []
+    for message_id in range(start_id, start_id + count):
+        started = time.perf_counter()
+        append(message_id)
+        timings.append(time.perf_counter() - started)
+    return np.array(timings) * 1e6
+
+
+def report(name, size, timings_us):
+    print(f"{name:<12} {size:>8} stored   mean {timings_us.mean():9.1f} us   "
+          f"p95 {np.percentile(timings_us, 95):9.1f} us   max {timings_us.max():9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of already stored IDs to measure at")
+    parser.add_argument("--appends", type=int, default=200, help="appends timed at each size")
+    parser.add_argument("--json-appends", type=int, default=20,
+                        help="appends timed at each size for the JSON file (slow at large sizes)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            json_path = os.path.join(directory, f"message_ids_{size}.json")
+            with open(json_path, "w") as f:
+                json.dump(list(range(size)), f)
+            timings = time_appends(lambda m: store_message_id_json(json_path, m), size, args.json_appends)
+            report("json", size, timings)
+
+            log = MessageLog(os.path.join(directory, f"message_ids_{size}.log"))
+            with open(log.path, "w") as f:
+                f.writelines(f"{m}\n" for m in range(size))
+            timings = time_appends(log.append, size, args.appends)
+            log.close()
+            report("MessageLog", size, timings)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-frame cost of the original resize + detect_motion() path compared with
+MotionDetector (running average, MOG2, KNN) on the same frames.
+
+    python3 benchmark_motion.py --clip recording.mp4 --frames 300
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from capture_image import open_video_source, detect_motion, MotionDetector
+
+MOTION_DETECTION_RESOLUTION = (320, 240)
+
+
+def load_frames(source, count):
+    cap = open_video_source(source, loop=True, realtime=False)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def report(name, timings, detections):
+    timings_us = np.array(timings) * 1e6
+    print(f"{name:<32} mean {timings_us.mean():8.1f} us   p95 {np.percentile(timings_us, 95):8.1f} us   "
+          f"motion frames {detections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    frames = load_frames(args.clip, args.frames)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, "
+          f"motion resolution {MOTION_DETECTION_RESOLUTION[0]}x{MOTION_DETECTION_RESOLUTION[1]}")
+
+    # Original path: resize every frame, then compare two consecutive frames
+    previous = cv2.resize(frames[0], MOTION_DETECTION_RESOLUTION)
+    timings, detections = [], 0
+    for frame in frames[1:]:
+        started = time.perf_counter()
+        current = cv2.resize(frame, MOTION_DETECTION_RESOLUTION)
+        detections += detect_motion(previous, current)
+        previous = current
+        timings.append(time.perf_counter() - started)
+    report("resize + detect_motion", timings, detections)
+
+    for method in MotionDetector.METHODS:
+        detector = MotionDetector(MOTION_DETECTION_RESOLUTION, method=method)
+        detector.detect(frames[0])
+        timings, detections = [], 0
+        for frame in frames[1:]:
+            started = time.perf_counter()
+            detections += detector.detect(frame)
+            timings.append(time.perf_counter() - started)
+        report(f"MotionDetector {method}", timings, detections)
+
+
+if __name__ == "__main__":
+    main()
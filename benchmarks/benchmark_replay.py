@@ -0,0 +1,392 @@
+"""
+End-to-end replay benchmark: plays a video file or an image folder through
+the full main.py pipeline (motion, cascade, SSD, tracker, event store, clips,
+Telegram sender) with the Bot API replaced by the local FakeBotAPI, and
+writes a JSON report: capture FPS, motion-to-alert latency histograms, SSD
+calls per minute, CPU/RAM peaks and, given a ground-truth file,
+precision/recall.
+
+    python3 benchmark_replay.py --source recording.mp4 --ground-truth recording.json --output run.json
+    python3 benchmark_replay.py --source frames/ --fast --output run.json
+    python3 benchmark_replay.py --compare baseline.json run.json
+    python3 benchmark_replay.py --source recording.mp4 --zones zones.json --output zoned.json
+
+Ground truth is JSON mapping frames to person boxes (x1, y1, x2, y2 in frame
+pixels). Keys are 0-based frame indexes, or file names for an image folder;
+frames that are not listed contain no person:
+
+    {"frames": {"120": [[410, 80, 530, 400]], "121": [[414, 80, 534, 402]]}}
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import cv2
+import numpy as np
+import psutil
+
+REPORT_VERSION = 1
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = [100, 250, 500, 1000, 2000, 5000, 10000, 30000]
+
+# Ground-truth frames with a person that are at most this many frames apart
+# belong to the same visit; a visit counts as alerted if any of its frames alerted
+VISIT_GAP_FRAMES = 30
+
+# Figures printed side by side by --compare (path in the report, higher is better)
+COMPARED_FIGURES = [
+    ("capture.fps_taken", True),
+    ("latency.motion_to_alert_ms.p50", False),
+    ("latency.motion_to_alert_ms.p95", False),
+    ("latency.motion_to_delivery_ms.p95", False),
+    ("detection.ssd_calls_per_minute", False),
+    ("resources.cpu_peak", False),
+    ("resources.rss_peak_mb", False),
+    ("startup.model_load_s", False),
+    ("startup.rss_loaded_mb", False),
+    ("accuracy.detector.precision", True),
+    ("accuracy.detector.recall", True),
+    ("accuracy.alerts.precision", True),
+    ("accuracy.alerts.visit_recall", True),
+]
+
+
+def latency_summary(latencies_ms):
+    """count, p50/p95/max and a histogram over LATENCY_BUCKETS_MS."""
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    counts = np.histogram(values, bins=[0.0] + LATENCY_BUCKETS_MS + [np.inf])[0] if len(values) else []
+    return {
+        "count": int(len(values)),
+        "p50": round(float(np.percentile(values, 50)), 1) if len(values) else None,
+        "p95": round(float(np.percentile(values, 95)), 1) if len(values) else None,
+        "max": round(float(values.max()), 1) if len(values) else None,
+        "histogram": {"le_ms": LATENCY_BUCKETS_MS + ["inf"], "counts": [int(c) for c in counts]},
+    }
+
+
+def ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def load_ground_truth(path, source):
+    """Returns {frame index: N x 4 boxes}; file name keys are resolved against an image folder source."""
+    with open(path, "r") as f:
+        frames = json.load(f)["frames"]
+    names = {os.path.basename(p): i for i, p in enumerate(getattr(source, "paths", []))}
+    ground_truth = {}
+    for key, boxes in frames.items():
+        index = int(key) if str(key).isdigit() else names.get(key)
+        if index is None:
+            print(f"Ground truth frame {key} is not in the source, ignoring it")
+            continue
+        ground_truth[index] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return ground_truth
+
+
+def visits(frame_indexes, gap=VISIT_GAP_FRAMES):
+    """Groups sorted frame indexes into (first, last) runs."""
+    runs = []
+    for index in sorted(frame_indexes):
+        if runs and index - runs[-1][1] <= gap:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+
+def accuracy_report(ground_truth, detections, alerts, iou_threshold):
+    """Detector precision/recall over the frames SSD saw, and alert precision / visit recall."""
+    from detection import match_boxes
+
+    tp = fp = fn = 0
+    for seq, boxes in detections:
+        t, p, n = match_boxes(boxes, ground_truth.get(seq, np.empty((0, 4))), iou_threshold)
+        tp, fp, fn = tp + t, fp + p, fn + n
+    person_frames = [index for index, boxes in ground_truth.items() if len(boxes)]
+    alert_frames = [alert["seq"] for alert in alerts]
+    correct_alerts = sum(1 for seq in alert_frames if len(ground_truth.get(seq, ())))
+    runs = visits(person_frames)
+    alerted = sum(1 for first, last in runs if any(first <= seq <= last for seq in alert_frames))
+    return {
+        "iou_threshold": iou_threshold,
+        "detector": {"frames": len(detections), "true_positives": tp, "false_positives": fp,
+                     "false_negatives": fn, "precision": ratio(tp, tp + fp), "recall": ratio(tp, tp + fn)},
+        "alerts": {"alerts": len(alert_frames), "on_person_frames": correct_alerts,
+                   "precision": ratio(correct_alerts, len(alert_frames)),
+                   "visits": len(runs), "visits_alerted": alerted, "visit_recall": ratio(alerted, len(runs))},
+    }
+
+
+def delivered_at(api):
+    """{file name: [monotonic times]} of the photos the fake Bot API received."""
+    received = {}
+    for timestamp, method, fields in api.calls():
+        if method not in ("sendPhoto", "sendMediaGroup"):
+            continue
+        for value in fields.values():
+            if isinstance(value, str) and value.startswith("<file ") and value.endswith(">"):
+                received.setdefault(value[6:-1], []).append(timestamp)
+    return received
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_until_idle(pipeline, cameras, duration, timeout):
+    """Waits for the sources to end (or duration to pass), then for the pipeline queues to drain."""
+    started = time.monotonic()
+    while any(camera.is_running() for camera in cameras):
+        if duration is not None and time.monotonic() - started >= duration:
+            for camera in cameras:
+                camera.grabber.stop()
+            break
+        time.sleep(0.2)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # Checked twice in a row: an item can be between a queue and the next stage
+        if pipeline.is_idle():
+            time.sleep(0.2)
+            if pipeline.is_idle():
+                return True
+        time.sleep(0.2)
+    print("Pipeline did not drain within the timeout")
+    return False
+
+
+def run_replay(args):
+    # Imported here: importing main imports torch and every pipeline module
+    import main
+    import send_telegram
+    from send_telegram import AsyncTelegramSender, stop_telegram_worker
+    from fake_bot_api import FakeBotAPI
+    from message_log import MessageLog
+    from idle_mode import system_active_event, image_detection_paused
+    from system_stats import telemetry, get_process_rss
+    from event_store import event_store
+    from detection import person_boxes
+    from zones import zone_store
+
+    work_dir = tempfile.mkdtemp(prefix="replay-")
+    api = FakeBotAPI()
+    try:
+        # Mock Telegram backend, and keep message IDs, events and clips out of the real folders
+        url = api.start(port=args.port)
+        send_telegram.sender = AsyncTelegramSender(token="replay", api_url=url).start()
+        send_telegram.message_log = MessageLog(os.path.join(work_dir, "message_ids.log"))
+        event_store.path = os.path.join(work_dir, "events.db")
+        event_store.media_dir = os.path.join(work_dir, "media")
+        # Zones of the replay camera (see ZONES_FILE in zones.py); none unless --zones is given
+        zone_store.path = args.zones or os.path.join(work_dir, "zones.json")
+        zone_store.defaults = {}
+
+        camera = main.Camera(args.name, args.source, loop=False, realtime=not args.fast)
+        if not camera.open():
+            raise SystemExit(f"Can not open {args.source}")
+        cameras = [camera]
+        ground_truth = load_ground_truth(args.ground_truth, camera.cap) if args.ground_truth else None
+
+        # Load and warm up the model first, so the replay measures the steady state
+        rss_idle = get_process_rss()
+        main.detection_engine.load()
+        rss_loaded = get_process_rss()
+
+        telemetry.interval = args.sample_interval
+        telemetry.add_source("capture_fps", lambda: camera.grabber.fps if camera.grabber is not None else None)
+        telemetry.add_source("inference_ms", lambda: main.detection_engine.last_inference_ms)
+        telemetry.add_source("rss_mb", get_process_rss)
+        telemetry.start()
+
+        detections = []
+        alerts = []
+
+        def on_detection(camera, frame, predictions):
+            boxes, _ = person_boxes(predictions)
+            detections.append((frame.seq, boxes))
+
+        def on_alert(alert):
+            alerts.append({"seq": alert["seq"], "filename": alert["filename"], "captured_at": alert["captured_at"],
+                           "motion_at": alert["motion_at"], "alerted_at": time.monotonic()})
+
+        system_active_event.set()
+        image_detection_paused.clear()
+        ssd_calls = main.detection_cascade.ssd_calls
+        inferences = main.detection_engine.inferences
+        candidates = main.frame_selector.candidates
+        main.detection_engine.start()
+        if main.EVENT_STORE_ENABLED:
+            event_store.start_pruning()
+        pipeline, _ = main.build_pipeline(cameras, on_detection=on_detection, on_alert=on_alert)
+        started = time.monotonic()
+        pipeline.start()
+        wait_until_idle(pipeline, cameras, args.duration, args.drain_timeout)
+        elapsed = time.monotonic() - started
+
+        stage_stats = pipeline.stats()
+        frames_grabbed = camera.grabber.frames_grabbed
+        frames_retrieved = camera.grabber.frames_retrieved
+        compressed = camera.grabber.compressed
+        source_fps = camera.cap.get(cv2.CAP_PROP_FPS)
+        pipeline.stop()
+        camera.close()  # Finishes a clip being recorded
+        main.detection_engine.stop()
+        telemetry.stop()
+        if main.EVENT_STORE_ENABLED:
+            event_store.close()
+        stop_telegram_worker()  # Sends everything still queued
+        window = telemetry.window_stats(None)
+
+        received = delivered_at(api)
+        delivery = []
+        for alert in alerts:
+            times = received.get(alert["filename"])
+            if times:
+                delivery.append((times.pop(0) - alert["motion_at"]) * 1000.0)
+        requests = {}
+        for _, method, _ in api.calls():
+            requests[method] = requests.get(method, 0) + 1
+
+        temperatures = [value[2] for name, value in window.items() if name.startswith("temp_")]
+        minutes = elapsed / 60.0
+        report = {
+            "version": REPORT_VERSION,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "host": {"node": platform.node(), "machine": platform.machine(), "cpus": psutil.cpu_count()},
+            "source": {"path": args.source, "fps": round(source_fps, 2), "realtime": not args.fast,
+                       "frames": frames_grabbed},
+            "config": {
+                "motion_resolution": list(main.MOTION_DETECTION_RESOLUTION),
+                "motion_method": main.MOTION_DETECTION_METHOD,
+                "cascade_enabled": main.detection_cascade.enabled,
+                "detector_backend": main.detection_engine.backend_name,
+                "detector_input": list(main.detection_engine.input_size),
+                "max_batch_size": main.detection_engine.max_batch_size,
+                "clip_recording": main.CLIP_RECORDING_ENABLED,
+                "event_store": main.EVENT_STORE_ENABLED,
+                "zones": len(camera.zones.zones),
+                "best_frame": main.BEST_FRAME_ENABLED,
+            },
+            "startup": {
+                "model_load_s": round(main.detection_engine.load_seconds, 2),
+                "warmup_s": round(main.detection_engine.warmup_seconds, 2),
+                "rss_idle_mb": round(rss_idle, 1),
+                "rss_loaded_mb": round(rss_loaded, 1),
+            },
+            "duration_s": round(elapsed, 2),
+            "capture": {
+                "fps_source": round(frames_grabbed / elapsed, 2),
+                "fps_taken": round(stage_stats[f"capture-{camera.name}"]["emitted"] / elapsed, 2),
+                "frames_skipped": camera.skipped_frames,
+                "frames_retrieved": frames_retrieved,
+                "compressed": compressed,
+                "motion_events": stage_stats[f"motion-{camera.name}"]["emitted"],
+            },
+            "detection": {
+                "frames": len(detections),
+                "ssd_calls": main.detection_cascade.ssd_calls - ssd_calls,
+                "ssd_calls_per_minute": round((main.detection_cascade.ssd_calls - ssd_calls) / minutes, 1),
+                "forward_passes": main.detection_engine.inferences - inferences,
+                "motion_ignored_by_zones": camera.zones.motion_ignored,
+                "detections_outside_zones": camera.zones.detections_ignored,
+                "alert_candidates": main.frame_selector.candidates - candidates,
+                "alerts": len(alerts),
+            },
+            "latency": {
+                "capture_to_alert_ms": latency_summary([(a["alerted_at"] - a["captured_at"]) * 1000.0
+                                                        for a in alerts]),
+                "motion_to_alert_ms": latency_summary([(a["alerted_at"] - a["motion_at"]) * 1000.0
+                                                       for a in alerts]),
+                "motion_to_delivery_ms": latency_summary(delivery),
+            },
+            "resources": {
+                "cpu_peak": round(window["cpu"][2], 1) if "cpu" in window else None,
+                "cpu_avg": round(window["cpu"][1], 1) if "cpu" in window else None,
+                "ram_peak": round(window["ram"][2], 1) if "ram" in window else None,
+                # ru_maxrss is in kilobytes on Linux
+                "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+                "temperature_peak": round(max(temperatures), 1) if temperatures else None,
+            },
+            "pipeline": stage_stats,
+            "telegram": {"requests": requests},
+        }
+        if ground_truth is not None:
+            report["accuracy"] = accuracy_report(ground_truth, detections, alerts, args.iou)
+        return report
+    finally:
+        api.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def figure(report, path):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(paths):
+    reports = []
+    for path in paths:
+        with open(path, "r") as f:
+            reports.append(json.load(f))
+    print(f"{'':<36}" + "".join(f"{os.path.basename(p)[:16]:>18}" for p in paths))
+    print(f"{'commit':<36}" + "".join(f"{str(r.get('git_commit')):>18}" for r in reports))
+    for path, higher_is_better in COMPARED_FIGURES:
+        values = [figure(report, path) for report in reports]
+        line = f"{path:<36}" + "".join(f"{'-' if v is None else v:>18}" for v in values)
+        first, last = values[0], values[-1]
+        if isinstance(first, (int, float)) and isinstance(last, (int, float)) and first:
+            change = 100.0 * (last - first) / abs(first)
+            if change:
+                line += f"   {change:+6.1f}% ({'better' if (change > 0) == higher_is_better else 'worse'})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="video file, image folder or 'synthetic'")
+    parser.add_argument("--name", default="replay", help="camera name used in alerts")
+    parser.add_argument("--ground-truth", help="JSON file with the person boxes of each frame")
+    parser.add_argument("--output", help="write the JSON report here (printed otherwise)")
+    parser.add_argument("--fast", action="store_true",
+                        help="read the source as fast as it decodes instead of at its frame rate")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds (needed for 'synthetic')")
+    parser.add_argument("--drain-timeout", type=float, default=60.0,
+                        help="seconds to wait for queued frames and alerts after the source ends")
+    parser.add_argument("--zones", help="zones file for the replay camera, as ZONES_FILE in zones.py")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU for matching boxes to the ground truth")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="telemetry sampling interval (s)")
+    parser.add_argument("--port", type=int, default=8099, help="port of the fake Bot API")
+    parser.add_argument("--compare", nargs="+", metavar="REPORT", help="compare saved reports instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    if not args.source:
+        parser.error("--source is required")
+    report = run_replay(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares full-frame detection with detection on merged motion regions over
+a clip: pixels sent to the detector, detector time and person frames found.
+
+    python3 benchmark_roi.py --clip recording.mp4 --frames 100
+"""
+import argparse
+import time
+import cv2
+from capture_image import open_video_source, detect_motion_regions
+from detection import DetectionEngine, merge_regions
+
+MOTION_DETECTION_RESOLUTION = (320, 240)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=50, help="maximum number of motion frames to check")
+    args = parser.parse_args()
+
+    engine = DetectionEngine()
+    cap = open_video_source(args.clip, realtime=False)
+    previous = None
+    checked = 0
+    full = {'pixels': 0, 'time': 0.0, 'persons': 0}
+    roi = {'pixels': 0, 'time': 0.0, 'persons': 0, 'regions': 0}
+    while checked < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        low_res = cv2.resize(frame, MOTION_DETECTION_RESOLUTION)
+        if previous is None:
+            previous = low_res
+            continue
+        height, width = frame.shape[:2]
+        motion, boxes = detect_motion_regions(previous, low_res, frame_size=(width, height))
+        previous = low_res
+        if not motion:
+            continue
+        checked += 1
+
+        started = time.perf_counter()
+        person, _ = engine.detect(frame)
+        full['time'] += time.perf_counter() - started
+        full['pixels'] += width * height
+        full['persons'] += person
+
+        regions = merge_regions(boxes, (width, height))
+        pixels_before = engine.roi_pixels
+        started = time.perf_counter()
+        person, _ = engine.detect_regions(frame, regions)
+        roi['time'] += time.perf_counter() - started
+        roi['pixels'] += engine.roi_pixels - pixels_before
+        roi['persons'] += person
+        roi['regions'] += len(regions)
+    cap.release()
+
+    if not checked:
+        print("No motion frames found in the clip.")
+        return
+    print(f"{checked} motion frames, {roi['regions'] / checked:.2f} merged regions per frame")
+    for name, result in (("full frame", full), ("motion ROIs", roi)):
+        print(f"{name:<12} pixels/frame {result['pixels'] / checked:10.0f}   "
+              f"detector {1000.0 * result['time'] / checked:8.1f} ms/frame   person frames {result['persons']}")
+    print(f"ROI pixels are {100.0 * roi['pixels'] / full['pixels']:.1f}% of full-frame pixels")
+
+
+if __name__ == "__main__":
+    main()
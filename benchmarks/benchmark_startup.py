@@ -0,0 +1,127 @@
+"""
+Measures startup time, first-detection latency and memory of the detection
+model, loaded at startup as before (eager) vs. loaded lazily with a warm-up
+inference, and the memory freed by unloading it after an idle period.
+
+Every mode runs in a fresh Python process, so imports and first allocations
+are measured as on a real start.
+
+    python3 benchmark_startup.py --clip synthetic
+    python3 benchmark_startup.py --no-pretrained    # random weights, no download
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ["eager", "lazy"]
+
+
+def rss_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def run_child(mode, clip, weights_file):
+    """Runs one mode in this process and prints its figures as one JSON line."""
+    figures = {"rss_start_mb": rss_mb()}
+    started = time.perf_counter()
+    import detection
+    from capture_image import open_video_source
+    figures["import_s"] = time.perf_counter() - started
+    figures["rss_imported_mb"] = rss_mb()
+    if weights_file:
+        detection.SSD_WEIGHTS_FILE = weights_file
+
+    cap = open_video_source(clip, loop=True, realtime=False)
+    frames = [cap.read()[1] for _ in range(3)]
+    cap.release()
+
+    t0 = time.perf_counter()
+    engine = detection.DetectionEngine(device="cpu", lazy=(mode == "lazy"))
+    figures["construct_s"] = time.perf_counter() - t0
+    if mode == "lazy":
+        engine.load()  # What load_async() does on the model-loader thread
+    figures["ready_s"] = time.perf_counter() - started
+    figures["load_s"] = engine.load_seconds
+    figures["warmup_s"] = engine.warmup_seconds
+    figures["rss_loaded_mb"] = rss_mb()
+
+    for i, frame in enumerate(frames[:2]):
+        t0 = time.perf_counter()
+        engine.detect_batch([frame])
+        figures["first_detection_ms" if i == 0 else "second_detection_ms"] = (time.perf_counter() - t0) * 1000.0
+    figures["rss_active_mb"] = rss_mb()
+
+    engine.unload()
+    figures["rss_unloaded_mb"] = rss_mb()
+    t0 = time.perf_counter()
+    engine.load()
+    figures["reload_s"] = time.perf_counter() - t0
+    print(json.dumps(figures))
+
+
+def measure(mode, clip, weights_file):
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--clip", clip]
+    if weights_file:
+        command += ["--weights", weights_file]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_table(results):
+    rows = [
+        ("import torch/torchvision (s)", "import_s"),
+        ("engine constructor (s)", "construct_s"),
+        ("model load (s)", "load_s"),
+        ("warm-up inference (s)", "warmup_s"),
+        ("process start to ready (s)", "ready_s"),
+        ("first detection (ms)", "first_detection_ms"),
+        ("second detection (ms)", "second_detection_ms"),
+        ("RSS after imports (MB)", "rss_imported_mb"),
+        ("RSS model loaded (MB)", "rss_loaded_mb"),
+        ("RSS active (MB)", "rss_active_mb"),
+        ("RSS after unload (MB)", "rss_unloaded_mb"),
+        ("reload from cache (s)", "reload_s"),
+    ]
+    print(f"{'':<30}" + "".join(f"{mode:>12}" for mode in results))
+    for name, key in rows:
+        values = [results[mode].get(key) for mode in results]
+        print(f"{name:<30}" + "".join(f"{'-' if v is None else round(v, 2):>12}" for v in values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clip", default="synthetic", help="video file, camera index or 'synthetic'")
+    parser.add_argument("--weights", default=None, help="weights file (default SSD_WEIGHTS_FILE)")
+    parser.add_argument("--no-pretrained", action="store_true", help="use random weights (no download)")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.clip, args.weights)
+        return
+
+    temp_dir = None
+    weights_file = args.weights
+    try:
+        if args.no_pretrained:
+            # Random weights saved as the cached weights file, so the load path is the real one
+            import torch
+            from torchvision.models.detection import ssd300_vgg16
+            temp_dir = tempfile.mkdtemp(prefix="weights-")
+            weights_file = os.path.join(temp_dir, "ssd300_vgg16.pth")
+            torch.save(ssd300_vgg16(pretrained=False, pretrained_backbone=False).state_dict(), weights_file)
+        results = {mode: measure(mode, args.clip, weights_file) for mode in MODES}
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+    print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+import cv2
+import numpy as np
+from detection import person_boxes
+
+# After a new person is found, the detections of the next BEST_FRAME_WINDOW seconds
+# (at most BEST_FRAME_MAX_CANDIDATES frames) are scored and only the best frame is
+# annotated, encoded and sent; 0 sends the first frame at once, as before
+BEST_FRAME_WINDOW = 1.5
+BEST_FRAME_MAX_CANDIDATES = 6
+
+# Weights of the confidence, size and sharpness scores (each 0..1) in a frame's score
+SCORE_WEIGHTS = (0.4, 0.3, 0.3)
+# A person box covering this fraction of the frame gets the full size score
+FULL_SIZE_FRACTION = 0.15
+# Variance of the Laplacian of a box crop (scaled to SHARPNESS_CROP_HEIGHT pixels high)
+# that gets the full sharpness score; motion blur brings it down to a few tens
+SHARPNESS_REFERENCE = 300.0
+SHARPNESS_CROP_HEIGHT = 128
+# Boxes touching the frame border show only part of the person: their score is scaled by this
+EDGE_PENALTY = 0.7
+EDGE_MARGIN = 0.01  # Fraction of the frame size that counts as touching the border
+
+
+def sharpness(image, box):
+    """Variance of the Laplacian of the box crop, scaled to SHARPNESS_CROP_HEIGHT pixels high."""
+    x1, y1, x2, y2 = (int(round(value)) for value in box)
+    height, width = image.shape[:2]
+    crop = image[max(y1, 0):min(y2, height), max(x1, 0):min(x2, width)]
+    if crop.shape[0] < 3 or crop.shape[1] < 3:
+        return 0.0
+    # The same scale for every crop, so small and large boxes compare
+    scale = SHARPNESS_CROP_HEIGHT / crop.shape[0]
+    if scale < 1.0:
+        crop = cv2.resize(crop, (max(int(crop.shape[1] * scale), 3), SHARPNESS_CROP_HEIGHT),
+                          interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return float(std[0, 0]) ** 2
+
+
+def score_boxes(image, boxes, scores):
+    """
+    Scores person boxes (N x 4, frame pixels) for alert quality: a weighted sum
+    of confidence, box size and sharpness, lowered for boxes cut off by the border.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    height, width = image.shape[:2]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    size = np.minimum(areas / (width * height * FULL_SIZE_FRACTION), 1.0)
+    sharp = np.minimum(np.array([sharpness(image, box) for box in boxes]) / SHARPNESS_REFERENCE, 1.0)
+    confidence_weight, size_weight, sharpness_weight = SCORE_WEIGHTS
+    total = confidence_weight * np.asarray(scores) + size_weight * size + sharpness_weight * sharp
+    margin_x, margin_y = EDGE_MARGIN * width, EDGE_MARGIN * height
+    at_edge = ((boxes[:, 0] <= margin_x) | (boxes[:, 1] <= margin_y)
+               | (boxes[:, 2] >= width - margin_x) | (boxes[:, 3] >= height - margin_y))
+    return np.where(at_edge, total * EDGE_PENALTY, total)
+
+
+class BestFrameSelector:
+    """
+    Picks the alert frame of each camera from a short window of detections.
+
+    A detection with new tracks opens a window for its camera; offer() scores
+    every detection of that camera until the window closes, keeping only the
+    best one (so at most one frame per camera is held). pop_due() returns the
+    best event of a closed window, carrying the new tracks of all its frames,
+    so several people entering within the window give one alert.
+    """
+
+    def __init__(self, window=BEST_FRAME_WINDOW, max_candidates=BEST_FRAME_MAX_CANDIDATES,
+                 confidence_threshold=0.5):
+        self.window = window
+        self.max_candidates = max_candidates
+        self.confidence_threshold = confidence_threshold
+        self._windows = {}  # camera name -> open window
+        self._lock = threading.Lock()
+        self.windows_closed = 0
+        self.candidates = 0
+        self.best_not_first = 0
+        self.scoring_ms = 0.0
+
+    def collecting(self, key):
+        """True while a window is open for the camera (its detections are candidates)."""
+        return key in self._windows
+
+    def pending(self):
+        return bool(self._windows)
+
+    def offer(self, key, event, now=None):
+        """Scores a detection event ('frame', 'detections', 'new_tracks') of camera key."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if not event['new_tracks']:
+                    return
+                window = self._windows[key] = {'opened_at': now, 'motion_at': event.get('motion_at'),
+                                               'tracks': [], 'candidates': 0, 'best': None, 'best_score': -1.0}
+        boxes, scores = person_boxes(event['detections'], self.confidence_threshold)
+        started = time.perf_counter()
+        score = float(score_boxes(event['frame'].image, boxes, scores).max()) if len(boxes) else 0.0
+        scoring_ms = (time.perf_counter() - started) * 1000.0
+        with self._lock:
+            self.scoring_ms += scoring_ms
+            self.candidates += 1
+            window['candidates'] += 1
+            window['tracks'].extend(event['new_tracks'])
+            if score > window['best_score']:
+                window['best'], window['best_score'] = event, score
+                window['best_index'] = window['candidates']
+
+    def pop_due(self, now=None):
+        """The best event of a window that has closed, or None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key, window in self._windows.items():
+                if now - window['opened_at'] >= self.window or window['candidates'] >= self.max_candidates:
+                    del self._windows[key]
+                    break
+            else:
+                return None
+            self.windows_closed += 1
+            if window['best_index'] > 1:
+                self.best_not_first += 1
+        event = window['best']
+        event['new_tracks'] = window['tracks']
+        event['motion_at'] = window['motion_at']  # Latency counts from the motion that opened the window
+        event['candidates'] = window['candidates']
+        event['frame_score'] = window['best_score']
+        return event
+
+    def format_stats(self):
+        scoring = self.scoring_ms / self.candidates if self.candidates else 0.0
+        return (f"best frame: {self.windows_closed} alerts from {self.candidates} candidate frames, "
+                f"best frame not the first in {self.best_not_first}, scoring avg {scoring:.1f} ms")
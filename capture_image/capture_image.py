@@ -1,16 +1,582 @@
 import cv2
 import time
 import os
+import logging
+import threading
+import queue
+from collections import namedtuple
+import numpy as np
 
-def initialize_camera():
+logger = logging.getLogger(__name__)
+
+# Index of the Logitech camera; also accepts a video file path or "synthetic"
+CAMERA_SOURCE = 1
+
+# Capture mode requested from USB cameras: pixel format, resolution and frame rate
+# (None keeps the driver default). MJPG lets the camera compress on board; raw YUYV
+# at 640x480 already fills most of a USB 2 link at 30 FPS
+CAPTURE_FOURCC = "MJPG"
+CAPTURE_RESOLUTION = (640, 480)
+CAPTURE_FPS = 30
+
+# Keep MJPEG frames compressed as they come from the camera (or an MJPEG file):
+# skipped frames are never decoded, motion detection decodes a reduced-size
+# grayscale image (JPEG DCT scaling) and only frames that are used in full, e.g.
+# for person detection, are decoded at full resolution
+CAPTURE_COMPRESSED = True
+
+# Number of frames kept by the background grabber
+FRAME_BUFFER_SIZE = 8
+
+# Image folders are played back as a video at this rate
+IMAGE_DIRECTORY_FPS = 10.0
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Where main() below saves the frames with motion
+MOTION_IMAGES_DIR = "motion_detected"
+
+# Changed areas smaller than this (in motion-resolution pixels) are ignored
+MIN_MOTION_REGION_AREA = 20
+MOTION_DILATE_KERNEL = np.ones((5, 5), dtype=np.uint8)
+
+# Value of a motion weight map (see MotionDetector zones) for a pixel that counts once
+MOTION_WEIGHT_UNIT = 16
+
+# JPEG decode flags by scale denominator: libjpeg scales the DCT blocks down while
+# decoding, which costs a fraction of a full decode followed by cv2.resize
+JPEG_REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Capture mode in effect on a camera
+CaptureMode = namedtuple("CaptureMode", ["fourcc", "width", "height", "fps"])
+
+
+def is_jpeg(data):
+    """True if data is a frame left compressed by the backend: one row of JPEG bytes."""
+    return (data is not None and data.dtype == np.uint8 and (data.ndim == 1 or data.shape[0] == 1)
+            and data.size > 2 and data.flat[0] == 0xFF and data.flat[1] == 0xD8)
+
+
+def decode_reduced(jpeg, frame_size, size):
+    """
+    Decodes a JPEG frame of frame_size (width, height) to grayscale at the
+    smallest DCT scale (1/2, 1/4 or 1/8) that is still at least size.
+    """
+    scale = 1
+    while (scale * 2 in JPEG_REDUCED_GRAYSCALE and frame_size[0] // (scale * 2) >= size[0]
+           and frame_size[1] // (scale * 2) >= size[1]):
+        scale *= 2
+    return cv2.imdecode(jpeg, JPEG_REDUCED_GRAYSCALE[scale])
+
+
+class Frame:
+    """
+    A captured frame with its sequence number, capture time and size (width, height).
+
+    Frames of a compressed source keep the JPEG data and decode the full image
+    on the first use of .image; preview() decodes a small grayscale image
+    straight from the JPEG data for motion detection.
+    """
+
+    __slots__ = ("seq", "timestamp", "size", "jpeg", "_image")
+
+    def __init__(self, seq, timestamp, image=None, jpeg=None, size=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.jpeg = jpeg
+        self._image = image
+        self.size = size if size is not None else image.shape[1::-1]
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = cv2.imdecode(self.jpeg, cv2.IMREAD_COLOR)
+        return self._image
+
+    def preview(self, size):
+        """An image of at least size (width, height) for motion detection: reduced gray or the full frame."""
+        if self._image is not None or self.jpeg is None:
+            return self.image
+        return decode_reduced(self.jpeg, self.size, size)
+
+
+class SyntheticVideoSource:
+    """
+    Camera stand-in that renders a gray background with a moving block.
+    Exposes the subset of the cv2.VideoCapture API used by this project.
+    """
+
+    def __init__(self, width=640, height=480, fps=30.0, num_frames=None, realtime=True):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.num_frames = num_frames
+        self.realtime = realtime
+        self._index = 0
+        self._next_time = time.monotonic()
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        if not self._opened:
+            return False
+        if self.num_frames is not None and self._index >= self.num_frames:
+            return False
+        if self.realtime:
+            # Pace the frames like a real camera would
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time + 1.0 / self.fps, time.monotonic() - 1.0 / self.fps)
+        self._index += 1
+        return True
+
+    def retrieve(self, image=None):
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        image[:] = 64
+        size = self.height // 4
+        x = (self._index * 4) % max(self.width - size, 1)
+        y = (self.height - size) // 2
+        image[y:y + size, x:x + size] = 200
+        return True, image
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._index)
+        return 0.0
+
+    def set(self, prop_id, value):
+        return False
+
+    def release(self):
+        self._opened = False
+
+
+def fourcc_to_str(value):
+    value = int(value)
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip("\0")
+
+
+def negotiate_capture_mode(cap, fourcc=CAPTURE_FOURCC, resolution=CAPTURE_RESOLUTION, fps=CAPTURE_FPS):
+    """
+    Requests a capture mode from a camera and returns the CaptureMode in effect.
+    V4L2 picks the frame sizes of the pixel format and the frame rates of the
+    size, so they are set in that order. A camera that lacks the mode falls
+    back to the nearest one it has; that is printed.
+    """
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    if resolution:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+    if fps:
+        cap.set(cv2.CAP_PROP_FPS, fps)
+    mode = CaptureMode(fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                       int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.get(cv2.CAP_PROP_FPS))
+    if ((fourcc and mode.fourcc != fourcc) or (resolution and (mode.width, mode.height) != tuple(resolution))
+            or (fps and abs(mode.fps - fps) > 0.5)):
+        logger.warning("Camera does not offer %s %s at %s FPS, using %s %dx%d at %.0f FPS",
+                       fourcc, resolution, fps, mode.fourcc, mode.width, mode.height, mode.fps)
+    return mode
+
+
+class CameraSource:
+    """
+    USB camera opened in the capture mode given by CAPTURE_* (see
+    negotiate_capture_mode()). With compressed=True and an MJPEG mode,
+    retrieve() returns the frame's JPEG data as the camera sent it, without
+    decoding it, if the backend supports that (V4L2 does).
+    """
+
+    def __init__(self, index, fourcc=CAPTURE_FOURCC, resolution=CAPTURE_RESOLUTION, fps=CAPTURE_FPS,
+                 compressed=False):
+        self.index = index
+        self._cap = cv2.VideoCapture(index)
+        self.mode = None
+        self.compressed = False
+        if not self._cap.isOpened():
+            return
+        self.mode = negotiate_capture_mode(self._cap, fourcc, resolution, fps)
+        if compressed and self.mode.fourcc == "MJPG" and self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            ret, data = self._cap.read()
+            self.compressed = ret and is_jpeg(data)
+            if not self.compressed:
+                self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def grab(self):
+        return self._cap.grab()
+
+    def retrieve(self, image=None):
+        if self.compressed:
+            return self._cap.retrieve()  # A new array per frame: the JPEG size varies
+        return self._cap.retrieve(image)
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop_id):
+        return self._cap.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self._cap.set(prop_id, value)
+
+    def release(self):
+        self._cap.release()
+
+
+class VideoFileSource:
+    """
+    Plays a video file like a live camera: frames are paced to the file's
+    FPS and playback optionally restarts from the beginning at the end.
+    With compressed=True an MJPEG file hands over the JPEG data of every
+    frame undecoded, like a USB camera in MJPEG mode (see CameraSource).
+    """
+
+    def __init__(self, path, loop=False, realtime=True, compressed=False):
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime
+        self._cap = cv2.VideoCapture(path)
+        fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 30.0
+        self._next_time = time.monotonic()
+        self.compressed = False
+        if compressed and fourcc_to_str(self._cap.get(cv2.CAP_PROP_FOURCC)) == "MJPG":
+            # FFmpeg returns the demuxed packets, which for MJPEG are JPEG images
+            self.compressed = self._cap.set(cv2.CAP_PROP_FORMAT, -1)
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def grab(self):
+        if self.realtime:
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time + 1.0 / self.fps, time.monotonic() - 1.0 / self.fps)
+        if self._cap.grab():
+            return True
+        if not self.loop:
+            return False
+        # Rewind to the first frame and try again
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self._cap.grab()
+
+    def retrieve(self, image=None):
+        if self.compressed:
+            return self._cap.retrieve()
+        return self._cap.retrieve(image)
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop_id):
+        return self._cap.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self._cap.set(prop_id, value)
+
+    def release(self):
+        self._cap.release()
+
+
+class ImageDirectorySource:
+    """
+    Plays the images of a folder, in file name order, like a live camera at
+    IMAGE_DIRECTORY_FPS. Images are resized to the size of the first one.
+    """
+
+    def __init__(self, path, fps=IMAGE_DIRECTORY_FPS, loop=False, realtime=True):
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.realtime = realtime
+        self.paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        first = cv2.imread(self.paths[0]) if self.paths else None
+        self.size = first.shape[1::-1] if first is not None else None
+        self._index = -1
+        self._next_time = time.monotonic()
+
+    def isOpened(self):
+        return self.size is not None
+
+    def grab(self):
+        if self.realtime:
+            delay = self._next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time = max(self._next_time + 1.0 / self.fps, time.monotonic() - 1.0 / self.fps)
+        if self._index + 1 >= len(self.paths):
+            if not self.loop or not self.paths:
+                return False
+            self._index = -1
+        self._index += 1
+        return True
+
+    def retrieve(self, image=None):
+        frame = cv2.imread(self.paths[self._index])
+        if frame is None:
+            return False, None
+        if frame.shape[1::-1] != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH and self.size:
+            return float(self.size[0])
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT and self.size:
+            return float(self.size[1])
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._index + 1)
+        return 0.0
+
+    def set(self, prop_id, value):
+        return False
+
+    def release(self):
+        self.paths = []
+
+
+def open_video_source(source, loop=False, realtime=True, compressed=False):
+    """
+    Opens a frame source. Integers are camera indexes (opened in the CAPTURE_*
+    mode), "synthetic" gives a generated test pattern, a folder is played back
+    as a sequence of images and anything else is treated as a file path or
+    stream URL. With compressed=True, cameras in MJPEG mode and MJPEG files
+    return JPEG data from read() (their `compressed` attribute is then True);
+    only FrameGrabber should ask for that.
+    """
+    if isinstance(source, int):
+        return CameraSource(source, compressed=compressed)
+    if isinstance(source, str) and source.isdigit():
+        return CameraSource(int(source), compressed=compressed)
+    if source == "synthetic":
+        return SyntheticVideoSource(realtime=realtime)
+    if isinstance(source, str) and "://" in source:
+        return cv2.VideoCapture(source)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, loop=loop, realtime=realtime)
+    return VideoFileSource(source, loop=loop, realtime=realtime, compressed=compressed)
+
+
+def initialize_camera(source=CAMERA_SOURCE):
     
     #this is for initializing the camera we must use 1 for the logitech camera
-    cap=cv2.VideoCapture(1)
+    cap = open_video_source(source)
     if not cap.isOpened():
         print("Can not open the Camera")
         exit()
     return cap
 
+
+class FrameRingBuffer:
+    """
+    Fixed-size ring of preallocated frames with capture timestamps.
+    A single writer pushes frames; any number of readers can take the
+    latest frame or every frame captured after a given time.
+
+    With compressed=True the ring keeps the JPEG data of every frame instead
+    (of any size) and hands out Frames that decode it on demand.
+    """
+
+    def __init__(self, capacity, frame_shape, dtype=np.uint8, compressed=False):
+        self.capacity = capacity
+        self.compressed = compressed
+        self._shape = tuple(frame_shape)
+        self._size = self._shape[1::-1]
+        self._frames = [None] * capacity if compressed else np.empty((capacity,) + tuple(frame_shape), dtype=dtype)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._seqs = np.full(capacity, -1, dtype=np.int64)
+        self._next_seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def frame_shape(self):
+        return self._shape
+
+    def push(self, image, timestamp=None):
+        """Copies a frame (its JPEG data if compressed) into the next slot and returns its sequence number."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.compressed:
+            image = image.copy()  # Frames handed out keep the data, so it is never overwritten
+        with self._cond:
+            seq = self._next_seq
+            slot = seq % self.capacity
+            if self.compressed:
+                self._frames[slot] = image
+            else:
+                np.copyto(self._frames[slot], image)
+            self._timestamps[slot] = timestamp
+            self._seqs[slot] = seq
+            self._next_seq = seq + 1
+            self._cond.notify_all()
+        return seq
+
+    def _frame_at(self, slot, copy):
+        if self.compressed:
+            return Frame(int(self._seqs[slot]), float(self._timestamps[slot]), jpeg=self._frames[slot],
+                         size=self._size)
+        image = self._frames[slot].copy() if copy else self._frames[slot]
+        return Frame(int(self._seqs[slot]), float(self._timestamps[slot]), image)
+
+    def latest(self, copy=True):
+        """Returns the most recent Frame, or None if nothing was pushed yet."""
+        with self._cond:
+            if self._next_seq == 0:
+                return None
+            return self._frame_at((self._next_seq - 1) % self.capacity, copy)
+
+    def wait_for_frame(self, after_seq=-1, timeout=None):
+        """Blocks until a frame newer than after_seq exists and returns the latest one."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._next_seq - 1 > after_seq, timeout):
+                return None
+            return self._frame_at((self._next_seq - 1) % self.capacity, True)
+
+    def drain_since(self, since):
+        """Returns copies of all buffered frames captured after `since`, oldest first."""
+        with self._cond:
+            first = max(self._next_seq - self.capacity, 0)
+            frames = []
+            for seq in range(first, self._next_seq):
+                slot = seq % self.capacity
+                if self._timestamps[slot] > since:
+                    frames.append(self._frame_at(slot, True))
+            return frames
+
+
+class FrameGrabber:
+    """
+    Background thread that reads frames from a capture source as fast as
+    the source delivers them and pushes them into a FrameRingBuffer, so
+    slow consumers never stall the camera.
+
+    Every frame is grabbed, which keeps the camera's queue short, but frames
+    beyond decode_fps per second are not retrieved: their pixels are never
+    decoded or copied. None retrieves every frame. A compressed source (see
+    open_video_source()) fills a compressed ring buffer.
+    """
+
+    def __init__(self, cap, buffer_size=FRAME_BUFFER_SIZE, decode_fps=None):
+        self.cap = cap
+        self.compressed = getattr(cap, "compressed", False)
+        ret, first_frame = cap.read()
+        if not ret:
+            raise RuntimeError("Failed to grab the initial frame")
+        image = cv2.imdecode(first_frame, cv2.IMREAD_COLOR) if self.compressed else first_frame
+        if image is None:
+            raise RuntimeError("Failed to decode the initial frame")
+        self.frame_size = image.shape[1::-1]
+        self.buffer = FrameRingBuffer(buffer_size, image.shape, image.dtype, compressed=self.compressed)
+        self.buffer.push(first_frame)
+        self._scratch = None if self.compressed else first_frame
+        self.decode_fps = decode_fps
+        self._next_retrieve = 0.0
+        self.failed = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.frames_grabbed = 1
+        self.frames_retrieved = 1
+        self._started_at = time.monotonic()
+
+    def start(self):
+        self._stop_event.clear()
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.cap.grab():
+                logger.error("Frame grabber: failed to grab frame")
+                self.failed.set()
+                break
+            self.frames_grabbed += 1
+            now = time.monotonic()
+            decode_fps = self.decode_fps
+            if decode_fps:
+                if now < self._next_retrieve:
+                    continue  # Skipped: the consumers do not take frames this fast
+                self._next_retrieve = max(self._next_retrieve + 1.0 / decode_fps, now)
+            ret, frame = self.cap.retrieve(self._scratch)
+            if not ret:
+                logger.error("Frame grabber: failed to retrieve frame")
+                self.failed.set()
+                break
+            if not self.compressed:
+                self._scratch = frame
+            self.buffer.push(frame, now)
+            self.frames_retrieved += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def fps(self):
+        """Average capture rate since start()."""
+        elapsed = time.monotonic() - self._started_at
+        return self.frames_grabbed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def retrieved_fraction(self):
+        """Share of the grabbed frames that were retrieved into the ring buffer."""
+        return self.frames_retrieved / self.frames_grabbed
+
+    def latest(self, copy=True):
+        return self.buffer.latest(copy)
+
+    def wait_for_frame(self, after_seq=-1, timeout=None):
+        return self.buffer.wait_for_frame(after_seq, timeout)
+
+    def drain_since(self, since):
+        return self.buffer.drain_since(since)
+
 def capture_image(cap, save_path):
     ret, frame = cap.read()
     if not ret:
@@ -22,7 +588,62 @@ def capture_image(cap, save_path):
     print(f"Image saved at {save_path}")
     return frame
 
-def detect_motion(previous_frame, current_frame, threshold=25):
+def encode_jpeg(image, quality=90, max_width=None):
+    """
+    Encodes a frame to JPEG bytes in memory, first downscaling it to
+    max_width if it is wider. Returns None if encoding fails.
+    """
+    height, width = image.shape[:2]
+    if max_width is not None and width > max_width:
+        image = cv2.resize(image, (max_width, int(height * max_width / width)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        return None
+    return buffer.tobytes()
+
+
+class ImageWriter:
+    """
+    Optional asynchronous disk sink: a background thread writes already
+    encoded image bytes to files, so saving never delays the caller.
+    """
+
+    def __init__(self, max_pending=32):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+        self._thread.start()
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, path, data):
+        """Queues data to be written to path; drops it if the disk cannot keep up."""
+        try:
+            self._queue.put_nowait((path, data))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Image writer is busy, not saving %s", path)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, data = item
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+                self.written += 1
+            except OSError as e:
+                logger.error("Failed to save image %s: %s", path, e)
+
+    def stop(self):
+        """Writes what is still queued, then stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def motion_mask(previous_frame, current_frame, threshold=25):
 
     #convert frames to grayscales
     prev_gray= cv2.cvtColor(previous_frame, cv2.COLOR_BGR2GRAY)
@@ -33,12 +654,168 @@ def detect_motion(previous_frame, current_frame, threshold=25):
 
     #Apply thresholding to get the regions with significant differences
     _,thresh= cv2.threshold(frame_diff, threshold, 255, cv2.THRESH_BINARY)
+    return thresh
+
+def detect_motion(previous_frame, current_frame, threshold=25):
+
+    thresh = motion_mask(previous_frame, current_frame, threshold)
 
     ##calculate the number of non-zero pixels (changes)
     non_zero_count= cv2.countNonZero(thresh)
     return non_zero_count > 500 # we need to adjust this value according to the environment
 
 
+def mask_regions(thresh, frame_size=None, min_region_area=MIN_MOTION_REGION_AREA):
+    """
+    Bounding boxes (x1, y1, x2, y2) of the connected changed areas in a motion
+    mask, scaled from the mask resolution to frame_size (width, height).
+    """
+    # Join nearby fragments of the same moving object before labelling
+    joined = cv2.dilate(thresh, MOTION_DILATE_KERNEL, iterations=2)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(joined, connectivity=8)
+    stats = stats[1:]  # Label 0 is the background
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= min_region_area]
+    boxes = np.empty((len(stats), 4), dtype=np.float32)
+    boxes[:, 0] = stats[:, cv2.CC_STAT_LEFT]
+    boxes[:, 1] = stats[:, cv2.CC_STAT_TOP]
+    boxes[:, 2] = stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]
+    boxes[:, 3] = stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]
+    if frame_size is not None:
+        mask_height, mask_width = thresh.shape[:2]
+        width, height = frame_size
+        boxes *= np.array([width / mask_width, height / mask_height,
+                           width / mask_width, height / mask_height], dtype=np.float32)
+    return boxes
+
+
+def detect_motion_regions(previous_frame, current_frame, threshold=25, frame_size=None,
+                          min_region_area=MIN_MOTION_REGION_AREA):
+    """
+    Like detect_motion(), but also returns where the motion happened:
+    (motion_detected, boxes) with boxes scaled to frame_size (width, height).
+    """
+    thresh = motion_mask(previous_frame, current_frame, threshold)
+    if cv2.countNonZero(thresh) <= 500:
+        return False, np.empty((0, 4), dtype=np.float32)
+    return True, mask_regions(thresh, frame_size, min_region_area)
+
+
+class MotionDetector:
+    """
+    Background-model motion detector.
+
+    "running_average" keeps an exponential running average of the gray
+    frames as background, updated in place with accumulateWeighted. All
+    intermediate images are preallocated, so a frame costs no allocations.
+    "mog2" and "knn" use OpenCV's background subtractors instead.
+    Thresholds are given as a fraction of the frame so they follow the
+    motion resolution.
+
+    zones (see zones.CameraZones) restricts motion to the watched area:
+    zones.masks(resolution) gives a 0/255 mask that is ANDed into the motion
+    mask and a weight map (MOTION_WEIGHT_UNIT per unit of sensitivity) for
+    the changed-pixel count. The lighting check runs before, on the whole frame.
+    """
+
+    METHODS = ("running_average", "mog2", "knn")
+
+    def __init__(self, resolution=(320, 240), method="running_average", threshold=25,
+                 learning_rate=0.05, min_changed_fraction=500 / (320 * 240),
+                 lighting_change_fraction=0.6, zones=None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown motion detection method: {method}")
+        self.resolution = resolution
+        self.method = method
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        self.zones = zones
+        width, height = resolution
+        self.min_changed_pixels = max(int(min_changed_fraction * width * height), 1)
+        self.lighting_change_pixels = int(lighting_change_fraction * width * height)
+        # Scale the minimum region area like the pixel threshold
+        self.min_region_area = max(int(MIN_MOTION_REGION_AREA * width * height / (320 * 240)), 1)
+
+        self._small = np.empty((height, width, 3), dtype=np.uint8)
+        self._gray = np.empty((height, width), dtype=np.uint8)
+        self._background = np.empty((height, width), dtype=np.float32)
+        self._background_u8 = np.empty((height, width), dtype=np.uint8)
+        self._diff = np.empty((height, width), dtype=np.uint8)
+        self._mask = np.empty((height, width), dtype=np.uint8)
+        self._weighted = np.empty((height, width), dtype=np.uint8)
+        self._initialized = False
+        self.last_changed_pixels = 0
+
+        if method == "mog2":
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(varThreshold=threshold, detectShadows=False)
+        elif method == "knn":
+            self._subtractor = cv2.createBackgroundSubtractorKNN(detectShadows=False)
+        else:
+            self._subtractor = None
+
+    def reset(self):
+        """Forget the background, e.g. after the camera was paused."""
+        self._initialized = False
+
+    def _prepare(self, frame):
+        resize = frame.shape[1::-1] != tuple(self.resolution)
+        if frame.ndim == 3:
+            if resize:
+                cv2.resize(frame, tuple(self.resolution), dst=self._small, interpolation=cv2.INTER_AREA)
+                frame = self._small
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        elif resize:
+            # Gray frames, e.g. Frame.preview() of a compressed frame
+            cv2.resize(frame, tuple(self.resolution), dst=self._gray, interpolation=cv2.INTER_AREA)
+        else:
+            np.copyto(self._gray, frame)
+
+    def update(self, frame):
+        """Feeds a frame (any size, BGR or gray); returns the motion mask at the motion resolution."""
+        self._prepare(frame)
+        if self._subtractor is not None:
+            self._subtractor.apply(self._gray, self._mask, self.learning_rate)
+        elif not self._initialized:
+            np.copyto(self._background, self._gray)
+            self._initialized = True
+            self._mask[:] = 0
+        else:
+            # Compare against the background before it absorbs the current frame
+            cv2.convertScaleAbs(self._background, dst=self._background_u8)
+            cv2.absdiff(self._gray, self._background_u8, dst=self._diff)
+            cv2.threshold(self._diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self._mask)
+            cv2.accumulateWeighted(self._gray, self._background, self.learning_rate)
+
+        self.last_changed_pixels = cv2.countNonZero(self._mask)
+        if self.last_changed_pixels >= self.lighting_change_pixels and self._subtractor is None:
+            # Most of the frame changed at once: a light was switched, not a person moving
+            np.copyto(self._background, self._gray)
+            self._mask[:] = 0
+            self.last_changed_pixels = 0
+        masks = self.zones.masks(self.resolution) if self.zones is not None else None
+        if masks is not None and self.last_changed_pixels:
+            watched, weights = masks
+            moved = self.last_changed_pixels > self.min_changed_pixels
+            cv2.bitwise_and(self._mask, watched, dst=self._mask)
+            cv2.bitwise_and(self._mask, weights, dst=self._weighted)
+            self.last_changed_pixels = int(cv2.sumElems(self._weighted)[0]) // MOTION_WEIGHT_UNIT
+            if moved and self.last_changed_pixels <= self.min_changed_pixels:
+                self.zones.motion_ignored += 1
+        return self._mask
+
+    def detect(self, frame):
+        """True if the frame differs enough from the background."""
+        self.update(frame)
+        return self.last_changed_pixels > self.min_changed_pixels
+
+    def detect_regions(self, frame, frame_size=None):
+        """Like detect_motion_regions(): (motion_detected, boxes scaled to frame_size)."""
+        if frame_size is None:
+            frame_size = frame.shape[1::-1]
+        if not self.detect(frame):
+            return False, np.empty((0, 4), dtype=np.float32)
+        return True, mask_regions(self._mask, frame_size, self.min_region_area)
+
+
 def main():
     cap = initialize_camera()
     time.sleep(1) #Allow camera to warm up
@@ -59,7 +836,7 @@ def main():
 
             if detect_motion(previous_frame,current_frame):
                 timestamp = time.strftime("%Y%m%d--%H%M%S")
-                save_path = os.path.join("/home/pta/pyProject/Camera Control Security/Motion Detected", f"image_{timestamp}.jpg")
+                save_path = os.path.join(MOTION_IMAGES_DIR, f"image_{timestamp}.jpg")
 
                 #ensure the directory exists
                 os.makedirs(os.path.dirname(save_path), exist_ok = True)
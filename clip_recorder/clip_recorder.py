@@ -0,0 +1,221 @@
+import os
+import itertools
+import logging
+import time
+import queue
+import tempfile
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from capture_image import encode_jpeg
+
+logger = logging.getLogger(__name__)
+
+# Seconds of video kept before the trigger, and recorded after it
+CLIP_PRE_SECONDS = 5.0
+CLIP_POST_SECONDS = 10.0
+# New triggers during a recording extend it, up to this total length (seconds)
+CLIP_MAX_SECONDS = 60.0
+
+# Clip frames are sampled at this rate, downscaled to CLIP_MAX_WIDTH and kept
+# as JPEG, which caps the memory used by the rolling buffer
+CLIP_FPS = 10.0
+CLIP_MAX_WIDTH = 640
+CLIP_JPEG_QUALITY = 75
+
+# Codecs tried in order for the MP4 files: H.264 (avc1) plays inline in the
+# Telegram clients; mp4v is the fallback for OpenCV builds without an H.264 encoder
+CLIP_FOURCCS = ("avc1", "mp4v")
+# Folder for the MP4 files; clips are deleted once handed to on_clip unless KEEP_CLIPS is set
+CLIP_DIR = tempfile.gettempdir()
+KEEP_CLIPS = False
+
+# Numbers the clips of this process, so file names are unique across cameras and events
+_clip_numbers = itertools.count(1)
+# The first of CLIP_FOURCCS the OpenCV build could open a writer with (found on the first clip)
+_clip_fourcc = None
+
+
+def open_clip_writer(path, fps, size):
+    """cv2.VideoWriter with the first codec of CLIP_FOURCCS that works, or None."""
+    global _clip_fourcc
+    for fourcc in ([_clip_fourcc] if _clip_fourcc else CLIP_FOURCCS):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            if _clip_fourcc is None and fourcc != CLIP_FOURCCS[0]:
+                logger.warning("OpenCV can not encode %s clips; using %s, which Telegram may not play inline",
+                               CLIP_FOURCCS[0], fourcc)
+            _clip_fourcc = fourcc
+            return writer
+        writer.release()
+    return None
+
+
+class ClipRecorder:
+    """
+    Rolling pre-event buffer and post-event recorder for one camera.
+
+    A sampler thread takes the latest frame from a FrameGrabber CLIP_FPS
+    times a second, encodes it to JPEG and keeps the last pre_seconds of
+    frames. trigger() starts a clip from that pre-roll; once post_seconds of
+    frames have followed, a writer thread muxes the clip into an MP4 with
+    cv2.VideoWriter and calls on_clip(path, caption). Kept clips are also
+    reported to on_saved(path, event_ids) with the event IDs passed to the
+    triggers they cover. Capture and the pipeline never wait on either thread.
+    """
+
+    def __init__(self, grabber, name="camera", on_clip=None, active=None, on_saved=None, keep_clips=KEEP_CLIPS,
+                 pre_seconds=CLIP_PRE_SECONDS, post_seconds=CLIP_POST_SECONDS, max_seconds=CLIP_MAX_SECONDS,
+                 fps=CLIP_FPS, max_width=CLIP_MAX_WIDTH, quality=CLIP_JPEG_QUALITY, clip_dir=CLIP_DIR):
+        self.grabber = grabber
+        self.name = name
+        self.on_clip = on_clip
+        self.active = active
+        self.on_saved = on_saved
+        self.keep_clips = keep_clips
+        self.post_seconds = post_seconds
+        self.max_seconds = max_seconds
+        self.fps = fps
+        self.max_width = max_width
+        self.quality = quality
+        self.clip_dir = clip_dir
+        self._buffer = deque(maxlen=max(1, int(round(pre_seconds * fps))))  # (timestamp, jpeg)
+        self._recording = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._clips = queue.Queue(maxsize=2)
+        self._sampler = threading.Thread(target=self._sample, name=f"clip-sampler-{name}", daemon=True)
+        self._writer = threading.Thread(target=self._write, name=f"clip-writer-{name}", daemon=True)
+        self.clips_written = 0
+        self.clips_dropped = 0
+
+    def start(self):
+        self._sampler.start()
+        self._writer.start()
+        return self
+
+    def stop(self):
+        """Stops sampling; a clip being recorded is finished with the frames it has."""
+        self._stop_event.set()
+        self._sampler.join()
+        with self._lock:
+            if self._recording is not None:
+                self._finish()
+        self._clips.put(None)
+        self._writer.join()
+
+    def trigger(self, timestamp, caption=None, event_id=None):
+        """Starts a clip with the buffered pre-roll, or extends the one being recorded."""
+        with self._lock:
+            if self._recording is None:
+                frames = list(self._buffer)
+                started = frames[0][0] if frames else timestamp
+                self._recording = {'frames': frames, 'started': started, 'event_ids': [],
+                                   'until': timestamp + self.post_seconds, 'caption': caption}
+            else:
+                until = max(self._recording['until'], timestamp + self.post_seconds)
+                self._recording['until'] = min(until, self._recording['started'] + self.max_seconds)
+            if event_id is not None:
+                self._recording['event_ids'].append(event_id)
+
+    def is_recording(self):
+        with self._lock:
+            return self._recording is not None
+
+    def buffered_bytes(self):
+        """Memory held by the pre-roll and the clip being recorded."""
+        with self._lock:
+            frames = list(self._buffer)
+            if self._recording is not None:
+                frames += self._recording['frames']
+            return sum(len(jpeg) for _, jpeg in frames)
+
+    def _sample(self):
+        interval = 1.0 / self.fps
+        last_seq = -1
+        next_sample = time.monotonic()
+        while not self._stop_event.wait(max(0.0, next_sample - time.monotonic())):
+            next_sample = max(next_sample + interval, time.monotonic())
+            if self.active is not None and not self.active():
+                # Do not keep stale pre-roll around while the system is idle
+                with self._lock:
+                    self._buffer.clear()
+                continue
+            frame = self.grabber.latest()
+            if frame is None or frame.seq == last_seq:
+                continue
+            last_seq = frame.seq
+            if frame.jpeg is not None and frame.size[0] <= self.max_width:
+                jpeg = frame.jpeg.tobytes()  # Compressed by the camera already: no decode and encode
+            else:
+                jpeg = encode_jpeg(frame.image, self.quality, self.max_width)
+            if jpeg is None:
+                continue
+            with self._lock:
+                self._buffer.append((frame.timestamp, jpeg))
+                if self._recording is not None:
+                    self._recording['frames'].append((frame.timestamp, jpeg))
+                    if frame.timestamp >= self._recording['until']:
+                        self._finish()
+
+    def _finish(self):
+        """Hands the current recording to the writer thread (called with the lock held)."""
+        try:
+            self._clips.put_nowait(self._recording)
+        except queue.Full:
+            self.clips_dropped += 1
+            logger.warning("Clip writer for %s is busy, dropping a clip", self.name)
+        self._recording = None
+
+    def _write(self):
+        while True:
+            clip = self._clips.get()
+            if clip is None:
+                break
+            try:
+                path = self.write_clip(clip['frames'])
+            except (cv2.error, OSError) as e:
+                logger.error("Failed to write clip for %s: %s", self.name, e)
+                continue
+            if path is None:
+                continue
+            self.clips_written += 1
+            try:
+                if self.on_clip is not None:
+                    self.on_clip(path, clip['caption'])
+                if self.keep_clips and self.on_saved is not None:
+                    self.on_saved(path, clip['event_ids'])
+            except Exception as e:
+                logger.exception("Error handling clip %s", path)
+            if not self.keep_clips:
+                os.remove(path)
+
+    def write_clip(self, frames):
+        """Decodes the JPEG frames and writes them to an MP4 file; returns its path."""
+        if not frames:
+            return None
+        first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        # Play the clip back at the rate the frames were actually sampled
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else self.fps
+        now = time.time()
+        timestamp = time.strftime("%Y%m%d--%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        os.makedirs(self.clip_dir, exist_ok=True)
+        path = os.path.join(self.clip_dir, f"clip_{self.name}_{timestamp}_{next(_clip_numbers)}.mp4")
+        writer = open_clip_writer(path, fps, (width, height))
+        if writer is None:
+            logger.error("Can not open a video writer for %s", path)
+            return None
+        try:
+            writer.write(first)
+            for _, jpeg in frames[1:]:
+                writer.write(cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR))
+        finally:
+            writer.release()
+        return path
+
+    def format_stats(self):
+        return (f"clips {self.name}: {self.clips_written} written, {self.clips_dropped} dropped, "
+                f"buffer {self.buffered_bytes() / 1024:.0f} KiB")
@@ -0,0 +1,684 @@
+import os
+import logging
+import gc
+import ctypes
+import threading
+import queue
+import time
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import torch
+from torchvision.models.detection import ssd300_vgg16
+
+logger = logging.getLogger(__name__)
+
+# Input resolution of SSD300
+SSD_INPUT_SIZE = (300, 300)
+# Smallest input the SSD300 VGG16 layers accept (the last extra layers need 3x3 feature maps)
+SSD_MIN_INPUT_SIZE = (268, 268)
+
+# COCO class ID for 'person'
+PERSON_LABEL = 1
+
+# Frames submitted within this window are run as one batch (seconds)
+BATCH_WINDOW = 0.02
+MAX_BATCH_SIZE = 4
+
+# Detector backend: "eager", "torchscript", "onnx" or "onnx-int8"
+DETECTOR_BACKEND = "eager"
+
+# Files written by export_model.py and read by the non-eager backends
+EXPORT_DIR = "exported_models"
+# Local copy of the pretrained SSD weights: downloaded once, then loaded from disk
+SSD_WEIGHTS_FILE = os.path.join(EXPORT_DIR, "ssd300_vgg16_coco.pth")
+BACKEND_MODEL_PATHS = {
+    "torchscript": os.path.join(EXPORT_DIR, "ssd300_vgg16.pt"),
+    "onnx": os.path.join(EXPORT_DIR, "ssd300_vgg16.onnx"),
+    "onnx-int8": os.path.join(EXPORT_DIR, "ssd300_vgg16.int8.onnx"),
+}
+
+# Two-tier cascade: a cheap HOG+SVM prescreen decides which frames go to SSD.
+# Frames whose best HOG score is below CASCADE_THRESHOLD skip SSD; lower values
+# send more uncertain frames on to SSD (higher recall, fewer SSD calls saved).
+# Off by default: HOG misses small, distant, seated and partly hidden people, and
+# a miss means no SSD call and no alert. Turn it on only once
+# benchmarks/benchmark_cascade.py shows the recall holds on the cameras' footage.
+CASCADE_ENABLED = False
+CASCADE_THRESHOLD = -0.5
+PRESCREEN_WIDTH = 400  # Frames are downscaled to this width for the prescreen
+
+# Region-of-interest detection: motion boxes are padded, grown to a minimum
+# size and merged; if the regions cover more than ROI_MAX_COVERAGE of the
+# frame, the whole frame is used instead.
+ROI_PADDING = 0.25      # Fraction of the box size added on every side
+ROI_MIN_SIZE = 128      # Minimum ROI width/height in frame pixels
+ROI_MAX_COVERAGE = 0.5
+# Every region costs one SSD forward pass, so on CPU all regions are
+# collapsed into their bounding box; raise this where batched crops are cheap (GPU)
+ROI_MAX_REGIONS = 1
+
+# Disable autograd bookkeeping for inference (inference_mode needs torch >= 1.9)
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_ssd_model(weights_file=None):
+    """
+    Load the pretrained SSD300-VGG16 model in evaluation mode. The weights are
+    read from weights_file (default SSD_WEIGHTS_FILE) if it exists; otherwise
+    they are downloaded and a copy is saved there, so later starts need no network.
+    """
+    weights_file = weights_file or SSD_WEIGHTS_FILE
+    if os.path.exists(weights_file):
+        model = ssd300_vgg16(pretrained=False, pretrained_backbone=False)
+        model.load_state_dict(torch.load(weights_file, map_location="cpu"))
+    else:
+        model = ssd300_vgg16(pretrained=True)
+        save_weights(model, weights_file)
+    model.eval()  # Set to evaluation mode
+    return model
+
+
+def save_weights(model, weights_file):
+    """Writes the model weights to a temporary file and moves it into place."""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(weights_file)), exist_ok=True)
+        tmp_file = weights_file + ".tmp"
+        torch.save(model.state_dict(), tmp_file)
+        os.replace(tmp_file, weights_file)
+    except OSError as e:
+        logger.warning("Could not save the model weights to %s: %s", weights_file, e)
+
+
+def _release_free_memory():
+    """Returns freed heap memory to the OS (glibc keeps it otherwise, so RSS would not drop)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def empty_predictions():
+    return {
+        'boxes': np.zeros((0, 4), dtype=np.float32),
+        'labels': np.zeros((0,), dtype=np.int64),
+        'scores': np.zeros((0,), dtype=np.float32),
+    }
+
+
+def has_person(predictions, confidence_threshold=0.5):
+    """True if the predictions contain a person above the confidence threshold."""
+    person = (predictions['labels'] == PERSON_LABEL) & (predictions['scores'] > confidence_threshold)
+    return bool(np.any(person))
+
+
+def person_boxes(predictions, confidence_threshold=0.5):
+    """Returns the (boxes, scores) of the persons above the confidence threshold."""
+    person = (predictions['labels'] == PERSON_LABEL) & (predictions['scores'] > confidence_threshold)
+    return predictions['boxes'][person], predictions['scores'][person]
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU between two arrays of x1/y1/x2/y2 boxes (N x 4 and M x 4)."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+def match_boxes(predicted, ground_truth, iou_threshold=0.5):
+    """
+    Greedily matches predicted boxes to ground-truth boxes by IoU.
+    Returns (true_positives, false_positives, false_negatives).
+    """
+    predicted = np.asarray(predicted, dtype=np.float32).reshape(-1, 4)
+    ground_truth = np.asarray(ground_truth, dtype=np.float32).reshape(-1, 4)
+    if len(predicted) == 0 or len(ground_truth) == 0:
+        return 0, len(predicted), len(ground_truth)
+    iou = box_iou(predicted, ground_truth)
+    matched = 0
+    while True:
+        best = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[best] < iou_threshold:
+            break
+        matched += 1
+        iou[best[0], :] = -1.0
+        iou[:, best[1]] = -1.0
+    return matched, len(predicted) - matched, len(ground_truth) - matched
+
+
+def merge_regions(boxes, frame_size, padding=ROI_PADDING, min_size=ROI_MIN_SIZE, max_regions=None):
+    """
+    Pads motion boxes, grows them to min_size, clips them to the frame
+    (width, height) and merges overlapping boxes until none overlap. If more
+    than max_regions remain, they are replaced by their bounding box.
+    Returns an int array of x1/y1/x2/y2 regions.
+    """
+    max_regions = ROI_MAX_REGIONS if max_regions is None else max_regions
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.int32)
+    width, height = frame_size
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+    sizes = np.maximum((boxes[:, 2:] - boxes[:, :2]) * (1.0 + 2.0 * padding), min_size)
+    regions = np.concatenate([centers - sizes / 2.0, centers + sizes / 2.0], axis=1)
+    regions = np.clip(regions, 0, [width, height, width, height])
+
+    merged = True
+    while merged and len(regions) > 1:
+        merged = False
+        overlap = box_iou(regions, regions) > 0
+        np.fill_diagonal(overlap, False)
+        for i in range(len(regions)):
+            partners = np.flatnonzero(overlap[i])
+            if len(partners):
+                group = np.concatenate([[i], partners])
+                union = np.concatenate([regions[group, :2].min(axis=0), regions[group, 2:].max(axis=0)])
+                regions = np.vstack([np.delete(regions, group, axis=0), union])
+                merged = True
+                break
+    if len(regions) > max_regions:
+        regions = np.concatenate([regions[:, :2].min(axis=0), regions[:, 2:].max(axis=0)])[None, :]
+    return np.round(regions).astype(np.int32)
+
+
+def concatenate_predictions(predictions):
+    if not predictions:
+        return empty_predictions()
+    return {key: np.concatenate([p[key] for p in predictions]) for key in ('boxes', 'labels', 'scores')}
+
+
+def _to_numpy_predictions(output):
+    return {
+        'boxes': np.asarray(output['boxes'], dtype=np.float32).reshape(-1, 4),
+        'labels': np.asarray(output['labels'], dtype=np.int64),
+        'scores': np.asarray(output['scores'], dtype=np.float32),
+    }
+
+
+class DetectorBackend:
+    """
+    Runs the detector on a preprocessed batch (N x 3 x H x W float tensor,
+    RGB in 0..1) and returns one prediction dict of NumPy arrays per image,
+    in input-size coordinates.
+    """
+
+    name = None
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def set_input_size(self, size):
+        """Makes the model run at size (width, height); returns False if the backend has a fixed input."""
+        return False
+
+
+class EagerBackend(DetectorBackend):
+    """The torchvision model run directly in eager mode."""
+
+    name = "eager"
+
+    def __init__(self, model=None, device="cpu"):
+        self.device = torch.device(device)
+        self.model = (model if model is not None else load_ssd_model()).to(self.device)
+        self.model.eval()
+
+    def predict(self, batch):
+        with _inference_mode():
+            outputs = self.model(list(batch.to(self.device)))
+        return [_to_numpy_predictions({k: v.cpu() for k, v in output.items()}) for output in outputs]
+
+    def set_input_size(self, size):
+        # torchvision's SSD resizes every image to transform.fixed_size (width, height)
+        transform = getattr(self.model, "transform", None)
+        if transform is None or getattr(transform, "fixed_size", None) is None:
+            return False
+        if size[0] < SSD_MIN_INPUT_SIZE[0] or size[1] < SSD_MIN_INPUT_SIZE[1]:
+            raise ValueError(f"SSD300 needs an input of at least {SSD_MIN_INPUT_SIZE}, got {size}")
+        transform.fixed_size = tuple(size)
+        return True
+
+
+class TorchScriptBackend(DetectorBackend):
+    """A scripted model saved by export_model.py."""
+
+    name = "torchscript"
+
+    def __init__(self, path, device="cpu"):
+        self.device = torch.device(device)
+        self.model = torch.jit.load(path, map_location=self.device)
+        self.model.eval()
+
+    def predict(self, batch):
+        with _inference_mode():
+            # Scripted detection models return (losses, detections)
+            _, outputs = self.model(list(batch.to(self.device)))
+        return [_to_numpy_predictions({k: v.cpu() for k, v in output.items()}) for output in outputs]
+
+
+class OnnxRuntimeBackend(DetectorBackend):
+    """An ONNX export (float or INT8) run with ONNX Runtime, one image per call."""
+
+    name = "onnx"
+
+    def __init__(self, path, providers=None):
+        import onnxruntime  # Optional dependency, only needed for this backend
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=providers or onnxruntime.get_available_providers())
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def predict(self, batch):
+        images = batch.cpu().numpy()
+        results = []
+        for image in images:
+            outputs = self.session.run(None, {self.input_name: image})
+            results.append(_to_numpy_predictions(dict(zip(self.output_names, outputs))))
+        return results
+
+
+def create_backend(name=None, device=None, model_path=None):
+    """Create the detector backend selected by name (defaults to DETECTOR_BACKEND)."""
+    name = name or DETECTOR_BACKEND
+    device = device or default_device()
+    if name == "eager":
+        return EagerBackend(device=device)
+    path = model_path or BACKEND_MODEL_PATHS.get(name)
+    if path is None:
+        raise ValueError(f"Unknown detector backend: {name}")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model file {path} not found. Run export_model.py to create it.")
+    if name == "torchscript":
+        return TorchScriptBackend(path, device=device)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxRuntimeBackend(path)
+    raise ValueError(f"Unknown detector backend: {name}")
+
+
+class DetectionEngine:
+    """
+    Owns the detector backend and reusable input buffers.
+
+    Frames are resized to the SSD input size and converted from BGR to RGB
+    with OpenCV before being copied into a preallocated (pinned, when CUDA
+    is available) batch tensor, so a detection does not allocate a
+    full-resolution float tensor. Boxes are scaled back to frame coordinates
+    and returned as NumPy arrays.
+
+    With lazy=True nothing is loaded when the engine is created: load_async()
+    loads and warms up the model on a background thread, the first detection
+    loads it otherwise, and unload() frees it again.
+    """
+
+    def __init__(self, backend=None, model=None, device=None, input_size=SSD_INPUT_SIZE,
+                 max_batch_size=MAX_BATCH_SIZE, batch_window=BATCH_WINDOW, lazy=False):
+        self.device = torch.device(device or default_device())
+        self.backend = backend
+        self.backend_name = backend.name if backend is not None else DETECTOR_BACKEND
+        self.default_backend_name = self.backend_name
+        self._model = model
+        # A backend passed in can not be created again, so it is never unloaded
+        self._owns_backend = backend is None
+        self.input_size = tuple(input_size)
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+
+        self._host_buffer = None
+        self._host_view = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loader = None
+        # Seconds taken by the last model load and warm-up inference
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.warmed_up = False
+        self.last_used = time.monotonic()
+
+        self._requests = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Pixels sent to the detector by detect_regions() vs. the full frames they came from
+        self.roi_pixels = 0
+        self.roi_frame_pixels = 0
+        # Forward passes and the duration of the last one (preprocessing included)
+        self.inferences = 0
+        self.last_inference_ms = 0.0
+
+        if not lazy:
+            self.load(warmup=False)
+
+    def _create_backend(self):
+        if self._model is not None and self.backend_name == "eager":
+            return EagerBackend(self._model, self.device)
+        return create_backend(self.backend_name, device=self.device)
+
+    def _allocate_buffer(self):
+        width, height = self.input_size
+        pin = self.device.type == "cuda"
+        self._host_buffer = torch.empty((self.max_batch_size, height, width, 3), dtype=torch.uint8, pin_memory=pin)
+        self._host_view = self._host_buffer.numpy()
+
+    def is_loaded(self):
+        return self.backend is not None and self._host_buffer is not None
+
+    def load(self, warmup=True):
+        """
+        Creates the backend and input buffers if they are not loaded, then
+        optionally runs one inference on a blank frame so the first real frame
+        does not pay for lazy initialization and first allocations. Concurrent
+        callers wait for the load in progress.
+        """
+        with self._load_lock:
+            if self.backend is None:
+                started = time.monotonic()
+                backend = self._create_backend()
+                backend.set_input_size(self.input_size)
+                self.load_seconds = time.monotonic() - started
+                with self._lock:
+                    self.backend = backend
+                logger.info("Detection model (%s) loaded in %.1f s", self.backend_name, self.load_seconds)
+            with self._lock:
+                if self._host_buffer is None:
+                    self._allocate_buffer()
+                if warmup and not self.warmed_up:
+                    started = time.monotonic()
+                    width, height = self.input_size
+                    with _inference_mode():
+                        self.backend.predict(self.preprocess([np.zeros((height, width, 3), dtype=np.uint8)]))
+                    self.warmup_seconds = time.monotonic() - started
+                    self.warmed_up = True
+                    logger.info("Detection model warmed up in %.2f s", self.warmup_seconds)
+        return self
+
+    def load_async(self, warmup=True):
+        """Loads (and warms up) the model on a background thread; returns at once."""
+        if self.is_loaded() or (self._loader is not None and self._loader.is_alive()):
+            return self
+
+        def run():
+            try:
+                self.load(warmup)
+            except Exception as e:
+                logger.exception("Failed to load the detection model: %s", e)
+
+        self._loader = threading.Thread(target=run, name="model-loader", daemon=True)
+        self._loader.start()
+        return self
+
+    def unload(self):
+        """
+        Frees the model and the input buffers, e.g. after a long idle period.
+        The next detection (or load_async()) loads them again. Returns False
+        if nothing was unloaded.
+        """
+        if not self._owns_backend:
+            return False
+        with self._load_lock, self._lock:
+            if self.backend is None:
+                return False
+            self.backend = None
+            self._host_buffer = None
+            self._host_view = None
+            self.warmed_up = False
+        gc.collect()
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        _release_free_memory()
+        logger.info("Detection model unloaded")
+        return True
+
+    def idle_seconds(self):
+        """Seconds since the last detection."""
+        return time.monotonic() - self.last_used
+
+    def preprocess(self, frames):
+        """Resize and convert frames into the reusable buffer; returns an NCHW float tensor."""
+        width, height = self.input_size
+        for i, frame in enumerate(frames):
+            resized = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+            cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=self._host_view[i])
+        batch = self._host_buffer[:len(frames)].to(self.device, non_blocking=True)
+        return batch.permute(0, 3, 1, 2).float().div_(255.0)
+
+    def _postprocess(self, output, frame_shape):
+        height, width = frame_shape[:2]
+        in_width, in_height = self.input_size
+        scale = np.array([width / in_width, height / in_height,
+                          width / in_width, height / in_height], dtype=np.float32)
+        output['boxes'] = output['boxes'] * scale
+        return output
+
+    def detect_batch(self, frames):
+        """Run SSD on a list of BGR frames and return one prediction dict per frame."""
+        results = []
+        start = 0
+        self.last_used = time.monotonic()
+        while start < len(frames):
+            if not self.is_loaded():
+                self.load(warmup=False)
+            with self._lock, _inference_mode():
+                if self.backend is None or self._host_buffer is None:
+                    continue  # Unloaded in between; load again
+                # The batch size is read under the lock, as configure() may change it
+                chunk = frames[start:start + self.max_batch_size]
+                start += len(chunk)
+                started = time.monotonic()
+                outputs = self.backend.predict(self.preprocess(chunk))
+                results.extend(self._postprocess(output, frame.shape) for output, frame in zip(outputs, chunk))
+                self.last_inference_ms = (time.monotonic() - started) * 1000.0
+                self.inferences += 1
+        return results
+
+    def detect(self, frame, confidence_threshold=0.5):
+        """
+        Detect persons in one frame. Goes through the batching worker when it
+        is running so concurrent callers share a forward pass.
+        """
+        if self._thread is not None:
+            predictions = self.submit(frame).result()
+        else:
+            predictions = self.detect_batch([frame])[0]
+        return has_person(predictions, confidence_threshold), predictions
+
+    def detect_regions(self, frame, regions, confidence_threshold=0.5):
+        """
+        Detect persons only inside the given regions (x1, y1, x2, y2 in frame
+        pixels, e.g. from merge_regions()). The crops are run as one batch and
+        the boxes are returned in full-frame coordinates.
+        """
+        height, width = frame.shape[:2]
+        covered = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        self.roi_frame_pixels += width * height
+        if len(regions) == 0 or len(regions) > self.max_batch_size or covered > ROI_MAX_COVERAGE * width * height:
+            self.roi_pixels += width * height
+            return self.detect(frame, confidence_threshold)
+
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        if self._thread is not None:
+            futures = [self.submit(crop) for crop in crops]
+            results = [future.result() for future in futures]
+        else:
+            results = self.detect_batch(crops)
+        for (x1, y1, _, _), result in zip(regions, results):
+            result['boxes'] = result['boxes'] + np.array([x1, y1, x1, y1], dtype=np.float32)
+        self.roi_pixels += covered
+        predictions = concatenate_predictions(results)
+        return has_person(predictions, confidence_threshold), predictions
+
+    def configure(self, input_size=None, max_batch_size=None, backend=None):
+        """
+        Changes the input size, batch size or backend (by name, see
+        create_backend()) at runtime, e.g. from the governor. Waits for the
+        forward pass in progress; the input size is only changed if the backend
+        supports it. Settings made while the model is not loaded take effect
+        when it is. Returns the settings in effect.
+        """
+        with self._lock:
+            if backend is not None and backend != self.backend_name and self._owns_backend:
+                self.backend_name = backend
+                if self.backend is not None:
+                    self.backend = self._create_backend()
+                    self.warmed_up = False
+                    # Exported models resize to the size they were exported at, whatever the input
+                    self.backend.set_input_size(self.input_size)
+            if input_size is not None and tuple(input_size) != self.input_size:
+                if self.backend is None or self.backend.set_input_size(input_size):
+                    self.input_size = tuple(input_size)
+            if max_batch_size is not None:
+                self.max_batch_size = max_batch_size
+            width, height = self.input_size
+            if self._host_buffer is not None and self._host_buffer.shape[:3] != (self.max_batch_size, height, width):
+                self._allocate_buffer()
+            return {"input_size": self.input_size, "max_batch_size": self.max_batch_size,
+                    "backend": self.backend_name}
+
+    def format_stats(self):
+        share = 100.0 * self.roi_pixels / self.roi_frame_pixels if self.roi_frame_pixels else 100.0
+        if self.is_loaded():
+            model = f"model loaded ({self.load_seconds or 0.0:.1f} s"
+            model += f", warm-up {self.warmup_seconds:.2f} s)" if self.warmed_up else ")"
+        else:
+            model = "model not loaded"
+        return f"detection: ROI pixels {share:.1f}% of full frames, {model}"
+
+    def submit(self, frame):
+        """Queue a frame for the batching worker; returns a Future with its predictions."""
+        future = Future()
+        self._requests.put((frame, future))
+        return future
+
+    def start(self):
+        """Start the worker that groups frames submitted within batch_window."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._batch_worker, name="detection-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _batch_worker(self):
+        while not self._stop_event.is_set():
+            try:
+                batch = [self._requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            frames = [frame for frame, _ in batch]
+            try:
+                predictions = self.detect_batch(frames)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, predictions):
+                future.set_result(result)
+
+
+class HogPrescreen:
+    """
+    OpenCV's HOG+SVM people detector used as a cheap first stage. score()
+    returns the best SVM margin found in the image (or region), or None when
+    the region is too small for the detection window.
+    """
+
+    def __init__(self, width=PRESCREEN_WIDTH, threshold=CASCADE_THRESHOLD):
+        self.width = width
+        self.threshold = threshold
+        self._hog = cv2.HOGDescriptor()
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        self._window = self._hog.winSize  # (64, 128)
+
+    def score(self, frame, roi=None):
+        if roi is not None:
+            x1, y1, x2, y2 = [int(v) for v in roi]
+            frame = frame[max(y1, 0):y2, max(x1, 0):x2]
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(frame, (self.width, int(height * self.width / width)), interpolation=cv2.INTER_AREA)
+            height, width = frame.shape[:2]
+        if width < self._window[0] or height < self._window[1]:
+            return None
+        rects, weights = self._hog.detectMultiScale(frame, hitThreshold=self.threshold,
+                                                    winStride=(8, 8), padding=(8, 8), scale=1.05)
+        if len(weights) == 0:
+            return float("-inf")
+        return float(np.max(weights))
+
+    def passes(self, frame, roi=None):
+        """True if the frame is positive or uncertain and should go on to SSD."""
+        score = self.score(frame, roi)
+        return score is None or score >= self.threshold
+
+
+class DetectionCascade:
+    """
+    Runs the HOG prescreen first and only calls the SSD engine for frames it
+    flags as positive or uncertain. Counts how many SSD calls were avoided.
+    """
+
+    def __init__(self, engine, prescreen=None, enabled=None):
+        self.engine = engine
+        self.prescreen = prescreen if prescreen is not None else HogPrescreen()
+        self.enabled = CASCADE_ENABLED if enabled is None else enabled
+        self.frames = 0
+        self.ssd_calls = 0
+        self.ssd_avoided = 0
+        self.prescreen_time = 0.0
+        self._lock = threading.Lock()
+
+    def detect(self, frame, confidence_threshold=0.5, rois=None):
+        """
+        Same contract as DetectionEngine.detect(). When rois (merged motion
+        regions) are given, both the prescreen and SSD only look at them.
+        """
+        with self._lock:
+            self.frames += 1
+        if self.enabled:
+            started = time.monotonic()
+            regions = rois if rois is not None and len(rois) else [None]
+            candidate = any(self.prescreen.passes(frame, roi) for roi in regions)
+            with self._lock:
+                self.prescreen_time += time.monotonic() - started
+                if not candidate:
+                    self.ssd_avoided += 1
+            if not candidate:
+                return False, empty_predictions()
+        with self._lock:
+            self.ssd_calls += 1
+        if rois is not None and len(rois):
+            return self.engine.detect_regions(frame, rois, confidence_threshold)
+        return self.engine.detect(frame, confidence_threshold)
+
+    def format_stats(self):
+        with self._lock:
+            avoided = 100.0 * self.ssd_avoided / self.frames if self.frames else 0.0
+            prescreen_ms = 1000.0 * self.prescreen_time / self.frames if self.frames else 0.0
+            return (f"cascade: {self.frames} frames, {self.ssd_calls} SSD calls, "
+                    f"{self.ssd_avoided} avoided ({avoided:.0f}%), prescreen avg {prescreen_ms:.1f} ms")
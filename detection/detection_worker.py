@@ -0,0 +1,586 @@
+"""
+Runs person detection (HOG prescreen + SSD) in a separate worker process.
+
+Frames go to the worker through a pool of shared memory slots: the caller
+copies a frame into a free slot and the worker reads it through a NumPy view
+of the same memory, so no frame is pickled. Requests and results are small
+messages over two pipes. The worker is supervised: if it crashes, hangs on a
+request or grows past its memory limit it is restarted, and the requests in
+flight fail instead of blocking their callers.
+
+The worker is started as a plain Python process running this file (not with
+multiprocessing), so it does not import main.py and its Telegram sender again.
+"""
+import os
+import sys
+import time
+import logging
+import queue
+import mmap
+import threading
+import itertools
+import subprocess
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Connection
+import numpy as np
+import psutil
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8 (JetPack 4): plain files in /dev/shm, mapped the same way
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+# Frames that can be in flight at once (one shared memory slot each); slots are
+# sized for the largest frame seen so far
+WORKER_SLOTS = 4
+
+# Request threads in the worker: several let the engine batch frames from different cameras
+WORKER_THREADS = 4
+
+# Cores the worker may run on (e.g. {2, 3}, so the Telegram, capture and
+# telemetry threads keep cores 0 and 1), or None for all
+WORKER_CPU_AFFINITY = None
+
+# torch intra-op threads in the worker, or None for the torch default (one per core)
+WORKER_TORCH_THREADS = None
+
+# Supervision: a request taking longer than WORKER_REQUEST_TIMEOUT means the
+# worker hangs; above WORKER_MAX_RSS_MB it is restarted once idle (leak guard).
+# Restarts wait WORKER_RESTART_DELAY seconds, doubled after every failed start
+# up to WORKER_RESTART_MAX_DELAY
+WORKER_START_TIMEOUT = 120.0
+WORKER_REQUEST_TIMEOUT = 30.0
+WORKER_MAX_RSS_MB = 1500
+WORKER_RESTART_DELAY = 1.0
+WORKER_RESTART_MAX_DELAY = 60.0
+WORKER_CHECK_INTERVAL = 1.0
+WORKER_STOP_TIMEOUT = 5.0
+
+SHM_DIR = "/dev/shm"
+
+
+class WorkerError(RuntimeError):
+    """A request could not be answered because the detection worker failed or is not running."""
+
+
+class SharedSlot:
+    """One block of shared memory, created by the parent and attached by the worker by name."""
+
+    def __init__(self, name=None, size=0):
+        self.size = size
+        if shared_memory is not None:
+            if name is None:
+                self._shm = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                self._shm = shared_memory.SharedMemory(name=name)
+                _untrack(self._shm)
+            self.name = self._shm.name
+            self.size = self._shm.size
+            self.buf = self._shm.buf
+            return
+        self._shm = None
+        self._owner = name is None
+        self.name = name or f"surveillance-{os.getpid()}-{next(_slot_ids)}"
+        path = os.path.join(SHM_DIR, self.name)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT if self._owner else os.O_RDWR, 0o600)
+        try:
+            if self._owner:
+                os.ftruncate(fd, size)
+            else:
+                self.size = os.fstat(fd).st_size
+            self._map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._map)
+
+    def view(self, shape, dtype):
+        """NumPy array over the slot memory (no copy)."""
+        return np.ndarray(shape, dtype=dtype, buffer=self.buf)
+
+    def close(self, unlink=False):
+        """Unmaps the slot; arrays from view() must no longer be in use (they are not kept from it)."""
+        self.buf.release()
+        if self._shm is not None:
+            self._shm.close()
+            if unlink:
+                self._shm.unlink()
+            return
+        self._map.close()
+        if unlink:
+            try:
+                os.unlink(os.path.join(SHM_DIR, self.name))
+            except OSError:
+                pass
+
+
+_slot_ids = itertools.count()
+
+
+def _untrack(shm):
+    """
+    Stops the worker's resource tracker from removing a segment it only
+    attached to when the worker exits (the parent owns and unlinks it).
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+
+class SlotPool:
+    """Fixed number of shared memory slots; a slot is re-created when a larger frame needs it."""
+
+    def __init__(self, count=WORKER_SLOTS):
+        self.slots = [None] * count
+        self._free = queue.Queue()
+        for index in range(count):
+            self._free.put(index)
+
+    def acquire(self, nbytes, timeout=None):
+        """Returns the index of a free slot of at least nbytes; blocks while all are in use."""
+        try:
+            index = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError("No free shared memory slot")
+        slot = self.slots[index]
+        if slot is None or slot.size < nbytes:
+            if slot is not None:
+                slot.close(unlink=True)
+            self.slots[index] = SharedSlot(size=nbytes)
+        return index
+
+    def release(self, index):
+        self._free.put(index)
+
+    def nbytes(self):
+        return sum(slot.size for slot in self.slots if slot is not None)
+
+    def close(self):
+        for index, slot in enumerate(self.slots):
+            if slot is not None:
+                slot.close(unlink=True)
+                self.slots[index] = None
+
+
+class DetectionWorker:
+    """
+    Parent side of the detection worker process. detect() has the contract of
+    DetectionCascade.detect() and may be called from several threads.
+
+    Mirrors the parts of DetectionEngine that main.py uses: load_async()
+    starts the worker process (the model loads there), unload() stops it,
+    which frees all of its memory, and configure() settings are kept and
+    applied again after every restart.
+    """
+
+    def __init__(self, slots=WORKER_SLOTS, threads=WORKER_THREADS, cpu_affinity=WORKER_CPU_AFFINITY,
+                 torch_threads=WORKER_TORCH_THREADS, weights_file=None, cascade_enabled=None):
+        from detection import DETECTOR_BACKEND
+        self.threads = threads
+        self.cpu_affinity = cpu_affinity
+        self.torch_threads = torch_threads
+        self.weights_file = weights_file
+        self.cascade_enabled = cascade_enabled
+        self.settings = {}  # configure() arguments, applied again after a restart
+        self.default_backend_name = DETECTOR_BACKEND
+        self.pool = SlotPool(slots)
+
+        # Figures reported by the worker with every result
+        self.inferences = 0
+        self.ssd_calls = 0
+        self.last_inference_ms = 0.0
+        self.load_seconds = None
+        self.last_used = time.monotonic()
+        self.starts = 0
+        self.restarts = []  # Reasons, oldest first
+
+        self._ids = itertools.count()
+        self._pending = {}  # request id -> (Future, slot index or None, sent at)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wanted = False  # The worker should be running (cleared by unload() and stop())
+        self._process = None
+        self._requests = None
+        self._restart_reason = None
+        self._failed_starts = 0
+        self._next_start = 0.0
+        self._stop_event = threading.Event()
+        self._supervisor = None
+
+    # Process management
+
+    def start(self):
+        """Starts supervising; the worker process itself starts with load_async() or the first detect()."""
+        if self._supervisor is None:
+            self._stop_event.clear()
+            self._supervisor = threading.Thread(target=self._supervise, name="detection-supervisor", daemon=True)
+            self._supervisor.start()
+        return self
+
+    def load_async(self, warmup=True):
+        """Starts the worker process; the model loads (and warms up) there. Returns at once."""
+        self.start()
+        with self._lock:
+            if self._wanted:
+                return self  # Running, starting or waiting for a restart
+            self._wanted = True
+            if self._process is None:
+                self._launch()
+        return self
+
+    def load(self, warmup=True):
+        """Starts the worker process and waits until its model is loaded."""
+        self.load_async(warmup)
+        if not self._ready.wait(WORKER_START_TIMEOUT):
+            raise WorkerError("Detection worker did not start in time")
+        return self
+
+    def _launch(self):
+        """Starts a worker process; called with _lock held."""
+        request_read, request_write = os.pipe()
+        result_read, result_write = os.pipe()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        command = [sys.executable, os.path.abspath(__file__), str(request_read), str(result_write)]
+        try:
+            process = subprocess.Popen(command, pass_fds=(request_read, result_write), env=env)
+        finally:
+            os.close(request_read)
+            os.close(result_write)
+        self._process = process
+        self._requests = Connection(request_write, readable=False)
+        self._ready.clear()
+        self.starts += 1
+        self._send(("init", {
+            "threads": self.threads,
+            "cpu_affinity": sorted(self.cpu_affinity) if self.cpu_affinity else None,
+            "torch_threads": self.torch_threads,
+            "weights_file": self.weights_file,
+            "cascade_enabled": self.cascade_enabled,
+            "settings": self.settings,
+        }))
+        results = Connection(result_read, writable=False)
+        threading.Thread(target=self._read_results, args=(process, results), name="detection-results",
+                         daemon=True).start()
+        logger.info("Detection worker started (pid %d)", process.pid)
+
+    def _send(self, message):
+        with self._send_lock:
+            self._requests.send(message)
+
+    def _read_results(self, process, results):
+        """Receives the messages of one worker process until it exits."""
+        while True:
+            try:
+                message = results.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "ready":
+                self._update_status(message[1])
+                self._failed_starts = 0
+                self._ready.set()
+                logger.info("Detection worker ready (pid %d, model loaded in %.1f s)", process.pid, self.load_seconds)
+                continue
+            if kind == "failed":
+                logger.error("Detection worker failed to start: %s", message[1])
+                continue
+            _, request_id, value, status = message
+            self._update_status(status)
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue
+            future, slot, _ = entry
+            if slot is not None:
+                self.pool.release(slot)
+            if kind == "result":
+                future.set_result(value)
+            else:
+                future.set_exception(WorkerError(value))
+        results.close()
+        process.wait()
+        self._on_exit(process)
+
+    def _update_status(self, status):
+        self.inferences = status["inferences"]
+        self.ssd_calls = status["ssd_calls"]
+        self.last_inference_ms = status["last_inference_ms"]
+        self.load_seconds = status["load_seconds"]
+
+    def _on_exit(self, process):
+        """Fails the requests of an exited worker and schedules a restart if it should be running."""
+        with self._lock:
+            if process is not self._process:
+                return
+            self._process = None
+            self._ready.clear()
+            pending, self._pending = self._pending, {}
+            reason = self._restart_reason or f"exit code {process.returncode}"
+            self._restart_reason = None
+            if self._wanted:
+                if not self.load_seconds or process.returncode:
+                    self._failed_starts += 1
+                delay = min(WORKER_RESTART_MAX_DELAY, WORKER_RESTART_DELAY * 2 ** max(0, self._failed_starts - 1))
+                self._next_start = time.monotonic() + delay
+                self.restarts.append(reason)
+                logger.warning("Detection worker (pid %d) stopped: %s; restarting in %.0f s", process.pid, reason, delay)
+        for future, slot, _ in pending.values():
+            if slot is not None:
+                self.pool.release(slot)
+            future.set_exception(WorkerError(f"Detection worker stopped: {reason}"))
+
+    def _supervise(self):
+        while not self._stop_event.wait(WORKER_CHECK_INTERVAL):
+            with self._lock:
+                process = self._process
+                if process is None:
+                    if self._wanted and time.monotonic() >= self._next_start:
+                        self._launch()
+                    continue
+                oldest = min((sent for _, _, sent in self._pending.values()), default=None)
+                idle = not self._pending
+            if oldest is not None and time.monotonic() - oldest > WORKER_REQUEST_TIMEOUT:
+                self._kill(process, f"no answer for {WORKER_REQUEST_TIMEOUT:.0f} s")
+                continue
+            rss = self.worker_rss()
+            if idle and rss is not None and rss > WORKER_MAX_RSS_MB:
+                self._kill(process, f"RSS {rss:.0f} MB over {WORKER_MAX_RSS_MB} MB")
+
+    def _kill(self, process, reason):
+        with self._lock:
+            if process is not self._process:
+                return
+            self._restart_reason = reason
+        process.kill()  # The result reader sees the pipe close and restarts it
+
+    def worker_rss(self):
+        """Resident memory of the worker process in MB, or None if it is not running."""
+        process = self._process
+        if process is None:
+            return None
+        try:
+            return psutil.Process(process.pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            return None
+
+    def unload(self):
+        """Stops the worker process, which frees the model and all of its memory."""
+        with self._lock:
+            self._wanted = False
+            process = self._process
+            if process is None:
+                return False
+            self._restart_reason = "unloaded"
+        try:
+            self._send(("stop",))
+        except OSError:
+            pass
+        try:
+            process.wait(WORKER_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        logger.info("Detection worker stopped (model unloaded)")
+        return True
+
+    def stop(self):
+        self.unload()
+        self._stop_event.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        # Wait for the result reader to fail what was still pending before the slots go
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        while self._process is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.pool.close()
+
+    def is_loaded(self):
+        return self._ready.is_set()
+
+    def idle_seconds(self):
+        """Seconds since the last detection."""
+        return time.monotonic() - self.last_used
+
+    # Requests
+
+    def _request(self, message, slot=None, timeout=None):
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            self._pending[request_id] = (future, slot, time.monotonic())
+        try:
+            self._send((message[0], request_id) + message[1:])
+        except (OSError, AttributeError) as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            if slot is not None:
+                self.pool.release(slot)
+            raise WorkerError(f"Detection worker is not running: {e}")
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # A slot stays pending, and out of the pool, until the worker answers or
+            # exits: the worker may still be reading the frame from it
+            if slot is None:
+                with self._lock:
+                    self._pending.pop(request_id, None)
+            raise WorkerError("Detection worker did not answer in time")
+
+    def detect(self, frame, confidence_threshold=0.5, rois=None):
+        """Run the cascade on a BGR frame in the worker; returns (person_detected, predictions)."""
+        self.last_used = time.monotonic()
+        if not self._wanted:
+            self.load_async()  # Load on first use, like DetectionEngine
+        if not self._ready.wait(WORKER_START_TIMEOUT):
+            raise WorkerError("Detection worker is not ready")
+        slot = self.pool.acquire(frame.nbytes, timeout=WORKER_REQUEST_TIMEOUT)
+        shared = self.pool.slots[slot]
+        np.copyto(shared.view(frame.shape, frame.dtype), frame)
+        rois = [tuple(int(v) for v in roi) for roi in rois] if rois is not None else None  # Pixel boxes
+        # The supervisor restarts a worker that hangs; the timeout only guards against a lost answer
+        return self._request(("detect", slot, shared.name, frame.shape, frame.dtype.str,
+                              confidence_threshold, rois), slot=slot, timeout=2 * WORKER_REQUEST_TIMEOUT)
+
+    def configure(self, input_size=None, max_batch_size=None, backend=None):
+        """Same as DetectionEngine.configure(); kept and applied again when the worker restarts."""
+        settings = {"input_size": input_size, "max_batch_size": max_batch_size, "backend": backend}
+        self.settings.update({name: value for name, value in settings.items() if value is not None})
+        if not self._ready.is_set():
+            return dict(self.settings)
+        return self._request(("configure", self.settings), timeout=WORKER_REQUEST_TIMEOUT)
+
+    def format_stats(self):
+        process = self._process
+        rss = self.worker_rss()
+        lines = []
+        if self._ready.is_set():
+            try:
+                lines.append(self._request(("stats",), timeout=WORKER_REQUEST_TIMEOUT))
+            except Exception as e:
+                lines.append(f"detection: stats not available ({e})")
+        state = f"pid {process.pid}, RSS {rss:.0f} MB" if process is not None and rss is not None else "not running"
+        restarts = f", last: {self.restarts[-1]}" if self.restarts else ""
+        lines.append(f"detection worker: {state}, {self.starts} starts, {len(self.restarts)} restarts{restarts}, "
+                     f"shared memory {self.pool.nbytes() / (1024 * 1024):.1f} MiB")
+        return "\n".join(lines)
+
+
+def _worker_main(request_fd, result_fd):
+    """Entry point of the worker process."""
+    requests = Connection(request_fd, writable=False)
+    results = Connection(result_fd, readable=False)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            results.send(message)
+
+    _, init = requests.recv()
+    from structured_logging import configure_logging
+    configure_logging()  # The worker's records go to the same stdout, in the same format
+    if init["cpu_affinity"] and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, init["cpu_affinity"])
+    import torch
+    if init["torch_threads"]:
+        torch.set_num_threads(init["torch_threads"])
+    import detection
+    if init["weights_file"]:
+        detection.SSD_WEIGHTS_FILE = init["weights_file"]
+
+    try:
+        engine = detection.DetectionEngine(lazy=True)
+        cascade = detection.DetectionCascade(engine, enabled=init["cascade_enabled"])
+        engine.configure(**init["settings"])
+        engine.load()
+        engine.start()
+    except Exception as e:
+        send(("failed", f"{type(e).__name__}: {e}"))
+        sys.exit(1)
+
+    def status():
+        return {"inferences": engine.inferences, "ssd_calls": cascade.ssd_calls,
+                "last_inference_ms": engine.last_inference_ms, "load_seconds": engine.load_seconds}
+
+    slots = {}  # slot index -> SharedSlot attached in this process
+    # Slots the parent has replaced. Other requests may still hold views of them,
+    # and reading a view of an unmapped slot crashes the worker, so they are only
+    # closed once no request is in flight
+    retired = []
+    in_flight = [0]
+    slots_lock = threading.Lock()
+
+    def attach(index, name):
+        with slots_lock:
+            slot = slots.get(index)
+            if slot is None or slot.name != name:
+                if slot is not None:
+                    retired.append(slot)
+                slot = slots[index] = SharedSlot(name=name)
+            return slot
+
+    def finished():
+        with slots_lock:
+            in_flight[0] -= 1
+            if not in_flight[0]:
+                while retired:
+                    retired.pop().close()
+
+    def handle(message):
+        kind, request_id = message[0], message[1]
+        if kind == "detect":
+            _, _, index, name, shape, dtype, threshold, rois = message
+            frame = attach(index, name).view(shape, np.dtype(dtype))
+            value = cascade.detect(frame, threshold, rois)
+            del frame  # The parent reuses the slot once the result is sent
+        elif kind == "configure":
+            value = engine.configure(**message[2])
+        elif kind == "stats":
+            value = f"{cascade.format_stats()}\n{engine.format_stats()}"
+        else:
+            raise ValueError(f"Unknown request: {kind}")
+        return value
+
+    work = queue.Queue()
+
+    def serve():
+        while True:
+            message = work.get()
+            if message is None:
+                return
+            try:
+                send(("result", message[1], handle(message), status()))
+            except Exception as e:
+                send(("error", message[1], f"{type(e).__name__}: {e}", status()))
+            finished()  # After the except block, whose traceback still references the frame
+
+    threads = [threading.Thread(target=serve, daemon=True) for _ in range(init["threads"])]
+    for thread in threads:
+        thread.start()
+    send(("ready", status()))
+
+    while True:
+        try:
+            message = requests.recv()
+        except (EOFError, OSError):
+            break  # The parent has gone
+        if message[0] == "stop":
+            break
+        with slots_lock:
+            in_flight[0] += 1
+        work.put(message)
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join(WORKER_STOP_TIMEOUT)
+    engine.stop()
+    if not any(thread.is_alive() for thread in threads):
+        for slot in list(slots.values()) + retired:
+            slot.close()
+
+
+if __name__ == "__main__":
+    _worker_main(int(sys.argv[1]), int(sys.argv[2]))
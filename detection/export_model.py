@@ -0,0 +1,150 @@
+"""
+Exports the SSD person detector for the TorchScript and ONNX Runtime
+backends, optionally quantizes the ONNX model to INT8, and checks the
+accuracy of the exported model against the float eager model.
+
+    python3 export_model.py --backend torchscript
+    python3 export_model.py --backend onnx
+    python3 export_model.py --backend onnx --quantize static --samples samples/
+
+A labeled sample set is a directory of images plus a labels.json file that
+maps each image file name to its list of person boxes [x1, y1, x2, y2].
+"""
+import argparse
+import inspect
+import json
+import os
+import cv2
+import numpy as np
+import torch
+from torchvision.models.detection import ssd300_vgg16
+from detection import (SSD_INPUT_SIZE, BACKEND_MODEL_PATHS, DetectionEngine, DetectorBackend, EagerBackend,
+                       create_backend, load_ssd_model, person_boxes, match_boxes)
+
+
+def export_torchscript(model, path):
+    scripted = torch.jit.script(model)
+    scripted.save(path)
+
+
+def export_onnx(model, path, opset_version=11):
+    width, height = SSD_INPUT_SIZE
+    dummy = torch.rand(3, height, width)
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False  # Newer PyTorch defaults to the dynamo exporter
+    torch.onnx.export(model, ([dummy],), path, opset_version=opset_version,
+                      input_names=["image"], output_names=["boxes", "scores", "labels"], **kwargs)
+
+
+def load_samples(directory):
+    """Returns a list of (file name, BGR frame, person boxes) from a labeled sample directory."""
+    with open(os.path.join(directory, "labels.json"), "r") as f:
+        labels = json.load(f)
+    samples = []
+    for name in sorted(labels):
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is None:
+            print(f"Skipping unreadable sample {name}")
+            continue
+        samples.append((name, frame, np.asarray(labels[name], dtype=np.float32).reshape(-1, 4)))
+    return samples
+
+
+class _CalibrationReader:
+    """Feeds preprocessed sample frames to ONNX Runtime static quantization."""
+
+    def __init__(self, input_name, engine, frames):
+        self._inputs = iter([{input_name: engine.preprocess([frame])[0].numpy()} for frame in frames])
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+
+def quantize_onnx(float_path, int8_path, mode, calibration_frames=None):
+    """Writes an INT8 copy of the ONNX model using dynamic or static quantization."""
+    import onnxruntime
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat
+
+    if mode == "dynamic":
+        quantize_dynamic(float_path, int8_path, weight_type=QuantType.QUInt8)
+        return
+    if not calibration_frames:
+        raise ValueError("Static quantization needs calibration frames (--samples)")
+    input_name = onnxruntime.InferenceSession(
+        float_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    engine = DetectionEngine(backend=DetectorBackend(), device="cpu", max_batch_size=1)  # Only used to preprocess
+    reader = _CalibrationReader(input_name, engine, calibration_frames)
+    quantize_static(float_path, int8_path, reader, quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def evaluate(engine, samples, confidence_threshold=0.5, iou_threshold=0.5):
+    """Person precision and recall of an engine on labeled samples."""
+    tp = fp = fn = 0
+    for _, frame, ground_truth in samples:
+        predictions = engine.detect_batch([frame])[0]
+        boxes, _ = person_boxes(predictions, confidence_threshold)
+        t, f, n = match_boxes(boxes, ground_truth, iou_threshold)
+        tp, fp, fn = tp + t, fp + f, fn + n
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    return precision, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["torchscript", "onnx"], required=True)
+    parser.add_argument("--output", help="output file (default: the path the backend loads from)")
+    parser.add_argument("--quantize", choices=["dynamic", "static"], help="also write an INT8 ONNX model")
+    parser.add_argument("--samples", help="labeled sample directory for calibration and the accuracy check")
+    parser.add_argument("--max-recall-drop", type=float, default=0.05,
+                        help="fail if the exported model loses more recall than this")
+    parser.add_argument("--no-pretrained", action="store_true", help="use random weights (no download)")
+    args = parser.parse_args()
+
+    if args.quantize and args.backend != "onnx":
+        parser.error("--quantize is only supported for the onnx backend")
+
+    if args.no_pretrained:
+        model = ssd300_vgg16(pretrained=False, pretrained_backbone=False).eval()
+    else:
+        model = load_ssd_model()
+
+    output = args.output or BACKEND_MODEL_PATHS[args.backend]
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if args.backend == "torchscript":
+        export_torchscript(model, output)
+    else:
+        export_onnx(model, output)
+    print(f"Exported {args.backend} model to {output}")
+
+    samples = load_samples(args.samples) if args.samples else []
+    exported = [(args.backend, output)]
+    if args.quantize:
+        int8_output = os.path.splitext(output)[0] + ".int8.onnx"
+        quantize_onnx(output, int8_output, args.quantize, [frame for _, frame, _ in samples])
+        print(f"Wrote {args.quantize} INT8 model to {int8_output}")
+        exported.append(("onnx-int8", int8_output))
+
+    if not samples:
+        print("No labeled samples given (--samples); skipping the accuracy check.")
+        return
+
+    reference = DetectionEngine(backend=EagerBackend(model, "cpu"), device="cpu")
+    ref_precision, ref_recall = evaluate(reference, samples)
+    print(f"{'eager (float)':<16} precision {ref_precision:.3f}  recall {ref_recall:.3f}")
+    failed = False
+    for name, path in exported:
+        engine = DetectionEngine(backend=create_backend(name, device="cpu", model_path=path), device="cpu")
+        precision, recall = evaluate(engine, samples)
+        print(f"{name:<16} precision {precision:.3f}  recall {recall:.3f}  "
+              f"(recall drop {ref_recall - recall:+.3f})")
+        if ref_recall - recall > args.max_recall_drop:
+            failed = True
+    if failed:
+        raise SystemExit(f"Exported model lost more than {args.max_recall_drop:.2f} recall")
+
+
+if __name__ == "__main__":
+    main()
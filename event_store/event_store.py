@@ -0,0 +1,281 @@
+import os
+import logging
+import re
+import json
+import time
+import sqlite3
+import threading
+import cv2
+import numpy as np
+from capture_image import encode_jpeg, ImageWriter
+
+logger = logging.getLogger(__name__)
+
+# SQLite database of detection events, and the folder for their thumbnails and clips
+EVENTS_DB_FILE = "events/events.db"
+EVENT_MEDIA_DIR = "events/media"
+
+# Thumbnails kept for the history contact sheet
+EVENT_THUMBNAIL_WIDTH = 160
+EVENT_THUMBNAIL_QUALITY = 70
+
+# Retention: events older than EVENT_RETENTION_DAYS are deleted, and the media of
+# the oldest events is deleted while the media folder is above EVENT_MEDIA_MAX_MB
+EVENT_RETENTION_DAYS = 14
+EVENT_MEDIA_MAX_MB = 500
+EVENT_PRUNE_INTERVAL = 3600.0  # Seconds between pruning runs
+
+# Events per history page (one contact sheet)
+EVENTS_PAGE_SIZE = 9
+CONTACT_SHEET_COLUMNS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    camera TEXT NOT NULL,
+    track_ids TEXT NOT NULL,
+    boxes TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    thumbnail TEXT,
+    clip TEXT
+);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_camera_timestamp ON events (camera, timestamp);
+"""
+
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)\s*([mhdw])$")
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_since(text, now=None):
+    """
+    Parses the argument of /events into a Unix timestamp: a duration such as
+    "30m", "2h", "3d" or "1w" back from now, or a date "YYYY-MM-DD[ HH:MM]".
+    Returns None if the text is not understood.
+    """
+    now = time.time() if now is None else now
+    text = text.strip().lower()
+    match = _DURATION.match(text)
+    if match:
+        return now - float(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    for date_format in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, date_format))
+        except ValueError:
+            continue
+    return None
+
+
+def _media_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def _remove_media(path):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class EventStore:
+    """
+    Local SQLite record of person detections, indexed by time and camera.
+
+    Every event stores the camera, the time, the person boxes, scores and
+    track IDs, and the paths of a small thumbnail and (once written) the
+    video clip. Thumbnails are written by a background ImageWriter. A pruning
+    thread enforces the retention time and the media size limit.
+    """
+
+    def __init__(self, path=EVENTS_DB_FILE, media_dir=EVENT_MEDIA_DIR, retention_days=EVENT_RETENTION_DAYS,
+                 media_max_mb=EVENT_MEDIA_MAX_MB):
+        self.path = path
+        self.media_dir = media_dir
+        self.retention_days = retention_days
+        self.media_max_bytes = media_max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        self._stop_event = threading.Event()
+        self._pruner = None
+
+    def _connection(self):
+        # Opened on first use, so importing the module does not touch the disk
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            os.makedirs(self.media_dir, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            # WAL with synchronous=NORMAL fsyncs at checkpoints instead of on every insert
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            self._writer = ImageWriter()
+        return self._db
+
+    def add_event(self, camera, timestamp, boxes, scores, track_ids, image=None):
+        """
+        Records a detection; timestamp is a Unix time. If image (the annotated
+        frame) is given, a thumbnail of it is saved. Returns the event ID.
+        """
+        boxes = [[round(float(v), 1) for v in box] for box in boxes]
+        scores = [round(float(s), 3) for s in scores]
+        with self._lock:
+            db = self._connection()
+            cursor = db.execute(
+                "INSERT INTO events (timestamp, camera, track_ids, boxes, scores) VALUES (?, ?, ?, ?, ?)",
+                (timestamp, camera, json.dumps([int(t) for t in track_ids]), json.dumps(boxes), json.dumps(scores)))
+            event_id = cursor.lastrowid
+            if image is not None:
+                thumbnail = encode_jpeg(image, EVENT_THUMBNAIL_QUALITY, EVENT_THUMBNAIL_WIDTH)
+                if thumbnail is not None:
+                    path = os.path.join(self.media_dir, f"event_{event_id}.jpg")
+                    self._writer.write(path, thumbnail)
+                    db.execute("UPDATE events SET thumbnail = ? WHERE id = ?", (path, event_id))
+            db.commit()
+            return event_id
+
+    def set_clip(self, path, event_ids):
+        """Attaches a saved clip to the events it covers."""
+        with self._lock:
+            db = self._connection()
+            db.executemany("UPDATE events SET clip = ? WHERE id = ?", [(path, event_id) for event_id in event_ids])
+            db.commit()
+
+    def _where(self, since, camera):
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if camera is not None:
+            conditions.append("camera = ?")
+            params.append(camera)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def query(self, since=None, camera=None, limit=EVENTS_PAGE_SIZE, offset=0):
+        """Returns events (as dicts) newest first."""
+        where, params = self._where(since, camera)
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT * FROM events{where} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        events = []
+        for row in rows:
+            event = dict(row)
+            for key in ("track_ids", "boxes", "scores"):
+                event[key] = json.loads(event[key])
+            events.append(event)
+        return events
+
+    def count(self, since=None, camera=None):
+        where, params = self._where(since, camera)
+        with self._lock:
+            return self._connection().execute(f"SELECT COUNT(*) FROM events{where}", params).fetchone()[0]
+
+    def prune(self, now=None):
+        """
+        Deletes events past the retention time, then the media of the oldest
+        events while the media folder is above the size limit.
+        Returns (events deleted, events whose media was deleted for space).
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.retention_days * 86400
+        removed_media = 0
+        with self._lock:
+            db = self._connection()
+            expired = db.execute("SELECT id, thumbnail, clip FROM events WHERE timestamp < ?", (cutoff,)).fetchall()
+            db.execute("DELETE FROM events WHERE timestamp < ?", (cutoff,))
+            clips_in_use = {row[0] for row in db.execute("SELECT DISTINCT clip FROM events WHERE clip IS NOT NULL")}
+            for row in expired:
+                _remove_media(row["thumbnail"])
+                # One clip can cover several events; keep it while any of them remains
+                if row["clip"] not in clips_in_use:
+                    _remove_media(row["clip"])
+
+            rows = db.execute("SELECT id, thumbnail, clip FROM events "
+                              "WHERE thumbnail IS NOT NULL OR clip IS NOT NULL ORDER BY timestamp").fetchall()
+            clips = {row["clip"] for row in rows if row["clip"]}
+            total = sum(_media_size(row["thumbnail"]) for row in rows) + sum(_media_size(clip) for clip in clips)
+            for row in rows:
+                if total <= self.media_max_bytes:
+                    break
+                total -= _media_size(row["thumbnail"]) + _media_size(row["clip"])
+                _remove_media(row["thumbnail"])
+                _remove_media(row["clip"])
+                db.execute("UPDATE events SET thumbnail = NULL, clip = NULL WHERE id = ? OR clip = ?",
+                           (row["id"], row["clip"]))
+                removed_media += 1
+            db.commit()
+        return len(expired), removed_media
+
+    def start_pruning(self, interval=EVENT_PRUNE_INTERVAL):
+        """Prunes now and then every interval seconds on a background thread."""
+        def run():
+            while True:
+                try:
+                    events, media = self.prune()
+                    if events or media:
+                        logger.info("Event retention: deleted %d events, media of %d events", events, media)
+                except sqlite3.Error as e:
+                    logger.error("Failed to prune events: %s", e)
+                if self._stop_event.wait(interval):
+                    break
+
+        self._pruner = threading.Thread(target=run, name="event-pruner", daemon=True)
+        self._pruner.start()
+        return self
+
+    def close(self):
+        self._stop_event.set()
+        if self._pruner is not None:
+            self._pruner.join()
+        with self._lock:
+            if self._writer is not None:
+                self._writer.stop()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def contact_sheet(events, first=1, columns=CONTACT_SHEET_COLUMNS, cell_width=EVENT_THUMBNAIL_WIDTH):
+    """
+    Tiles the thumbnails of the events into one image, each labelled with its
+    number (counting from first) and its time. Missing thumbnails are left grey.
+    Returns the sheet as JPEG bytes.
+    """
+    cell_height = cell_width * 3 // 4
+    rows = max(1, (len(events) + columns - 1) // columns)
+    sheet = np.full((rows * cell_height, columns * cell_width, 3), 64, dtype=np.uint8)
+    for i, event in enumerate(events):
+        y, x = (i // columns) * cell_height, (i % columns) * cell_width
+        thumbnail = cv2.imread(event["thumbnail"]) if event.get("thumbnail") else None
+        if thumbnail is not None:
+            sheet[y:y + cell_height, x:x + cell_width] = cv2.resize(thumbnail, (cell_width, cell_height))
+        label = f"{first + i} {time.strftime('%H:%M:%S', time.localtime(event['timestamp']))}"
+        cv2.putText(sheet, label, (x + 4, y + cell_height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 3)
+        cv2.putText(sheet, label, (x + 4, y + cell_height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    return encode_jpeg(sheet, 85)
+
+
+def format_events(events, total, offset, since):
+    """Telegram caption for one history page."""
+    since_text = time.strftime("%Y-%m-%d %H:%M", time.localtime(since))
+    if not events:
+        return f"No events since {since_text}."
+    lines = [f"Events since {since_text}: {total} (showing {offset + 1}-{offset + len(events)})"]
+    for i, event in enumerate(events):
+        when = time.strftime("%m-%d %H:%M:%S", time.localtime(event["timestamp"]))
+        tracks = ", ".join(f"#{t}" for t in event["track_ids"])
+        best = max(event["scores"]) if event["scores"] else 0.0
+        clip = ", clip" if event.get("clip") else ""
+        lines.append(f"{offset + i + 1}. {when} {event['camera']} {tracks} ({best:.2f}{clip})")
+    return "\n".join(lines)
+
+
+# Shared by the pipeline (which records events) and the Telegram listener (which queries them)
+event_store = EventStore()
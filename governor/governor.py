@@ -0,0 +1,187 @@
+import os
+import logging
+import json
+import time
+import threading
+from system_stats import control_columns
+
+logger = logging.getLogger(__name__)
+
+# Seconds between governor decisions, and the telemetry window each decision looks at
+GOVERNOR_INTERVAL = 5.0
+GOVERNOR_WINDOW = 15.0
+
+# Budgets: step down a level when the hottest control zone (CONTROL_ZONES in
+# system_stats.py) is above TEMP_BUDGET,
+# detection latency (frame capture to SSD result) above LATENCY_TARGET_MS or CPU
+# usage above CPU_BUDGET. Step back up only when all of them are clearly below
+# (TEMP_MARGIN degrees, LATENCY_RECOVER_RATIO of the target, CPU_MARGIN percent)
+TEMP_BUDGET = 70.0
+TEMP_MARGIN = 5.0
+LATENCY_TARGET_MS = 1000.0
+LATENCY_RECOVER_RATIO = 0.6
+CPU_BUDGET = 90.0
+CPU_MARGIN = 20.0
+
+# Seconds a level must hold before stepping down again (so the window shows its
+# effect) and before stepping back up (so the governor does not oscillate)
+STEP_DOWN_AFTER = 15.0
+STEP_UP_AFTER = 180.0
+
+# Every decision is appended to this JSON-lines file; it is rotated to .1 at GOVERNOR_LOG_MAX_BYTES
+GOVERNOR_LOG_FILE = "logs/governor.log"
+GOVERNOR_LOG_MAX_BYTES = 1024 * 1024
+
+# Settings from full quality (level 0) to lowest load. capture_fps None means
+# every frame; detector_input is (width, height) and can not go below
+# SSD_MIN_INPUT_SIZE; a level may also name a detector "backend" to switch to.
+GOVERNOR_LEVELS = [
+    {"capture_fps": None, "motion_resolution": (320, 240), "detector_input": (300, 300), "batch_size": 4},
+    {"capture_fps": 15, "motion_resolution": (320, 240), "detector_input": (300, 300), "batch_size": 2},
+    {"capture_fps": 10, "motion_resolution": (240, 180), "detector_input": (268, 268), "batch_size": 2},
+    {"capture_fps": 5, "motion_resolution": (160, 120), "detector_input": (268, 268), "batch_size": 1},
+]
+
+
+def _hottest_average(stats):
+    """Highest window average among the control zone columns."""
+    values = [stats[name][1] for name in control_columns(stats)]
+    return max(values) if values else None
+
+
+class Governor:
+    """
+    Thermal- and load-aware governor for the capture rate, motion resolution
+    and detector settings.
+
+    Every GOVERNOR_INTERVAL seconds it reads the telemetry window and moves
+    one step along GOVERNOR_LEVELS: down when the temperature, detection
+    latency or CPU usage is over budget, up when all of them are comfortably
+    below. apply(settings) puts a level into effect. Every decision, including
+    holding the current level, is written to the decision log with the
+    figures it was based on.
+    """
+
+    def __init__(self, telemetry, apply, levels=GOVERNOR_LEVELS, interval=GOVERNOR_INTERVAL,
+                 window=GOVERNOR_WINDOW, latency_metric="detection_latency_ms", log_file=GOVERNOR_LOG_FILE):
+        self.telemetry = telemetry
+        self.apply = apply
+        self.levels = levels
+        self.interval = interval
+        self.window = window
+        self.latency_metric = latency_metric
+        self.log_file = log_file
+        self.level = 0
+        self.changes = 0
+        self._last_change = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def measure(self):
+        """The figures a decision is based on: hottest control zone (C), latency (ms) and CPU (%)."""
+        stats = self.telemetry.window_stats(self.window)
+        # Temperatures are averaged over the window so a single reading does not
+        # trip the governor; latency uses the worst value, as that is what users wait for
+        latency = stats.get(self.latency_metric)
+        cpu = stats.get("cpu")
+        return {"temperature": _hottest_average(stats),
+                "latency_ms": latency[2] if latency else None,
+                "cpu": cpu[1] if cpu else None}
+
+    def decide(self, measurements, now):
+        """Returns (level, reason) for the measurements; does not apply anything."""
+        temperature = measurements["temperature"]
+        latency = measurements["latency_ms"]
+        cpu = measurements["cpu"]
+        held = now - self._last_change if self._last_change is not None else float("inf")
+
+        over = []
+        if temperature is not None and temperature > TEMP_BUDGET:
+            over.append(f"temperature {temperature:.1f}C > {TEMP_BUDGET:.0f}C")
+        if latency is not None and latency > LATENCY_TARGET_MS:
+            over.append(f"latency {latency:.0f} ms > {LATENCY_TARGET_MS:.0f} ms")
+        if cpu is not None and cpu > CPU_BUDGET:
+            over.append(f"CPU {cpu:.0f}% > {CPU_BUDGET:.0f}%")
+        if over:
+            if self.level == len(self.levels) - 1:
+                return self.level, "over budget at the lowest level: " + ", ".join(over)
+            if held < STEP_DOWN_AFTER:
+                return self.level, "over budget, waiting for the last change to settle: " + ", ".join(over)
+            return self.level + 1, "over budget: " + ", ".join(over)
+
+        comfortable = ((temperature is None or temperature < TEMP_BUDGET - TEMP_MARGIN)
+                       and (latency is None or latency < LATENCY_TARGET_MS * LATENCY_RECOVER_RATIO)
+                       and (cpu is None or cpu < CPU_BUDGET - CPU_MARGIN))
+        if self.level > 0 and comfortable:
+            if held < STEP_UP_AFTER:
+                return self.level, "below budget, waiting before stepping up"
+            return self.level - 1, "below budget"
+        return self.level, "within budget"
+
+    def step(self, now=None):
+        """Takes one decision, applies a level change and logs it; returns the decision record."""
+        now = time.monotonic() if now is None else now
+        measurements = self.measure()
+        level, reason = self.decide(measurements, now)
+        record = {"time": round(time.time(), 3), "level": level, "previous_level": self.level,
+                  "reason": reason}
+        record.update({name: None if value is None else round(value, 1) for name, value in measurements.items()})
+        if level != self.level:
+            try:
+                self.apply(self.levels[level])
+            except Exception as e:
+                record["level"] = self.level
+                record["reason"] = f"{reason}; failed to apply level {level}: {e}"
+            else:
+                logger.info("Governor: level %d -> %d (%s)", self.level, level, reason)
+                self.level = level
+                self.changes += 1
+                self._last_change = now
+                record["settings"] = self.levels[level]
+        self._log(record)
+        return record
+
+    def _log(self, record):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.log_file)), exist_ok=True)
+            if os.path.exists(self.log_file) and os.path.getsize(self.log_file) >= GOVERNOR_LOG_MAX_BYTES:
+                os.replace(self.log_file, self.log_file + ".1")
+            with open(self.log_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning("Failed to write the governor log: %s", e)
+
+    def start(self):
+        """Applies level 0 and starts deciding on a background thread."""
+        self.apply(self.levels[self.level])
+        self._last_change = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="governor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.step()
+
+    def format_stats(self):
+        return f"governor: level {self.level} of {len(self.levels) - 1}, {self.changes} changes"
+
+
+def read_decisions(log_file=GOVERNOR_LOG_FILE):
+    """Returns the logged decisions (oldest first) for reviewing the tuning."""
+    decisions = []
+    for path in (log_file + ".1", log_file):
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    decisions.append(json.loads(line))
+                except ValueError:
+                    continue
+    return decisions
@@ -0,0 +1,150 @@
+"""
+Runs the governor and the fan curve against a simulated sysfs tree, so the
+budgets and levels can be tuned without a Jetson (or without heating one up).
+
+A temporary directory gets three thermal zones and a pwm-fan target_pwm file.
+A simple thermal model writes the CPU and GPU zone temperatures: they move
+towards the ambient temperature plus the heat of the current level's load,
+minus what the fan (driven by the real fan curve) removes. The third zone,
+PMIC-Die, reads a constant 100C as on the Nano and must drive neither the fan
+nor the governor. Detection latency follows the load and rises when the chip
+is hot enough to throttle. The ambient temperature climbs and falls again over
+the run, like a warm afternoon.
+
+    python3 simulate_governor.py --minutes 60 --speed 60
+
+Every decision goes to the decision log (printed at the end) exactly as on the device.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import system_stats
+from system_stats import TelemetrySampler, TELEMETRY_INTERVAL, control_fan_on_change
+from governor import Governor, GOVERNOR_LEVELS, GOVERNOR_INTERVAL, GOVERNOR_WINDOW, read_decisions
+from structured_logging import configure_logging
+
+# Thermal model (Celsius, seconds)
+HEAT_AT_FULL_LOAD = 40.0      # Rise above ambient at level 0 with the fan off
+FAN_COOLING = 18.0            # Drop at full fan speed
+THERMAL_TIME_CONSTANT = 90.0
+THROTTLE_TEMP = 75.0          # Above this the simulated chip slows down
+# Detection latency at level 0 (ms); lower levels cost less
+BASE_LATENCY_MS = 600.0
+# The Nano's PMIC-Die zone reads this whatever the load
+PMIC_DIE_TEMP = 100.0
+
+
+def make_sysfs(root, zones=("CPU-therm", "GPU-therm", "PMIC-Die")):
+    """Creates class/thermal/thermal_zone*/{type,temp} and devices/pwm-fan/target_pwm under root."""
+    for i, name in enumerate(zones):
+        zone_dir = os.path.join(root, f"class/thermal/thermal_zone{i}")
+        os.makedirs(zone_dir)
+        with open(os.path.join(zone_dir, "type"), "w") as f:
+            f.write(name + "\n")
+    os.makedirs(os.path.join(root, "devices/pwm-fan"))
+    with open(os.path.join(root, system_stats.FAN_PWM_FILE), "w") as f:
+        f.write("0\n")
+
+
+def write_temperatures(root, temperatures):
+    for i, temperature in enumerate(temperatures):
+        with open(os.path.join(root, f"class/thermal/thermal_zone{i}/temp"), "w") as f:
+            f.write(f"{int(temperature * 1000)}\n")
+
+
+def read_pwm(root):
+    with open(os.path.join(root, system_stats.FAN_PWM_FILE), "r") as f:
+        return int(f.read().strip() or 0)
+
+
+def level_load(settings):
+    """Relative compute load of a level: frames taken times detector pixels, against level 0."""
+    full = GOVERNOR_LEVELS[0]
+    fps = settings["capture_fps"] or 30.0
+    full_fps = full["capture_fps"] or 30.0
+    pixels = settings["detector_input"][0] * settings["detector_input"][1]
+    full_pixels = full["detector_input"][0] * full["detector_input"][1]
+    return min(1.0, 0.3 + 0.7 * (fps / full_fps) * (pixels / full_pixels))
+
+
+def ambient_at(t, duration, low, high):
+    """Ambient temperature rising from low to high at half time and back."""
+    half = duration / 2.0
+    return low + (high - low) * (1.0 - abs(t - half) / half)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60.0, help="simulated duration")
+    parser.add_argument("--speed", type=float, default=60.0, help="simulated seconds per real second")
+    parser.add_argument("--ambient", type=float, nargs=2, default=[30.0, 50.0], metavar=("LOW", "HIGH"),
+                        help="ambient temperature at the start/end and at half time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    configure_logging()  # Shows the level changes and fan switches logged by the governor and system_stats
+
+    root = tempfile.mkdtemp(prefix="sysfs-")
+    log_file = os.path.join(root, "governor.log")
+    try:
+        make_sysfs(root)
+        system_stats.SYSFS_ROOT = root  # The fan curve writes to the fake PWM file
+        duration = args.minutes * 60.0
+        state = {"settings": GOVERNOR_LEVELS[0], "temperature": args.ambient[0], "latency_ms": BASE_LATENCY_MS}
+        write_temperatures(root, [state["temperature"]] * 2 + [PMIC_DIE_TEMP])
+
+        sampler = TelemetrySampler(interval=TELEMETRY_INTERVAL / args.speed, sysfs_root=root)
+        sampler.add_source("detection_latency_ms", lambda: state["latency_ms"])
+        sampler.add_listener(control_fan_on_change)
+        sampler.start()
+
+        def apply(settings):
+            state["settings"] = settings
+
+        governor = Governor(sampler, apply, window=GOVERNOR_WINDOW / args.speed, log_file=log_file)
+
+        seconds_at_level = [0.0] * len(GOVERNOR_LEVELS)
+        max_temperature = state["temperature"]
+        sim_time = 0.0
+        next_step = GOVERNOR_INTERVAL
+        started = time.monotonic()
+        while sim_time < duration:
+            # One simulated second per iteration
+            ambient = ambient_at(sim_time, duration, *args.ambient)
+            load = level_load(state["settings"])
+            pwm = read_pwm(root)
+            target = ambient + HEAT_AT_FULL_LOAD * load - FAN_COOLING * pwm / 255.0
+            state["temperature"] += (target - state["temperature"]) / THERMAL_TIME_CONSTANT
+            throttle = 1.0 + max(0.0, state["temperature"] - THROTTLE_TEMP) * 0.15
+            state["latency_ms"] = BASE_LATENCY_MS * load * throttle * random.uniform(0.85, 1.15)
+            write_temperatures(root, [state["temperature"], state["temperature"] - 1.5, PMIC_DIE_TEMP])
+            max_temperature = max(max_temperature, state["temperature"])
+            seconds_at_level[governor.level] += 1.0
+
+            if sim_time >= next_step:
+                next_step += GOVERNOR_INTERVAL
+                previous = governor.level
+                record = governor.step(now=sim_time)
+                if record["level"] != previous or int(sim_time) % 300 == 0:
+                    print(f"{int(sim_time) // 60:3d}:{int(sim_time) % 60:02d}  ambient {ambient:4.1f}C  "
+                          f"temp {record['temperature']}C  fan {pwm:3d}  latency {record['latency_ms']} ms  "
+                          f"level {record['level']}  {record['reason']}")
+
+            sim_time += 1.0
+            time.sleep(max(0.0, started + sim_time / args.speed - time.monotonic()))
+
+        sampler.stop()
+        decisions = read_decisions(log_file)
+        print(f"\nMax temperature {max_temperature:.1f}C, {governor.changes} level changes, "
+              f"{len(decisions)} decisions logged")
+        for level, seconds in enumerate(seconds_at_level):
+            print(f"level {level}: {seconds / 60:5.1f} min  {GOVERNOR_LEVELS[level]}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,200 @@
+import logging
+import cv2
+import numpy as np
 import telegram
 import time
 import threading
-import json
-import os
-from bot_config import bot, chat_id
-from send_telegram import store_message_id, MESSAGE_IDS_FILE, send_message_via_telegram
-from system_stats import get_temperature, get_cpu_usage, get_ram_usage
+from bot_config import bot
+from send_telegram import (send_message_via_telegram, delete_all_messages, reply_via_telegram, reply_photo_via_telegram,
+                           reply_document_via_telegram, answer_callback_query)
+from system_stats import get_temperature, get_cpu_usage, get_ram_usage, telemetry
+from event_store import event_store, parse_since, contact_sheet, format_events, EVENTS_PAGE_SIZE
+from zones import zone_store
+from profiler import profile, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Period shown by the History button and by /events without an argument
+HISTORY_DEFAULT_SINCE = "1d"
+
+# Period covered by /chart and /csv without an argument
+TELEMETRY_DEFAULT_WINDOW = "1h"
+
+# Long-poll timeout of the listener (seconds): Telegram answers as soon as an
+# update arrives, so a long timeout only means fewer requests while nothing happens
+LISTENER_POLL_TIMEOUT = 30
+
+UNKNOWN_COMMAND_TEXT = ("Unknown command. Available commands are: start, stop, status, clean, system, history, "
+                        "/events <since> (e.g. /events 2h, /events 2024-05-01), /chart <window>, /csv <window>, "
+                        "/zones [camera], /zones clear [camera], /profile [seconds].")
+
+ZONES_HELP_TEXT = ("Paint on this snapshot and send it back with the caption /zones {camera} [sensitivity]: "
+                   "red areas are ignored; if you paint green areas, only they are watched.")
+
+_state_condition = threading.Condition()
+_state_version = 0
+_state_changed_at = time.monotonic()
+
+class StateEvent(threading.Event):
+    """threading.Event that also wakes up wait_for_state_change() when it is set or cleared."""
+
+    def set(self):
+        super().set()
+        _notify_state_change()
+
+    def clear(self):
+        super().clear()
+        _notify_state_change()
+
+def _notify_state_change():
+    global _state_version, _state_changed_at
+    with _state_condition:
+        _state_version += 1
+        _state_changed_at = time.monotonic()
+        _state_condition.notify_all()
+
+def state_version():
+    """Counter of state changes, to pass to wait_for_state_change()."""
+    with _state_condition:
+        return _state_version
+
+def state_changed_at():
+    """time.monotonic() of the last state change, e.g. the Start button being handled."""
+    with _state_condition:
+        return _state_changed_at
+
+def wait_for_state_change(version, timeout=None):
+    """
+    Blocks until one of the state events changed after state_version() returned
+    version, or until the timeout. Returns the current version.
+    """
+    with _state_condition:
+        _state_condition.wait_for(lambda: _state_version != version, timeout)
+        return _state_version
 
 # Create threading.Event objects for system activity and exit events
-system_active_event = threading.Event()  # Initially, the system is idle (not set)
-exit_event = threading.Event()  # This will signal when the system should exit
-image_detection_paused = threading.Event()  # Event to manage image detection pausing
+system_active_event = StateEvent()  # Initially, the system is idle (not set)
+exit_event = StateEvent()  # This will signal when the system should exit
+image_detection_paused = StateEvent()  # Event to manage image detection pausing
 
 # Set the image detection paused to True initially to make sure it's paused until "Start" is pressed
 image_detection_paused.set()  # Start in a paused state
 
-def delete_all_messages():
-    """Deletes all messages stored in the message_ids.json file."""
-    if os.path.exists(MESSAGE_IDS_FILE):
-        with open(MESSAGE_IDS_FILE, 'r') as f:
-            message_ids = json.load(f)
+def send_event_history(chat, since, offset=0):
+    """Sends one page of the event history: a contact sheet of thumbnails with the event list."""
+    total = event_store.count(since)
+    events = event_store.query(since, limit=EVENTS_PAGE_SIZE, offset=offset)
+    text = format_events(events, total, offset, since)
 
-        for message_id in message_ids:
-            try:
-                bot.delete_message(chat_id=chat_id, message_id=message_id)
-            except Exception as e:
-                print(f"Failed to delete message {message_id}: {e}")
+    # Page buttons carry the query in their callback data: history:<since>:<offset>
+    buttons = []
+    if offset > 0:
+        buttons.append({"text": "Newer",
+                        "callback_data": f"history:{int(since)}:{max(0, offset - EVENTS_PAGE_SIZE)}"})
+    if offset + len(events) < total:
+        buttons.append({"text": "Older", "callback_data": f"history:{int(since)}:{offset + EVENTS_PAGE_SIZE}"})
+    reply_markup = {"inline_keyboard": [buttons]} if buttons else None
 
-        # Clear the message IDs after deletion
-        with open(MESSAGE_IDS_FILE, 'w') as f:
-            json.dump([], f)
+    if events:
+        reply_photo_via_telegram(chat, contact_sheet(events, offset + 1), caption=text, reply_markup=reply_markup)
+    else:
+        reply_via_telegram(chat, text)
+
+def send_telemetry(chat, command, argument):
+    """Sends the telemetry history of the last window as a chart (/chart) or a CSV file (/csv)."""
+    since = parse_since(argument or TELEMETRY_DEFAULT_WINDOW)
+    if since is None:
+        reply_via_telegram(chat, f"Usage: {command} 10m | 1h")
+    elif command == '/chart':
+        reply_photo_via_telegram(chat, telemetry.render_chart(time.time() - since),
+                                 caption=f"Telemetry, last {argument or TELEMETRY_DEFAULT_WINDOW}")
+    else:
+        csv = telemetry.to_csv(time.time() - since).encode()
+        reply_document_via_telegram(chat, csv, time.strftime("telemetry_%Y%m%d--%H%M%S.csv"))
+
+def _zone_camera(chat, argument):
+    """The camera a /zones command is for (the only camera if none is named), or None after a usage reply."""
+    names = zone_store.names()
+    if argument:
+        matches = [name for name in names if name.lower() == argument]
+    else:
+        matches = names if len(names) == 1 else []
+    if matches:
+        return matches[0]
+    reply_via_telegram(chat, f"Usage: /zones <camera>, cameras: {', '.join(names)}")
+    return None
+
+def send_zones(chat, argument):
+    """/zones [camera]: the zones of the cameras, each with a gray snapshot to paint new zones on."""
+    command, _, name = argument.partition(' ')
+    if command == 'clear':
+        name = _zone_camera(chat, name.strip())
+        if name is not None:
+            zone_store.clear(name)
+            reply_via_telegram(chat, f"Zones of {name} removed: the whole frame is watched.")
+        return
+    names = [_zone_camera(chat, argument)] if argument else zone_store.names()
+    for name in names:
+        if name is None:
+            continue
+        text = zone_store.camera(name).describe()
+        snapshot = zone_store.snapshot(name)
+        if snapshot is None:
+            reply_via_telegram(chat, f"{text}\nStart the system to get a snapshot to draw on.")
+        else:
+            _, jpeg = cv2.imencode(".jpg", snapshot)
+            reply_photo_via_telegram(chat, jpeg.tobytes(), caption=f"{text}\n{ZONES_HELP_TEXT.format(camera=name)}")
 
-        print("All messages have been deleted.")
+def handle_zone_upload(update):
+    """A painted snapshot (photo or image file) sent with the caption /zones [camera] [sensitivity]."""
+    chat = update.message.chat_id
+    caption = (update.message.caption or '').strip().lower()
+    if not caption.startswith('/zones'):
+        reply_via_telegram(chat, "To change the zones, send the image with the caption /zones [camera] [sensitivity].")
+        return
+    arguments = caption[len('/zones'):].split()
+    sensitivity = 1.0
+    if arguments:
+        try:
+            sensitivity = float(arguments[-1])
+            arguments = arguments[:-1]
+        except ValueError:
+            pass
+    name = _zone_camera(chat, arguments[0] if arguments else '')
+    if name is None:
+        return
+    # The largest size of a photo; documents keep the image uncompressed
+    file_id = update.message.photo[-1].file_id if update.message.photo else update.message.document.file_id
+    data = bot.get_file(file_id).download_as_bytearray()
+    image = cv2.imdecode(np.frombuffer(bytes(data), dtype=np.uint8), cv2.IMREAD_COLOR)
+    zones = zone_store.set_drawn_mask(name, image, sensitivity) if image is not None else None
+    if zones is None:
+        text = "No zones found in the image: paint red areas to ignore or green areas to watch."
     else:
-        print("No message IDs file found. Nothing to delete.")
+        text = f"Zones updated.\n{zones.describe()}"
+    reply_via_telegram(chat, text)
+
+def send_profile(chat, argument):
+    """/profile [seconds]: samples the threads of the process and sends the top hotspots."""
+    try:
+        seconds = float(argument) if argument else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = None
+    if seconds is None or not 0 < seconds <= PROFILE_MAX_SECONDS:
+        reply_via_telegram(chat, f"Usage: /profile [seconds, at most {PROFILE_MAX_SECONDS:.0f}]")
+        return
+    reply_via_telegram(chat, f"Profiling for {seconds:.0f} s...")
+
+    def run():
+        # On its own thread, so the listener keeps answering meanwhile
+        report = profile(seconds)
+        if report is None:
+            report = "A profile is already running."
+        else:
+            logger.info("Profile for Telegram\n%s", report)
+        reply_via_telegram(chat, report[:4096])
+
+    threading.Thread(target=run, name="profile", daemon=True).start()
 
 def send_command_buttons():
     """Sends the command buttons to Telegram."""
@@ -50,21 +211,17 @@ def handle_callback_query(update):
     if message == 'start':
         image_detection_paused.clear()  # Resume image detection
         system_active_event.set()  # Activate the system
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text="System activated. Motion detection is ON.")
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, "System activated. Motion detection is ON.")
     elif message == 'stop':
         system_active_event.clear()  # Deactivate the system
         image_detection_paused.set()  # Pause image detection
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text="System deactivated. Motion detection is OFF.")
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, "System deactivated. Motion detection is OFF.")
     elif message == 'status':
         status = "active" if system_active_event.is_set() else "idle"
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text=f"The system is currently {status}.")
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, f"The system is currently {status}.")
     elif message == 'clean':
         delete_all_messages()
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text="All messages and images have been deleted.")
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, "All messages and images have been deleted.")
         image_detection_paused.set()  # Pause image detection
         send_command_buttons()  # Resend buttons after cleaning
     elif message == 'system':
@@ -72,7 +229,9 @@ def handle_callback_query(update):
         cpu = get_cpu_usage()
         ram = get_ram_usage()
 
-        if temp is not None and cpu is not None and ram is not None:
+        if telemetry.snapshot():
+            status_message = telemetry.format_summary()
+        elif temp is not None and cpu is not None and ram is not None:
             status_message = (
                 f"CPU Temperature: {temp:.2f}°C\n"
                 f"CPU Usage: {cpu:.1f}%\n"
@@ -80,21 +239,20 @@ def handle_callback_query(update):
             )
         else:
             status_message = "Error reading system stats."
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text=status_message)
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, status_message)
+    elif message == 'history':
+        send_event_history(query.message.chat_id, parse_since(HISTORY_DEFAULT_SINCE))
+    elif message.startswith('history:'):
+        _, since, offset = message.split(':')
+        send_event_history(query.message.chat_id, float(since), int(offset))
     elif message == 'exit':
         exit_event.set()  # Signal the main program to exit
-        sent_message = bot.send_message(chat_id=query.message.chat_id, text="Exiting the system...")
-        store_message_id(sent_message.message_id)
-        print("Exit command received. Exiting the system.")
+        reply_via_telegram(query.message.chat_id, "Exiting the system...")
+        logger.info("Exit command received. Exiting the system.")
     else:
-        sent_message = bot.send_message(
-            chat_id=query.message.chat_id,
-            text="Unknown command. Available commands are: start, stop, status, clean, system."
-        )
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(query.message.chat_id, UNKNOWN_COMMAND_TEXT)
 
-    query.answer()  # Acknowledge the callback query
+    answer_callback_query(query.id)  # Acknowledge the callback query
 
 def handle_text_message(update):
     """Handle text commands sent via Telegram."""
@@ -104,12 +262,22 @@ def handle_text_message(update):
         # Resend command buttons
         send_command_buttons()
         image_detection_paused.set()  # Pause image detection
+    elif message.split(' ')[0] in ('/chart', '/csv'):
+        command, _, argument = message.partition(' ')
+        send_telemetry(update.message.chat_id, command, argument.strip())
+    elif message.startswith('/events') or message == 'history':
+        argument = message[len('/events'):].strip() if message.startswith('/events') else ''
+        since = parse_since(argument or HISTORY_DEFAULT_SINCE)
+        if since is None:
+            reply_via_telegram(update.message.chat_id, "Usage: /events 30m | 2h | 3d | 1w | YYYY-MM-DD [HH:MM]")
+        else:
+            send_event_history(update.message.chat_id, since)
+    elif message.split(' ')[0] == '/zones':
+        send_zones(update.message.chat_id, message[len('/zones'):].strip())
+    elif message.split(' ')[0] == '/profile':
+        send_profile(update.message.chat_id, message[len('/profile'):].strip())
     else:
-        sent_message = bot.send_message(
-            chat_id=update.message.chat_id,
-            text="Unknown command. Available commands are: start, stop, status, clean, system."
-        )
-        store_message_id(sent_message.message_id)
+        reply_via_telegram(update.message.chat_id, UNKNOWN_COMMAND_TEXT)
 
 def idle_mode_listener():
     """Manually polls for new messages and handles them."""
@@ -118,26 +286,28 @@ def idle_mode_listener():
         updates = bot.get_updates()
         update_id = updates[-1].update_id + 1 if updates else None
     except Exception as e:
-        print(f"Error while fetching updates: {e}")
+        logger.warning("Error while fetching updates: %s", e)
         update_id = None
 
     while not exit_event.is_set():  # Stop polling when exit is requested
         try:
-            updates = bot.get_updates(offset=update_id, timeout=10)
+            updates = bot.get_updates(offset=update_id, timeout=LISTENER_POLL_TIMEOUT)
             for update in updates:
                 update_id = update.update_id + 1  # Move to the next update
                 if update.message and update.message.text:
                     handle_text_message(update)
+                elif update.message and (update.message.photo or update.message.document):
+                    handle_zone_upload(update)
                 elif update.callback_query:
                     handle_callback_query(update)
         except telegram.error.TimedOut:
             continue  # Retry on timeout
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.exception("Error in the Telegram listener: %s", e)
             time.sleep(1)  # Short delay before retrying
 
 def initialize_idle_mode():
     """Initialize the idle mode listener in a separate thread."""
-    thread = threading.Thread(target=idle_mode_listener)
+    thread = threading.Thread(target=idle_mode_listener, name="telegram-listener")
     thread.daemon = True  # This makes sure the thread will exit when the main program does
     thread.start()
@@ -1,54 +1,561 @@
 import os
 import time
+import logging
+import threading
 import cv2
-import torch
-from torchvision.models.detection import ssd300_vgg16
-from send_telegram import send_image_via_telegram, send_message_via_telegram, stop_telegram_worker
-from capture_image import initialize_camera, detect_motion
-from idle_mode import initialize_idle_mode, system_active_event, exit_event, image_detection_paused
-from system_stats import initialize_temperature_monitor
+from send_telegram import (send_image_via_telegram, send_video_via_telegram, send_message_via_telegram,
+                           start_telegram_worker, stop_telegram_worker)
+from capture_image import (CAMERA_SOURCE, CAPTURE_COMPRESSED, open_video_source, FrameGrabber, MotionDetector,
+                           encode_jpeg, ImageWriter)
+from idle_mode import (initialize_idle_mode, system_active_event, exit_event, image_detection_paused,
+                       state_version, state_changed_at, wait_for_state_change)
+from system_stats import initialize_temperature_monitor, telemetry, get_process_rss, get_process_uptime
+from pipeline import Pipeline, StageQueue, StageStats, FairScheduler, DROP_OLDEST, NEVER_DROP
+from detection import DetectionEngine, DetectionCascade, merge_regions, person_boxes, MAX_BATCH_SIZE
+from detection_worker import DetectionWorker
+from tracker import PersonTracker
+from clip_recorder import ClipRecorder, CLIP_FPS
+from event_store import event_store
+from governor import Governor
+from zones import zone_store
+from best_frame import BestFrameSelector
+from metrics import registry, MetricsServer, METRICS_HOST, METRICS_PORT
+from structured_logging import configure_logging, stop_logging
 
-# Load the SSD model
-ssd_model = ssd300_vgg16(pretrained=True)
-ssd_model.eval()  # Set to evaluation mode
+logger = logging.getLogger(__name__)
+
+# The SSD model and its reusable input buffers are loaded after startup (see MODEL_PRELOAD)
+detection_engine = DetectionEngine(lazy=True)
+
+# Optional HOG prescreen in front of SSD, off unless CASCADE_ENABLED (see detection.py)
+detection_cascade = DetectionCascade(detection_engine)
+
+# Run the prescreen and SSD in a supervised worker process instead (see WORKER_*
+# in detection_worker.py), so torch threads do not compete with the Telegram and
+# capture threads and a crash in inference only restarts the worker
+DETECTION_ISOLATED = True
+
+# Set in main() when DETECTION_ISOLATED is on
+detection_worker = None
+
+# Picks the alert frame of each camera (used when BEST_FRAME_ENABLED is on)
+frame_selector = BestFrameSelector()
+
+# Cameras as (name, source) pairs; a source is a USB camera index, an RTSP URL
+# or a video file (files loop, which is handy for testing several streams)
+CAMERA_SOURCES = [("camera", CAMERA_SOURCE)]
+
+# How the shared detector picks the next camera: "round_robin" or "priority"
+# (largest motion first, but no camera is passed over more than SCHEDULER_MAX_SKIPS times)
+SCHEDULING_POLICY = "round_robin"
+SCHEDULER_MAX_SKIPS = 3
 
 # Set resolution for motion detection
 MOTION_DETECTION_RESOLUTION = (320, 240)  # Lower resolution for faster processing
 
-def detect_person(frame, confidence_threshold=0.5):
-    """Run SSD detection on a frame and check if a person is detected."""
-    transform = torch.nn.functional.interpolate  # Optional: Preprocess the image if needed
-    image_tensor = torch.from_numpy(frame).permute(2, 0, 1).float().unsqueeze(0) / 255.0  # Normalize
-    predictions = ssd_model(image_tensor)[0]
+# Background model used for motion detection: "running_average", "mog2" or "knn"
+MOTION_DETECTION_METHOD = "running_average"
+
+# Queue sizes between the pipeline stages
+FRAME_QUEUE_SIZE = 2       # capture -> motion (drop oldest)
+DETECTION_QUEUE_SIZE = 2   # motion -> detection, per camera (drop oldest)
+SELECT_QUEUE_SIZE = 4      # detection -> best-frame selection (never drop)
+ANNOTATE_QUEUE_SIZE = 4    # detection/selection -> annotate/encode (never drop)
+ALERT_QUEUE_SIZE = 16      # annotate/encode -> notify (never drop)
+
+# Send the best frame of a short window after a new person is found (scored by
+# confidence, box size and sharpness, see BEST_FRAME_* in best_frame.py) instead of
+# the first frame the person was detected in
+BEST_FRAME_ENABLED = True
+
+# Alert images are encoded in memory and sent straight to Telegram
+ALERT_JPEG_QUALITY = 85
+ALERT_MAX_WIDTH = 1280  # Telegram downscales larger photos anyway
+
+# Optionally keep a copy of every alert image on disk (written in the background)
+SAVE_PROCESSED_IMAGES = False
+PROCESSED_IMAGES_DIR = "processed_images"
+
+# Send a video clip of the seconds before and after each alert (see CLIP_* in clip_recorder.py)
+CLIP_RECORDING_ENABLED = True
+
+# Record every alert in the local event database (see EVENT_* in event_store.py);
+# clips are then kept next to the event thumbnails for the history command
+EVENT_STORE_ENABLED = True
+
+# Adapt capture rate, motion resolution and detector settings to the temperature
+# and latency budgets (see GOVERNOR_LEVELS and the budgets in governor.py)
+GOVERNOR_ENABLED = True
+
+# Load and warm up the detection model in the background as soon as the system
+# has started (otherwise the first detection loads it). While detection is idle
+# or paused for MODEL_UNLOAD_IDLE_MINUTES the model is unloaded to free RAM and
+# loaded again when detection resumes; None keeps it loaded
+MODEL_PRELOAD = True
+MODEL_UNLOAD_IDLE_MINUTES = 30
+
+# Idle mode: on Stop (or pause) the cameras are closed and the pipeline threads
+# stopped, after up to PIPELINE_DRAIN_TIMEOUT seconds to send the alerts in flight.
+# Start reopens them; RESUME_TARGET_MS bounds the time from Start to the first
+# processed frame (slower starts are reported)
+PIPELINE_DRAIN_TIMEOUT = 5.0
+RESUME_TARGET_MS = 2000
+
+# How often the pipeline counters are printed (seconds); while idle the main loop
+# only wakes up for this and for state changes
+PIPELINE_STATS_INTERVAL = 60.0
+
+# Serve the counters, gauges and latency histograms in the Prometheus text format on
+# METRICS_HOST:METRICS_PORT (see metrics.py); the /profile Telegram command works either way
+METRICS_ENABLED = True
 
-    person_detected = False
-    for box, label, score in zip(predictions['boxes'], predictions['labels'], predictions['scores']):
+# Durations of the idle mode transitions: Stop to cameras and pipeline released,
+# Start to the first frame through motion detection
+suspend_latency = StageStats()
+resume_latency = StageStats()
+
+frames_captured = registry.counter("frames_captured_total", "Frames taken into the pipeline", ("camera",))
+frames_skipped = registry.counter("frames_skipped_total", "Grabbed frames the pipeline did not take", ("camera",))
+motion_events = registry.counter("motion_events_total", "Frames with motion passed on to detection", ("camera",))
+camera_fps = registry.gauge("camera_fps", "Frames per second grabbed from the camera", ("camera",))
+inference_seconds = registry.histogram("inference_seconds",
+                                       "Person detection on the motion regions of one frame (prescreen, SSD "
+                                       "and, with DETECTION_ISOLATED, the round trip to the worker)")
+detection_latency_seconds = registry.histogram("detection_latency_seconds",
+                                               "Time from capturing a frame to its detection result", ("camera",))
+encode_seconds = registry.histogram("encode_seconds", "JPEG encoding of one alert image")
+alerts = registry.counter("alerts_total", "Alert images handed to Telegram", ("camera",))
+alert_latency_seconds = registry.histogram("alert_latency_seconds",
+                                           "Time from the motion to the alert image being handed to Telegram")
+
+def detect_person(frame, confidence_threshold=0.5, rois=None):
+    """
+    Run SSD detection on a frame and check if a person is detected.
+    If rois (motion regions in frame pixels) are given, only those are searched.
+    """
+    if detection_worker is not None:
+        return detection_worker.detect(frame, confidence_threshold, rois)
+    return detection_cascade.detect(frame, confidence_threshold, rois)
+
+def detector():
+    """What runs the detections: the worker process or the engine in this process."""
+    return detection_worker if detection_worker is not None else detection_engine
+
+def detection_active():
+    return system_active_event.is_set() and not image_detection_paused.is_set()
+
+def annotate_detections(frame, detections, confidence_threshold=0.5):
+    """Draw the person boxes on the frame and return the Telegram detection text."""
+    lines = []
+    for box, label, score in zip(detections['boxes'], detections['labels'], detections['scores']):
         if label == 1 and score > confidence_threshold:  # Assuming '1' is the class ID for 'person'
-            person_detected = True
-            break
+            x1, y1, x2, y2 = map(int, box)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(frame, f"Person: {score:.2f}", (x1, y1 - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+            lines.append(f"Person detected with confidence: {score:.2f}")
+    return "\n".join(lines)
+
+class Camera:
+    """One configured video source with its grabber, motion detector and counters."""
+
+    def __init__(self, name, source, loop=True, realtime=True):
+        self.name = name
+        self.source = source
+        self.loop = loop  # Restart video files at the end (replay runs play them once)
+        self.realtime = realtime
+        self.cap = None
+        self.grabber = None
+        # Include/exclude zones (see ZONES in zones.py); edits from Telegram apply to this object
+        self.zones = zone_store.camera(name)
+        self.motion_detector = MotionDetector(MOTION_DETECTION_RESOLUTION, method=MOTION_DETECTION_METHOD,
+                                              zones=self.zones)
+        self.last_seq = -1
+        self.tracker = PersonTracker()
+        self.clip_recorder = None
+        self.skipped_frames = 0
+        self.detection_latency = StageStats()
+        # Frames per second taken into the pipeline; None takes every frame (set by the governor)
+        self.max_fps = None
+        self.last_capture = 0.0
+        # time.monotonic() of the Start that reopened the camera, until its first frame is processed
+        self.resume_started = None
+        # Metric children of this camera, looked up once for the pipeline threads
+        self.frames_captured = frames_captured.labels(name)
+        self.frames_skipped = frames_skipped.labels(name)
+        self.motion_events = motion_events.labels(name)
+        self.detection_latency_seconds = detection_latency_seconds.labels(name)
+        camera_fps.track(lambda: self.grabber.fps if self.grabber is not None else 0.0, name)
+
+    def open(self):
+        """Open the source and start grabbing; returns False if the camera is unusable."""
+        self.cap = open_video_source(self.source, loop=self.loop, realtime=self.realtime,
+                                     compressed=CAPTURE_COMPRESSED)
+        if not self.cap.isOpened():
+            logger.error("Can not open camera %s (%s)", self.name, self.source)
+            return False
+        try:
+            self.grabber = FrameGrabber(self.cap, decode_fps=self.decode_fps()).start()
+        except RuntimeError:
+            logger.error("Failed to grab the initial frame from camera %s", self.name)
+            self.cap.release()
+            return False
+        self.last_seq = self.grabber.latest(copy=False).seq
+        self.motion_detector.reset()  # The background from before a Stop is stale
+        if CLIP_RECORDING_ENABLED and EVENT_STORE_ENABLED:
+            self.clip_recorder = ClipRecorder(self.grabber, self.name, on_clip=send_video_via_telegram,
+                                              active=detection_active, on_saved=event_store.set_clip,
+                                              keep_clips=True, clip_dir=event_store.media_dir).start()
+        elif CLIP_RECORDING_ENABLED:
+            self.clip_recorder = ClipRecorder(self.grabber, self.name, on_clip=send_video_via_telegram,
+                                              active=detection_active).start()
+        return True
+
+    def is_running(self):
+        return self.grabber is not None and not self.grabber.failed.is_set()
+
+    def decode_fps(self):
+        """Frames per second the pipeline and the clip recorder take; the grabber only grabs the others."""
+        if not self.max_fps:
+            return None
+        return max(self.max_fps, CLIP_FPS) if CLIP_RECORDING_ENABLED else self.max_fps
+
+    def snapshot(self):
+        """The latest frame (BGR), or None while the camera is closed."""
+        frame = self.grabber.latest() if self.grabber is not None else None
+        return frame.image if frame is not None else None
+
+    def close(self):
+        if self.clip_recorder is not None:
+            self.clip_recorder.stop()
+            self.clip_recorder = None
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def format_stats(self, scheduler):
+        fps = self.grabber.fps if self.grabber is not None else 0.0
+        retrieved = self.grabber.retrieved_fraction if self.grabber is not None else 0.0
+        compressed = ", compressed" if self.grabber is not None and self.grabber.compressed else ""
+        queue = scheduler.queues.get(self.name)
+        dropped = queue.dropped if queue is not None else 0
+        latency = self.detection_latency.snapshot()
+        stats = (f"{self.name}: {fps:.1f} FPS ({retrieved:.0%} retrieved{compressed}), "
+                 f"{self.skipped_frames} frames skipped, "
+                 f"{dropped} motion events dropped, detection latency avg {latency['avg_latency_ms']:.0f} ms "
+                 f"p95 {latency['p95_latency_ms']:.0f} ms ({latency['processed']} detections)")
+        if self.zones.zones:
+            stats += f"\n{self.zones.format_stats()}"
+        if self.clip_recorder is not None:
+            stats += f"\n{self.clip_recorder.format_stats()}"
+        return stats
+
+def build_pipeline(cameras, image_writer=None, on_detection=None, on_alert=None):
+    """
+    Build the capture -> motion -> detection -> select -> annotate/encode -> notify pipeline.
+    Every camera has its own capture and motion stage; they feed one shared
+    detector through a fair scheduler. Frame queues drop their oldest entry when
+    full so no camera ever waits on inference; alert queues never drop.
+    on_detection(camera, frame, detections) and on_alert(alert) are called for
+    every detector result and every alert handed to Telegram (e.g. by the replay benchmark).
+    """
+    multiple_cameras = len(cameras) > 1
+    select_queue = StageQueue(SELECT_QUEUE_SIZE, NEVER_DROP)
+    annotate_queue = StageQueue(ANNOTATE_QUEUE_SIZE, NEVER_DROP)
+    alert_queue = StageQueue(ALERT_QUEUE_SIZE, NEVER_DROP)
+    scheduler = FairScheduler(key=lambda event: event['camera'].name, maxsize_per_key=DETECTION_QUEUE_SIZE,
+                              policy=SCHEDULING_POLICY, priority=lambda event: event['motion_score'],
+                              max_skips=SCHEDULER_MAX_SKIPS)
+    pipeline = Pipeline()
+
+    def capture_stage(camera):
+        if not detection_active() or not camera.is_running():
+            # Forget the background so resuming does not compare against a stale one
+            camera.motion_detector.reset()
+            time.sleep(0.1)
+            return None
+        if camera.max_fps:
+            delay = camera.last_capture + 1.0 / camera.max_fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame = camera.grabber.wait_for_frame(camera.last_seq, timeout=0.5)
+        if frame is None:
+            return None
+        camera.last_capture = time.monotonic()
+        skipped = frame.seq - camera.last_seq - 1
+        camera.skipped_frames += skipped
+        camera.last_seq = frame.seq
+        camera.frames_captured.inc()
+        if skipped > 0:
+            camera.frames_skipped.inc(skipped)
+        return frame
+
+    def motion_stage(camera, frame):
+        if camera.resume_started is not None:
+            record_resume(camera)
+        # Compare the frame with the background model at the lower motion resolution
+        # (the governor may swap the detector for one at another resolution). A
+        # compressed frame is decoded at reduced size here and in full only if it
+        # goes on to detection
+        motion_detector = camera.motion_detector
+        width, height = frame.size
+        motion, boxes = motion_detector.detect_regions(frame.preview(motion_detector.resolution),
+                                                       frame_size=(width, height))
+        if not motion:
+            return None
+        camera.motion_events.inc()
+        width_low, height_low = motion_detector.resolution
+        return {'camera': camera, 'frame': frame, 'rois': merge_regions(boxes, (width, height)),
+                'motion_score': motion_detector.last_changed_pixels / (width_low * height_low),
+                'motion_at': time.monotonic()}
+
+    for camera in cameras:
+        frame_queue = StageQueue(FRAME_QUEUE_SIZE, DROP_OLDEST)
+        pipeline.add_stage(f"capture-{camera.name}", lambda camera=camera: capture_stage(camera),
+                           output_queue=frame_queue)
+        pipeline.add_stage(f"motion-{camera.name}", lambda frame, camera=camera: motion_stage(camera, frame),
+                           frame_queue, scheduler)
 
-    return person_detected, predictions
+    def detection_stage(event):
+        # Run SSD detection on the motion regions of the full-resolution frame
+        frame = event['frame']
+        camera = event['camera']
+        with inference_seconds.time():
+            person_detected, detections = detect_person(frame.image, rois=event['rois'])
+        # People whose box lies mostly in an excluded area (or outside the include zones) do not count
+        detections = camera.zones.filter_detections(detections, frame.size)
+        person_detected = person_detected and len(person_boxes(detections)[0]) > 0
+        latency = time.monotonic() - frame.timestamp
+        camera.detection_latency.record(latency, person_detected)
+        camera.detection_latency_seconds.observe(latency)
+        if on_detection is not None:
+            on_detection(camera, frame, detections)
+
+        # Only alert on people the tracker has not seen yet (or who came back after the cooldown);
+        # while an alert frame is being selected, every frame with a person is a candidate
+        boxes, scores = person_boxes(detections)
+        new_tracks = camera.tracker.update(boxes, scores, frame.timestamp)
+        if not new_tracks and not (BEST_FRAME_ENABLED and len(boxes) and frame_selector.collecting(camera.name)):
+            return None
+        event['detections'] = detections
+        event['new_tracks'] = new_tracks
+        return event
+
+    def select_stage(event):
+        frame_selector.offer(event['camera'].name, event)
+        return None  # The best frame leaves through frame_selector.pop_due() when the window closes
+
+    def annotate_stage(event):
+        camera = event['camera']
+        frame = event['frame']
+        image = frame.image
+        detection_data = annotate_detections(image, event['detections'])
+        track_ids = ", ".join(f"#{track.track_id}" for track in event['new_tracks'])
+        detection_data = f"New person in view (track {track_ids})\n{detection_data}"
+
+        # Encode the processed frame with bounding boxes in memory
+        timestamp = time.strftime("%Y%m%d--%H%M%S")
+        if multiple_cameras:
+            detection_data = f"{camera.name}\n{detection_data}"
+            filename = f"image_{camera.name}_{timestamp}.jpg"
+        else:
+            filename = f"image_{timestamp}.jpg"
+        with encode_seconds.time():
+            jpeg = encode_jpeg(image, ALERT_JPEG_QUALITY, ALERT_MAX_WIDTH)
+        if jpeg is None:
+            logger.error("Failed to encode the processed image")
+            return None
+        if image_writer is not None:
+            image_writer.write(os.path.join(PROCESSED_IMAGES_DIR, filename), jpeg)
+        event_id = None
+        if EVENT_STORE_ENABLED:
+            boxes, scores = person_boxes(event['detections'])
+            captured_at = time.time() - (time.monotonic() - frame.timestamp)
+            event_id = event_store.add_event(camera.name, captured_at, boxes, scores,
+                                             [track.track_id for track in event['new_tracks']], image)
+        if camera.clip_recorder is not None:
+            # The clip follows the photo once the post-event seconds are recorded
+            camera.clip_recorder.trigger(frame.timestamp, detection_data, event_id)
+        return {'jpeg': jpeg, 'filename': filename, 'detection_data': detection_data, 'camera': camera.name,
+                'seq': frame.seq, 'captured_at': frame.timestamp, 'motion_at': event['motion_at']}
+
+    def notify_stage(alert):
+        # Send image and detection details to Telegram
+        send_image_via_telegram(alert['jpeg'], detection_data=alert['detection_data'], filename=alert['filename'])
+        latency = time.monotonic() - alert['motion_at']
+        alert_latency_seconds.observe(latency)
+        alerts.labels(alert['camera']).inc()
+        logger.info("Person detected", extra={'camera': alert['camera'], 'latency_ms': round(latency * 1000.0)})
+        if on_alert is not None:
+            on_alert(alert)
+        return None
+
+    # Several detection workers let the engine batch frames from different cameras
+    detection_output = select_queue if BEST_FRAME_ENABLED else annotate_queue
+    for worker in range(min(len(cameras), MAX_BATCH_SIZE)):
+        pipeline.add_stage(f"detection-{worker + 1}", detection_stage, scheduler, detection_output)
+    if BEST_FRAME_ENABLED:
+        pipeline.add_stage("select", select_stage, select_queue, annotate_queue,
+                           tick=frame_selector.pop_due, pending=frame_selector.pending)
+    pipeline.add_stage("annotate", annotate_stage, annotate_queue, alert_queue)
+    pipeline.add_stage("notify", notify_stage, alert_queue)
+    return pipeline, scheduler
+
+def record_resume(camera):
+    """Records the time from Start to the first frame the camera put through the pipeline."""
+    latency_ms = (time.monotonic() - camera.resume_started) * 1000.0
+    camera.resume_started = None
+    resume_latency.record(latency_ms / 1000.0, latency_ms <= RESUME_TARGET_MS)
+    if latency_ms > RESUME_TARGET_MS:
+        logger.warning("Camera %s: first frame %.0f ms after Start (target %d ms)",
+                       camera.name, latency_ms, RESUME_TARGET_MS)
+    else:
+        logger.info("Camera %s: first frame %.0f ms after Start", camera.name, latency_ms)
+
+def suspend(cameras, pipeline, started):
+    """
+    Releases the cameras and stops the pipeline threads while the system is
+    idle. started is the time.monotonic() of the Stop command.
+    """
+    for camera in cameras:
+        camera.close()
+    pipeline.clear_queues()  # Frames taken before Stop are not checked for people
+    if not pipeline.drain(PIPELINE_DRAIN_TIMEOUT):
+        logger.warning("Pipeline did not drain in time; the remaining alerts are sent after Start")
+    pipeline.stop()
+    latency = time.monotonic() - started
+    suspend_latency.record(latency, True)
+    logger.info("System idle: cameras and pipeline released %.0f ms after Stop", latency * 1000)
+
+def resume(cameras, pipeline, started):
+    """
+    Reopens the cameras (in parallel) and restarts the pipeline; returns the
+    cameras that opened. started is the time.monotonic() of the Start command.
+    """
+    opened = []
+
+    def open_camera(camera):
+        if camera.open():
+            camera.resume_started = started
+            opened.append(camera)
+
+    threads = [threading.Thread(target=open_camera, args=(camera,), name=f"open-{camera.name}")
+               for camera in cameras]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pipeline.clear_queues()
+    pipeline.start()
+    logger.info("System active: %d of %d cameras reopened %.0f ms after Start",
+                len(opened), len(cameras), (time.monotonic() - started) * 1000)
+    return opened
+
+def format_idle_stats():
+    stops = suspend_latency.snapshot()
+    starts = resume_latency.snapshot()
+    return (f"idle mode: {stops['processed']} stops (avg {stops['avg_latency_ms']:.0f} ms), "
+            f"{starts['processed']} starts to first frame (avg {starts['avg_latency_ms']:.0f} ms, "
+            f"max {starts['max_latency_ms']:.0f} ms, {starts['emitted']} within {RESUME_TARGET_MS} ms)")
+
+def apply_governor_level(cameras, settings):
+    """Puts one governor level (see GOVERNOR_LEVELS) into effect."""
+    for camera in cameras:
+        camera.max_fps = settings.get('capture_fps')
+        if camera.grabber is not None:
+            camera.grabber.decode_fps = camera.decode_fps()
+        resolution = settings.get('motion_resolution', MOTION_DETECTION_RESOLUTION)
+        if tuple(camera.motion_detector.resolution) != tuple(resolution):
+            camera.motion_detector = MotionDetector(resolution, method=MOTION_DETECTION_METHOD, zones=camera.zones)
+    # Levels without a backend use the one the engine started with
+    detector().configure(input_size=settings.get('detector_input'),
+                         max_batch_size=settings.get('batch_size'),
+                         backend=settings.get('backend', detector().default_backend_name))
+
+def detection_stats():
+    if detection_worker is not None:
+        return detection_worker.format_stats()  # Cascade and engine lines from the worker
+    return f"{detection_cascade.format_stats()}\n{detection_engine.format_stats()}"
+
+def total_rss():
+    """RSS of this process and the detection worker (MB)."""
+    worker_rss = detection_worker.worker_rss() if detection_worker is not None else None
+    return get_process_rss() + (worker_rss or 0.0)
+
+def manage_model_memory():
+    """Loads the model when detection resumes and unloads it after a long idle period."""
+    if detection_active():
+        if MODEL_PRELOAD and not detector().is_loaded():
+            detector().load_async()
+    elif (MODEL_UNLOAD_IDLE_MINUTES is not None and detector().is_loaded()
+          and detector().idle_seconds() >= MODEL_UNLOAD_IDLE_MINUTES * 60):
+        rss_before = total_rss()
+        if detector().unload():
+            logger.info("Detection idle for %d minutes: RSS %.0f MB -> %.0f MB",
+                        MODEL_UNLOAD_IDLE_MINUTES, rss_before, total_rss())
 
 def main():
-    # Initialize the idle mode listener
-    initialize_idle_mode()
+    global detection_worker
+    configure_logging()
+    metrics_server = None
+    if METRICS_ENABLED:
+        try:
+            metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT).start()
+            logger.info("Metrics at http://%s:%d/metrics", METRICS_HOST, metrics_server.port)
+        except OSError as e:
+            logger.error("Can not start the metrics endpoint on %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
 
-    # Initialize the temperature monitor
-    initialize_temperature_monitor()
+    # Start the Telegram sender; the idle mode listener sends its replies through it
+    start_telegram_worker()
+    initialize_idle_mode()
 
-    # Initialize the camera
-    cap = initialize_camera()
-    time.sleep(2)  # Allow the camera to warm up
+    # Initialize the cameras
+    cameras = [Camera(name, source) for name, source in CAMERA_SOURCES]
+    # Snapshots for the /zones command
+    zone_store.snapshot_source = lambda name: next(
+        (camera.snapshot() for camera in cameras if camera.name == name), None)
+    time.sleep(2)  # Allow the cameras to warm up
 
-    # Capture the first frame for motion detection
-    ret, previous_frame = cap.read()
-    if not ret:
-        print("Failed to grab the initial frame")
+    # Capture the first frame of every camera and start grabbing frames in the background
+    failed = [camera for camera in cameras if not camera.open()]
+    for camera in failed:
+        send_message_via_telegram(f"Failed to initialize camera {camera.name}. Please check the setup.")
+    cameras = [camera for camera in cameras if camera not in failed]
+    if not cameras:
+        logger.error("Failed to grab the initial frame")
         send_message_via_telegram("Failed to initialize the camera. Please check the setup and restart.", with_buttons=True)
         return
 
-    # Resize the first frame to the lower resolution for motion detection
-    previous_frame_low_res = cv2.resize(previous_frame, MOTION_DETECTION_RESOLUTION)
+    if DETECTION_ISOLATED:
+        detection_worker = DetectionWorker()
+
+    # Initialize the telemetry sampler (and temperature monitor) with the pipeline's own figures
+    telemetry.add_source("capture_fps", lambda: sum(camera.grabber.fps for camera in cameras
+                                                    if camera.grabber is not None))
+    telemetry.add_source("inference_ms", lambda: detector().last_inference_ms)
+    telemetry.add_source("rss_mb", get_process_rss)
+    if detection_worker is not None:
+        telemetry.add_source("worker_rss_mb", detection_worker.worker_rss)
+    telemetry.add_source("detection_latency_ms", lambda: max(
+        [latency * 1000.0 for latency in (camera.detection_latency.take_max_latency() for camera in cameras)
+         if latency is not None], default=None))
+    initialize_temperature_monitor()
+
+    if MODEL_PRELOAD:
+        detector().load_async()
+    detector().start()
+    if EVENT_STORE_ENABLED:
+        event_store.start_pruning()
+    image_writer = ImageWriter() if SAVE_PROCESSED_IMAGES else None
+    pipeline, scheduler = build_pipeline(cameras, image_writer)
+    pipeline.start()
+    governor = None
+    if GOVERNOR_ENABLED:
+        governor = Governor(telemetry, lambda settings: apply_governor_level(cameras, settings)).start()
+        registry.gauge("governor_level", "Current governor level (0 is full quality)", function=lambda: governor.level)
 
     # Send initialization message via Telegram with buttons
     initialization_message = (
@@ -56,81 +563,85 @@ def main():
         "Please press the appropriate button to control the system."
     )
     send_message_via_telegram(initialization_message, with_buttons=True)
-    print("Initialization message sent to Telegram with buttons.")
+    logger.info("Initialization message sent to Telegram with buttons")
+    logger.info("Started in %.1f s, RSS %.0f MB (detection model %s)", get_process_uptime(), get_process_rss(),
+                "loading in the background" if MODEL_PRELOAD else "loaded on first use")
 
+    last_stats = time.monotonic()
+    running = True  # Cameras open and pipeline started
+    version = state_version()
+    loop_started = time.monotonic()
     try:
         while True:
             if exit_event.is_set():  # Check if the exit signal is set
-                print("Exit signal received. Shutting down...")
+                logger.info("Exit signal received. Shutting down...")
                 break  # Break the loop to exit
 
-            if system_active_event.is_set() and not image_detection_paused.is_set():
-                # System is active and image detection is not paused; perform motion detection
-                ret, current_frame = cap.read()
-                if not ret:
-                    print("Failed to grab frame")
-                    send_message_via_telegram("Camera error: Failed to grab frame. System is stopping.", with_buttons=True)
+            # Transitions are timed from the Start/Stop command (or from here for the state at startup)
+            changed_at = max(state_changed_at(), loop_started)
+            if detection_active() and not running:
+                running = True
+                opened = resume(cameras, pipeline, changed_at)
+                failed = [camera for camera in cameras if camera not in opened]
+                for camera in failed:
+                    send_message_via_telegram(f"Camera error: Failed to reopen camera {camera.name}.")
+                if len(failed) == len(cameras):
+                    send_message_via_telegram("Camera error: Failed to reopen the camera. System is stopping.",
+                                              with_buttons=True)
                     break
+            elif not detection_active() and running:
+                # System is idle or image detection is paused: release the cameras until Start
+                running = False
+                suspend(cameras, pipeline, changed_at)
 
-                # Resize the current frame for motion detection
-                current_frame_low_res = cv2.resize(current_frame, MOTION_DETECTION_RESOLUTION)
-
-                # Perform motion detection on the lower-resolution frames
-                if detect_motion(previous_frame_low_res, current_frame_low_res):
-                    print("Motion detected, checking for person detection...")
-
-                    # Save the image and perform person detection with SSD (on full resolution)
-                    timestamp = time.strftime("%Y%m%d--%H%M%S")
-                    save_path = os.path.join("processed_images", f"image_{timestamp}.jpg")
-                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-                    # Run SSD detection on the full-resolution current frame
-                    person_detected, detections = detect_person(current_frame)
-
-                    if person_detected:
-                        print("Person detected, drawing bounding boxes...")
-
-                        # Draw bounding boxes and save the processed image
-                        for box, label, score in zip(detections['boxes'], detections['labels'], detections['scores']):
-                            if label == 1 and score > 0.5:  # Assuming '1' is the class ID for 'person'
-                                x1, y1, x2, y2 = map(int, box)
-                                cv2.rectangle(current_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                                cv2.putText(current_frame, f"Person: {score:.2f}", (x1, y1 - 10),
-                                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-                        # Save the processed frame with bounding boxes
-                        cv2.imwrite(save_path, current_frame)
-                        print(f"Processed image saved with bounding boxes at {save_path}")
-
-                        # Prepare detection details (confidence scores) for Telegram
-                        detection_data = "\n".join(
-                            [f"Person detected with confidence: {score:.2f}"
-                             for box, label, score in zip(detections['boxes'], detections['labels'], detections['scores'])
-                             if label == 1 and score > 0.5])
-
-                        # Send image and detection details to Telegram
-                        send_image_via_telegram(save_path, detection_data=detection_data)
-
-                    # Avoid continuous capturing
-                    time.sleep(2)
+            if running:
+                for camera in cameras:
+                    if camera.grabber is not None and camera.grabber.failed.is_set():
+                        logger.error("Failed to grab frame from camera %s", camera.name)
+                        camera.close()
+                        send_message_via_telegram(f"Camera error: Failed to grab frame from {camera.name}.")
+                if not any(camera.is_running() for camera in cameras):
+                    send_message_via_telegram("Camera error: Failed to grab frame. System is stopping.", with_buttons=True)
+                    break
+            manage_model_memory()
 
-                # Update the previous frame for motion detection
-                previous_frame_low_res = current_frame_low_res
+            if time.monotonic() - last_stats >= PIPELINE_STATS_INTERVAL:
+                last_stats = time.monotonic()
+                camera_stats = "\n".join(f"{camera.format_stats(scheduler)}\n{camera.tracker.format_stats()}"
+                                         for camera in cameras)
+                stats = [camera_stats, pipeline.format_stats(), detection_stats(),
+                         f"memory: RSS {get_process_rss():.0f} MB"]
+                if BEST_FRAME_ENABLED:
+                    stats.append(frame_selector.format_stats())
+                if governor is not None:
+                    stats.append(governor.format_stats())
+                stats.append(format_idle_stats())
+                logger.info("Pipeline stats\n%s", "\n".join(stats))
 
-                # Adding a small delay to reduce CPU usage
-                cv2.waitKey(30)
-            else:
-                # System is idle or image detection is paused; skip motion detection
-                print("System is idle or image detection is paused.")
-                time.sleep(1)  # Sleep for a while before checking again
+            # Sleep until Start, Stop or Exit; while running, wake up every second to check the cameras
+            timeout = 1.0 if running else max(0.0, last_stats + PIPELINE_STATS_INTERVAL - time.monotonic())
+            version = wait_for_state_change(version, timeout)
 
     except KeyboardInterrupt:
-        print("Process interrupted. Exiting...")
+        logger.info("Process interrupted. Exiting...")
 
     finally:
-        cap.release()
+        if governor is not None:
+            governor.stop()
+        pipeline.stop()
+        detector().stop()
+        telemetry.stop()
+        for camera in cameras:
+            camera.close()
+        if image_writer is not None:
+            image_writer.stop()
+        if EVENT_STORE_ENABLED:
+            event_store.close()
         cv2.destroyAllWindows()
         stop_telegram_worker()  # Stop the Telegram worker thread
+        if metrics_server is not None:
+            metrics_server.stop()
+        stop_logging()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+import os
+import logging
+import json
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Appends are flushed to the OS at once and fsynced in batches: after this many
+# appends, or on the first append once this many seconds have passed
+FSYNC_EVERY = 16
+FSYNC_INTERVAL = 5.0
+
+
+class MessageLog:
+    """
+    Append-only log of sent Telegram message IDs, one ID per line.
+
+    Storing an ID writes one short line to a file that stays open, so the
+    cost does not grow with the number of stored IDs. A crash can at worst
+    leave a partial last line (no newline): read_all() skips it and the
+    first append cuts it off, so it never runs into the next ID. One lock
+    serializes the sender thread and the idle-mode listener thread.
+    """
+
+    def __init__(self, path, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a")
+            self._truncate_partial_line()
+        return self._file
+
+    def _truncate_partial_line(self):
+        """Cuts off a last line without a newline, left by a crash during an append."""
+        size = self._file.seek(0, os.SEEK_END)
+        if not size:
+            return
+        with open(self.path, "rb") as f:
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+        if end < size:
+            logger.warning("Dropping a partial last line (%d bytes) in %s", size - end, self.path)
+            self._file.truncate(end)
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, message_id):
+        """Stores one message ID."""
+        with self.lock:
+            f = self._open()
+            f.write(f"{int(message_id)}\n")
+            f.flush()
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def read_all(self):
+        """Returns the stored message IDs in the order they were appended."""
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+            if not os.path.exists(self.path):
+                return []
+            message_ids = []
+            with open(self.path, "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue  # Partial line left by a crash
+                    try:
+                        message_ids.append(int(line))
+                    except ValueError:
+                        continue  # Partial line left by a crash
+            return message_ids
+
+    def remove(self, message_ids):
+        """
+        Removes the given IDs, keeping any appended since they were read.
+        The file is rewritten to a temporary copy and swapped in atomically.
+        """
+        removed = set(message_ids)
+        with self.lock:
+            remaining = [m for m in self.read_all() if m not in removed]
+            self.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"{m}\n" for m in remaining)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def import_json(self, json_path):
+        """Moves the IDs of an old message_ids.json list into the log, then deletes the JSON file."""
+        with self.lock:
+            if not os.path.exists(json_path):
+                return 0
+            try:
+                with open(json_path, "r") as f:
+                    message_ids = json.load(f)
+            except ValueError as e:
+                logger.warning("Could not read old message IDs from %s: %s", json_path, e)
+                return 0
+            for message_id in message_ids:
+                self.append(message_id)
+            self._sync()
+            os.remove(json_path)
+            return len(message_ids)
+
+    def close(self):
+        """Fsyncs and closes the file; the next append reopens it."""
+        with self.lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
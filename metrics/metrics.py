@@ -0,0 +1,350 @@
+import bisect
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Local HTTP endpoint with the metrics in the Prometheus text format (GET /metrics);
+# bound to localhost, so put a reverse proxy or an SSH tunnel in front to scrape it
+# from another machine. None disables the endpoint
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Prefix of every metric name
+METRICS_PREFIX = "surveillance_"
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is added
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadCells:
+    """
+    Per-thread accumulators of one metric. Every thread adds to its own list
+    of numbers, so an update takes no lock and loses nothing when threads race;
+    a scrape sums the lists of all threads. The lists of finished threads are
+    folded into one retired total and dropped (on a scrape and when a new
+    thread registers), so counters never go down and the stage threads that
+    are recreated on every Stop/Start do not pile up.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._cells = []  # (weak reference to the owning thread, cell)
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0] * self.size
+            with self._lock:
+                self._prune()
+                self._cells.append((weakref.ref(threading.current_thread()), cell))
+            return cell
+
+    def _prune(self):
+        """Folds the cells of finished threads into the retired total (called with the lock held)."""
+        live = []
+        for owner, cell in self._cells:
+            thread = owner()
+            if thread is not None and thread.is_alive():
+                live.append((owner, cell))
+            else:
+                # A finished thread no longer writes to its cell
+                for index in range(self.size):
+                    self._retired[index] += cell[index]
+        self._cells = live
+
+    def totals(self):
+        with self._lock:
+            self._prune()
+            cells = [cell for _, cell in self._cells]
+            retired = list(self._retired)
+        return [retired[index] + sum(cell[index] for cell in cells) for index in range(self.size)]
+
+
+class Counter:
+    """A number that only goes up, e.g. frames captured (or read from function() at scrape time)."""
+
+    kind = "counter"
+
+    def __init__(self, function=None):
+        self.function = function
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+
+    def value(self):
+        if self.function is None:
+            return self._cells.totals()[0]
+        try:
+            return self.function()
+        except Exception:
+            return None
+
+    def samples(self, name, labels):
+        value = self.value()
+        return [] if value is None else [(name, labels, value)]
+
+
+class Gauge:
+    """A current value, set by the code or read from function() at scrape time (e.g. a queue depth)."""
+
+    kind = "gauge"
+
+    def __init__(self, function=None):
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value  # A single assignment, atomic under the GIL
+
+    def value(self):
+        if self.function is None:
+            return self._value
+        try:
+            return self.function()
+        except Exception:
+            return None
+
+    def samples(self, name, labels):
+        value = self.value()
+        return [] if value is None else [(name, labels, value)]
+
+
+class Histogram:
+    """Distribution of observed values (latencies in seconds) over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, one for +Inf, then the sum
+        self._cells = _ThreadCells(len(self.buckets) + 2)
+
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        """Context manager that observes the duration of its block."""
+        return _Timer(self)
+
+    def snapshot(self):
+        """(cumulative counts per bucket including +Inf, sum)."""
+        totals = self._cells.totals()
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None without observations)."""
+        cumulative, _ = self.snapshot()
+        if not cumulative[-1]:
+            return None
+        index = bisect.bisect_left(cumulative, q * cumulative[-1])
+        return self.buckets[index] if index < len(self.buckets) else float("inf")
+
+    def samples(self, name, labels):
+        cumulative, total = self.snapshot()
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        samples = [(f"{name}_bucket", labels + (("le", bound),), count) for bound, count in zip(bounds, cumulative)]
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative[-1]))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricFamily:
+    """A metric name with its help text and one child metric per label value combination."""
+
+    def __init__(self, name, help_text, factory, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        self.kind = factory().kind
+        if not self.labelnames:
+            self.labels()  # Rendered (as 0) before the first update
+
+    def labels(self, *values):
+        """The child metric for these label values (created on first use)."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes the labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def track(self, function, *values):
+        """Reads the child for these label values from function() at scrape time."""
+        self.labels(*values).function = function
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    # A family without labels is used like its only child
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def value(self):
+        return self.labels().value()
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in children:
+            samples.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return samples
+
+
+class Registry:
+    """The metric families of the process, rendered together for the endpoint."""
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name, help_text, factory, labelnames):
+        name = self.prefix + name
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(name, help_text, factory, labelnames)
+        return family
+
+    def counter(self, name, help_text, labelnames=(), function=None):
+        """A counter; with function (only without labels, see MetricFamily.track), read at scrape time."""
+        family = self._family(name, help_text, lambda: Counter(), labelnames)
+        if function is not None:
+            family.track(function)
+        return family
+
+    def gauge(self, name, help_text, labelnames=(), function=None):
+        """A gauge; with function (only without labels, see MetricFamily.track), read at scrape time."""
+        family = self._family(name, help_text, lambda: Gauge(), labelnames)
+        if function is not None:
+            family.track(function)
+        return family
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._family(name, help_text, lambda: Histogram(buckets), labelnames)
+
+    def get(self, name):
+        return self._families.get(self.prefix + name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda family: family.name)
+        lines = []
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples():
+                if labels:
+                    text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                    lines.append(f"{name}{{{text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else str(int(value))
+
+
+registry = Registry()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves registry.render() on GET /metrics from a background thread."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, metrics_registry=None):
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry or registry
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        metrics_registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # One line per scrape is noise
+
+        self._server = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Sampling period and limits of a profile run (the /profile Telegram command)
+PROFILE_INTERVAL = 0.005
+PROFILE_DEFAULT_SECONDS = 10.0
+PROFILE_MAX_SECONDS = 60.0
+PROFILE_TOP = 12
+
+# Python functions in which a thread is blocked rather than working; samples that
+# end in one of them count as waiting and are left out of the hotspots
+WAIT_FUNCTIONS = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("threading.py", "join"),
+    ("queue.py", "get"), ("selectors.py", "select"), ("socket.py", "readinto"), ("socket.py", "accept"),
+    ("ssl.py", "read"), ("base_events.py", "_run_once"), ("connection.py", "_recv"),
+    ("connection.py", "poll"), ("socketserver.py", "serve_forever"), ("threading.py", "wait_for"),
+}
+
+
+def _location(code, lineno=None):
+    filename = os.path.basename(code.co_filename)
+    if lineno is None:
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    return f"{code.co_name} ({filename}:{lineno})"
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for the threads of this process.
+
+    Every interval, run() takes the current stack of every other thread from
+    sys._current_frames() and counts the innermost line (self time) and, once
+    per sample, every function on the stack (total time). It needs no tracing
+    hooks, so the profiled code runs at full speed; the cost is one stack walk
+    per thread per interval on the profiling thread. Time spent in C code
+    (OpenCV, torch, I/O) is charged to the Python line that called it, so a
+    call that blocks in C (a camera grab, time.sleep) shows up like work.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.waiting = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.thread_counts = Counter()
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def _sample(self, own_ident, names):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            self.samples += 1
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in WAIT_FUNCTIONS:
+                self.waiting += 1
+                continue
+            self.self_counts[_location(code, frame.f_lineno)] += 1
+            self.thread_counts[names.get(ident, str(ident))] += 1
+            seen = set()
+            while frame is not None:
+                location = _location(frame.f_code)
+                # Every thread starts in threading.py, so its frames say nothing
+                if location not in seen and not frame.f_code.co_filename.endswith("threading.py"):
+                    seen.add(location)
+                    self.total_counts[location] += 1
+                frame = frame.f_back
+
+    def run(self, seconds):
+        """Samples for seconds (on the calling thread) and returns self."""
+        own_ident = threading.get_ident()
+        started = time.monotonic()
+        cpu_started = time.process_time()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            self._sample(own_ident, names)
+            time.sleep(self.interval)
+        self.seconds = time.monotonic() - started
+        self.cpu_seconds = time.process_time() - cpu_started
+        return self
+
+    def format_report(self, top=PROFILE_TOP):
+        busy = self.samples - self.waiting
+        # process_time() includes the profiler's own stack walks
+        lines = [f"Profile: {self.seconds:.1f} s, {self.samples} thread samples, "
+                 f"{self.waiting / max(self.samples, 1):.0%} waiting, "
+                 f"process CPU {self.cpu_seconds / max(self.seconds, 1e-6):.0%} of one core"]
+        if not busy:
+            return lines[0]
+        lines.append("Busy threads:")
+        lines.extend(f"  {count / busy:6.1%}  {name}" for name, count in self.thread_counts.most_common(5))
+        lines.append("Hotspots (self):")
+        lines.extend(f"  {count / busy:6.1%}  {location}" for location, count in self.self_counts.most_common(top))
+        lines.append("Hotspots (total):")
+        lines.extend(f"  {count / busy:6.1%}  {location}" for location, count in self.total_counts.most_common(top))
+        return "\n".join(lines)
+
+
+_profile_lock = threading.Lock()
+
+
+def profile(seconds=PROFILE_DEFAULT_SECONDS, top=PROFILE_TOP):
+    """
+    Runs one time-boxed profile (at most PROFILE_MAX_SECONDS) and returns the
+    report, or None if another profile is running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return SamplingProfiler().run(min(seconds, PROFILE_MAX_SECONDS)).format_report(top)
+    finally:
+        _profile_lock.release()
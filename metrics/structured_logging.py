@@ -0,0 +1,111 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+# Log level and format: "text" (time, level, logger, message, then key=value fields)
+# or "json" (one object per line, for log shippers)
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+
+# Optional log file next to the console output, rotated at LOG_FILE_MAX_MB
+LOG_FILE = None
+LOG_FILE_MAX_MB = 10
+LOG_FILE_BACKUPS = 3
+
+# Attributes every LogRecord has; the others come from extra={...} and are the structured fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def record_fields(record):
+    """The fields passed with extra={...} to a logging call."""
+    return {key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_")}
+
+
+def _format_field(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = str(value)
+    return json.dumps(text) if not text or " " in text or "=" in text else text
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as text with key=value fields, or as JSON lines."""
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = record_fields(record)
+        message = record.getMessage()
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        timestamp += f".{int(record.msecs):03d}"
+        # Records from the queue carry the traceback already rendered (see _QueueHandler)
+        exception = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if self.json_lines:
+            entry = {"time": timestamp, "level": record.levelname, "logger": record.name, "message": message}
+            entry.update(fields)
+            if exception:
+                entry["exception"] = exception
+            return json.dumps(entry, default=str)
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={_format_field(value)}" for key, value in fields.items())
+        if exception:
+            line += "\n" + exception
+        return line
+
+
+_listener = None
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, log_file=LOG_FILE, stream=None):
+    """
+    Sets up the root logger. Records are put on a queue by the calling thread
+    and formatted and written by a background listener thread, so a slow
+    terminal or SD card never holds up the pipeline threads.
+    """
+    global _listener
+    formatter = StructuredFormatter(json_lines=log_format == "json")
+    handlers = [logging.StreamHandler(stream or sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_FILE_MAX_MB * 1024 * 1024, backupCount=LOG_FILE_BACKUPS))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    stop_logging()
+    records = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)  # Records still queued at exit are written, not lost
+
+
+def stop_logging():
+    """Writes the records still queued and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Keep the record as it is (fields included) apart from what can not be
+        # handed to another thread: merge the arguments and render the traceback
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
@@ -0,0 +1,416 @@
+import logging
+import threading
+import queue
+import time
+from collections import deque
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Backpressure policies for the queues between stages
+DROP_OLDEST = "drop_oldest"  # Frames: discard the stalest item to make room
+NEVER_DROP = "never_drop"    # Alerts: block the producer until there is room
+
+stage_seconds = registry.histogram("pipeline_stage_seconds", "Time a pipeline stage spends on one item", ("stage",))
+stage_errors = registry.counter("pipeline_stage_errors_total", "Items a pipeline stage failed on", ("stage",))
+queue_depth = registry.gauge("pipeline_queue_depth", "Items waiting in the input queue of a stage", ("stage",))
+queue_dropped = registry.counter("pipeline_queue_dropped_total", "Items dropped from the input queue of a stage",
+                                 ("stage",))
+
+
+class StageQueue:
+    """
+    Bounded queue between two pipeline stages with a backpressure policy
+    and counters for depth and dropped items.
+    """
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, NEVER_DROP):
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, item, stop_event=None):
+        """
+        Adds an item. DROP_OLDEST evicts the oldest item when full;
+        NEVER_DROP waits for room (or until stop_event is set).
+        Returns False if the item was not queued.
+        """
+        with self._lock:
+            while len(self._items) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._not_full.wait(0.1)
+            self._items.append(item)
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Removes and returns the oldest item; raises queue.Empty on timeout."""
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def depth(self):
+        with self._lock:
+            return len(self._items)
+
+    def peek(self):
+        """Returns the oldest item without removing it (None if empty)."""
+        with self._lock:
+            return self._items[0] if self._items else None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._not_full.notify_all()
+
+
+class StageStats:
+    """Processing counters and latency figures for one stage."""
+
+    def __init__(self, window=256):
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.held = 0  # Items a NEVER_DROP queue could not take before the stage stopped
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._interval_max = None
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, emitted):
+        with self._lock:
+            self.processed += 1
+            if emitted:
+                self.emitted += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._interval_max = latency if self._interval_max is None else max(self._interval_max, latency)
+            self._recent.append(latency)
+
+    def count_emitted(self):
+        """Counts an item emitted outside record(), e.g. by a stage's tick()."""
+        with self._lock:
+            self.emitted += 1
+
+    def count_held(self):
+        with self._lock:
+            self.held += 1
+
+    def take_max_latency(self):
+        """Highest latency recorded since the previous call, or None if nothing was recorded."""
+        with self._lock:
+            latency, self._interval_max = self._interval_max, None
+            return latency
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            p95 = recent[int(0.95 * (len(recent) - 1))] if recent else 0.0
+            avg = self.total_latency / self.processed if self.processed else 0.0
+            return {
+                "processed": self.processed,
+                "emitted": self.emitted,
+                "errors": self.errors,
+                "held": self.held,
+                "avg_latency_ms": avg * 1000.0,
+                "p95_latency_ms": p95 * 1000.0,
+                "max_latency_ms": self.max_latency * 1000.0,
+            }
+
+
+class Stage:
+    """
+    One pipeline step running on its own worker thread.
+
+    The handler receives an item from input_queue (or nothing, for a source
+    stage without an input queue) and returns the item to pass downstream,
+    or None to drop it. An optional tick() is called after every item and at
+    least every 0.1 s while the input queue is empty; it returns the items
+    that became due in the meantime (e.g. when a time window closes) one per
+    call, and None when there are no more. pending() tells whether the stage
+    still holds items that tick() will release.
+
+    An item the output queue did not take before the stage was stopped (a
+    full NEVER_DROP queue) is kept and queued first when the stage starts
+    again, so an alert is late rather than lost.
+    """
+
+    def __init__(self, name, handler, input_queue=None, output_queue=None, tick=None, pending=None):
+        self.name = name
+        self.handler = handler
+        self.tick = tick
+        self.pending = pending
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stats = StageStats()
+        # Label children are looked up once; the updates in _run() take no lock
+        self._seconds = stage_seconds.labels(name)
+        self._errors = stage_errors.labels(name)
+        if input_queue is not None:
+            queue_depth.track(input_queue.depth, name)
+            queue_dropped.track(lambda: input_queue.dropped, name)
+        self.busy = False  # True while the handler runs on an item from input_queue
+        self._held = deque()  # Results not yet queued when the stage was stopped
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            self._thread.join()  # A stopped stage may still be finishing its last item
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f"stage-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._held and not self._stop_event.is_set():
+            if not self.output_queue.put(self._held[0], stop_event=self._stop_event):
+                break
+            self._held.popleft()
+        while not self._stop_event.is_set():
+            if self.input_queue is not None:
+                try:
+                    item = self.input_queue.get(timeout=0.1)
+                except queue.Empty:
+                    self._run_tick()
+                    continue
+                self.busy = True
+                args = (item,)
+            else:
+                args = ()
+
+            started = time.monotonic()
+            try:
+                result = self.handler(*args)
+            except Exception:
+                self.stats.errors += 1
+                self._errors.inc()
+                self.busy = False
+                logger.exception("Error in pipeline stage %s", self.name)
+                continue
+            latency = time.monotonic() - started
+            self.stats.record(latency, result is not None)
+            self._seconds.observe(latency)
+
+            if result is not None:
+                self._emit(result)
+            self.busy = False
+            self._run_tick()
+
+    def _run_tick(self):
+        if self.tick is None:
+            return
+        while True:
+            try:
+                result = self.tick()
+            except Exception:
+                self.stats.errors += 1
+                self._errors.inc()
+                logger.exception("Error in pipeline stage %s", self.name)
+                return
+            if result is None:
+                return
+            self.stats.count_emitted()
+            self._emit(result)
+
+    def _emit(self, result):
+        if self.output_queue is None or self.output_queue.put(result, stop_event=self._stop_event):
+            return
+        self._held.append(result)
+        self.stats.count_held()
+        logger.warning("Pipeline stage %s stopped before its output queue had room; "
+                       "the item is queued when the stage starts again", self.name,
+                       extra={'stage': self.name, 'held': len(self._held)})
+
+    def held(self):
+        """Number of results waiting to be queued when the stage starts again."""
+        return len(self._held)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+
+class Pipeline:
+    """A chain of stages connected by bounded queues."""
+
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, handler, input_queue=None, output_queue=None, tick=None, pending=None):
+        stage = Stage(name, handler, input_queue, output_queue, tick, pending)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def is_idle(self):
+        """True when every input queue is empty and no stage is working on or holding an item."""
+        return not any(stage.held() or (stage.input_queue is not None and (
+                       stage.busy or stage.input_queue.depth() or (stage.pending is not None and stage.pending())))
+                       for stage in self.stages)
+
+    def drain(self, timeout):
+        """
+        Waits until the pipeline is idle, e.g. before stopping it without losing
+        queued alerts. Returns False if it did not drain within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # Checked twice, as an item may be between a queue and a busy flag
+            if self.is_idle():
+                time.sleep(0.05)
+                if self.is_idle():
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def clear_queues(self):
+        """Discards the items waiting in every queue that may drop items (stale frames)."""
+        for stage in self.stages:
+            if stage.input_queue is not None and getattr(stage.input_queue, "policy", None) != NEVER_DROP:
+                stage.input_queue.clear()
+
+    def stats(self):
+        """Returns per-stage counters, including the depth of each stage's input queue."""
+        report = {}
+        for stage in self.stages:
+            entry = stage.stats.snapshot()
+            if stage.input_queue is not None:
+                entry["queue_depth"] = stage.input_queue.depth()
+                entry["queue_max_depth"] = stage.input_queue.max_depth
+                entry["queue_dropped"] = stage.input_queue.dropped
+            report[stage.name] = entry
+        return report
+
+    def format_stats(self):
+        lines = []
+        for name, entry in self.stats().items():
+            line = (f"{name}: {entry['processed']} in / {entry['emitted']} out, "
+                    f"avg {entry['avg_latency_ms']:.1f} ms, p95 {entry['p95_latency_ms']:.1f} ms")
+            if "queue_depth" in entry:
+                line += f", queue {entry['queue_depth']} (max {entry['queue_max_depth']}, dropped {entry['queue_dropped']})"
+            if entry["held"]:
+                line += f", {entry['held']} held at stop"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class FairScheduler:
+    """
+    Shared input for a stage that serves several producers (e.g. cameras).
+    Each producer gets its own bounded DROP_OLDEST queue, and get() picks the
+    next producer either round-robin or by the highest priority at the head
+    of its queue. With priorities, a producer that was passed over max_skips
+    times is served next, so a busy camera cannot starve the others.
+    Has the put/get/depth interface of StageQueue, so it can feed a Stage.
+    """
+
+    ROUND_ROBIN = "round_robin"
+    PRIORITY = "priority"
+
+    def __init__(self, key, maxsize_per_key=2, policy=ROUND_ROBIN, priority=None, max_skips=3):
+        if policy not in (self.ROUND_ROBIN, self.PRIORITY):
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        if policy == self.PRIORITY and priority is None:
+            raise ValueError("The priority policy needs a priority function")
+        self.key = key
+        self.maxsize_per_key = maxsize_per_key
+        self.policy = policy
+        self.priority = priority
+        self.max_skips = max_skips
+        self.queues = {}
+        self._order = []
+        self._next = 0
+        self._skips = {}
+        self.served = {}
+        self._cond = threading.Condition()
+
+    def _queue_for(self, key):
+        if key not in self.queues:
+            self.queues[key] = StageQueue(self.maxsize_per_key, DROP_OLDEST)
+            self._order.append(key)
+            self._skips[key] = 0
+            self.served[key] = 0
+        return self.queues[key]
+
+    def put(self, item, stop_event=None):
+        with self._cond:
+            self._queue_for(self.key(item)).put(item)
+            self._cond.notify()
+        return True
+
+    def _ready_keys(self):
+        return [key for key in self._order if self.queues[key].depth()]
+
+    def _pick(self, ready):
+        if self.policy == self.ROUND_ROBIN:
+            # First ready key at or after the round-robin position
+            for offset in range(len(self._order)):
+                key = self._order[(self._next + offset) % len(self._order)]
+                if key in ready:
+                    self._next = (self._order.index(key) + 1) % len(self._order)
+                    return key
+        starved = [key for key in ready if self._skips[key] >= self.max_skips]
+        if starved:
+            return max(starved, key=lambda k: self._skips[k])
+        return max(ready, key=lambda k: self.priority(self.queues[k].peek()))
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(self._ready_keys, timeout):
+                raise queue.Empty
+            ready = self._ready_keys()
+            key = self._pick(ready)
+            for other in ready:
+                self._skips[other] = 0 if other == key else self._skips[other] + 1
+            self.served[key] += 1
+            return self.queues[key].get(timeout=0)
+
+    def depth(self):
+        with self._cond:
+            return sum(q.depth() for q in self.queues.values())
+
+    @property
+    def max_depth(self):
+        return sum(q.max_depth for q in self.queues.values())
+
+    @property
+    def dropped(self):
+        return sum(q.dropped for q in self.queues.values())
+
+    def clear(self):
+        with self._cond:
+            for q in self.queues.values():
+                q.clear()
@@ -0,0 +1,133 @@
+"""
+A small local stand-in for the Telegram Bot API, for testing the sender
+and running the system without a real bot.
+
+    python3 fake_bot_api.py --port 8081 --rate-limit-every 5
+
+Then set TELEGRAM_API_URL = "http://127.0.0.1:8081" in send_telegram.py.
+Every request is recorded; --rate-limit-every N answers every Nth request
+with 429 Too Many Requests and --server-error-every N with 500.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from aiohttp import web
+
+
+class FakeBotAPI:
+    """Records Bot API calls and answers them like Telegram would."""
+
+    def __init__(self, rate_limit_every=0, server_error_every=0, retry_after=1, bulk_delete=True):
+        self.rate_limit_every = rate_limit_every
+        self.bulk_delete = bulk_delete  # False: answer deleteMessages with 404, like older Bot API servers
+        self.server_error_every = server_error_every
+        self.retry_after = retry_after
+        self.requests = []  # (timestamp, method, fields)
+        self.deleted = set()
+        self._count = 0
+        self._next_message_id = 1
+        self._lock = threading.Lock()
+        self._loop = None
+        self._runner = None
+
+    def _message(self):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": 0}}
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            fields = await request.json()
+        else:
+            form = await request.post()
+            fields = {key: (value if isinstance(value, str) else f"<file {value.filename}>")
+                      for key, value in form.items()}
+
+        with self._lock:
+            self._count += 1
+            count = self._count
+            self.requests.append((time.monotonic(), method, fields))
+
+            if self.rate_limit_every and count % self.rate_limit_every == 0:
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": "Too Many Requests: retry later",
+                                          "parameters": {"retry_after": self.retry_after}}, status=429)
+            if self.server_error_every and count % self.server_error_every == 0:
+                return web.json_response({"ok": False, "error_code": 500,
+                                          "description": "Internal Server Error"}, status=500)
+
+            if method == "sendMediaGroup":
+                media = fields["media"]
+                media = json.loads(media) if isinstance(media, str) else media
+                result = [self._message() for _ in media]
+            elif method in ("sendMessage", "sendPhoto", "sendVideo", "sendDocument"):
+                result = self._message()
+            elif method == "answerCallbackQuery":
+                result = True
+            elif method == "deleteMessage":
+                self.deleted.add(int(fields["message_id"]))
+                result = True
+            elif method == "deleteMessages" and self.bulk_delete:
+                ids = fields["message_ids"]
+                ids = json.loads(ids) if isinstance(ids, str) else ids
+                self.deleted.update(int(i) for i in ids)
+                result = True
+            elif method == "getUpdates":
+                result = []
+            elif method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+            else:
+                return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"},
+                                         status=404)
+        return web.json_response({"ok": True, "result": result})
+
+    def calls(self, method=None):
+        with self._lock:
+            return [r for r in self.requests if method is None or r[1] == method]
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def start(self, host="127.0.0.1", port=8081):
+        """Serve on a background thread; returns the base URL for TELEGRAM_API_URL."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.app())
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.TCPSite(self._runner, host, port).start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+
+        threading.Thread(target=run, name="fake-bot-api", daemon=True).start()
+        ready.wait()
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--server-error-every", type=int, default=0)
+    parser.add_argument("--no-bulk-delete", action="store_true", help="reject deleteMessages with 404")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.rate_limit_every, args.server_error_every, bulk_delete=not args.no_bulk_delete)
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
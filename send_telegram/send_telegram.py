@@ -1,104 +1,478 @@
 import os
 import threading
-import queue
+import asyncio
 import json
-from bot_config import bot, chat_id
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import logging
+import random
+import time
+import aiohttp
+from bot_config import bot_token, chat_id
+from message_log import MessageLog
+from metrics import registry
 
-# Define the path for the JSON file to store message IDs
-MESSAGE_IDS_FILE = "/home/pta/pyProject/Camera Control Security/message_ids.json"  # You can change this path as needed
+logger = logging.getLogger(__name__)
 
-# Create a thread-safe queue for sending messages
-send_queue = queue.Queue()
+# Define the path for the append-only log that stores message IDs
+MESSAGE_IDS_FILE = "/home/pta/pyProject/Camera Control Security/message_ids.log"  # You can change this path as needed
+# IDs stored by older versions are moved into the log on startup
+LEGACY_MESSAGE_IDS_FILE = os.path.join(os.path.dirname(MESSAGE_IDS_FILE), "message_ids.json")
+
+# Base URL of the Bot API; point it at a local fake server (fake_bot_api.py) for testing
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Telegram allows about one message per second in a chat (short bursts are tolerated)
+# and about 30 messages per second overall
+PER_CHAT_RATE = 1.0
+PER_CHAT_BURST = 3
+GLOBAL_RATE = 30.0
+
+# Retries for 429 (Too Many Requests), 5xx and network errors
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0  # Seconds; doubled after every failed attempt
+REQUEST_TIMEOUT = 30.0
+
+# Images queued within this window are sent together as one album (2-10 photos)
+MEDIA_GROUP_WINDOW = 1.0
+MEDIA_GROUP_MAX = 10
+CAPTION_LIMIT = 1024
+
+# deleteMessages takes up to 100 IDs per call; if it fails, messages are
+# deleted one by one with this many requests in flight
+DELETE_BATCH_SIZE = 100
+DELETE_CONCURRENCY = 8
+
+# Inline keyboard shown with messages sent with_buttons=True
+COMMAND_KEYBOARD = {
+    "inline_keyboard": [
+        [{"text": "Start", "callback_data": "start"}, {"text": "Stop", "callback_data": "stop"}],
+        [{"text": "Status", "callback_data": "status"}, {"text": "Clean", "callback_data": "clean"}],
+        [{"text": "System", "callback_data": "system"}, {"text": "History", "callback_data": "history"}],
+        [{"text": "Exit", "callback_data": "exit"}],
+    ]
+}
+
+request_seconds = registry.histogram("telegram_request_seconds", "Duration of one Bot API request", ("method",))
+delivery_seconds = registry.histogram("telegram_delivery_seconds",
+                                      "Time from queueing an item to Telegram accepting it (rate limits and "
+                                      "retries included)", ("type",))
+
+message_log = MessageLog(MESSAGE_IDS_FILE)
+message_log.import_json(LEGACY_MESSAGE_IDS_FILE)
 
 def store_message_id(message_id):
     """
-    Stores the message ID in a JSON file for future deletion.
+    Stores the message ID in the message log for future deletion.
+    Safe to call from any thread.
     """
-    if os.path.exists(MESSAGE_IDS_FILE):
-        with open(MESSAGE_IDS_FILE, 'r') as f:
-            message_ids = json.load(f)
-    else:
-        message_ids = []
+    message_log.append(message_id)
+
+
+class TelegramAPIError(Exception):
+    """A Bot API request that failed; retry_after is set for 429 responses."""
+
+    def __init__(self, method, status, description, retry_after=None):
+        super().__init__(f"{method} failed ({status}): {description}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status == 429 or self.status >= 500
+
+
+class TokenBucket:
+    """Token-bucket rate limiter for coroutines."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
 
-    message_ids.append(message_id)
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
 
-    with open(MESSAGE_IDS_FILE, 'w') as f:
-        json.dump(message_ids, f)
+    def pause(self, seconds):
+        """Empty the bucket for the given time, e.g. after a 429 with retry_after."""
+        self._tokens = 1.0 - seconds * self.rate
+        self._updated = time.monotonic()
 
-def telegram_worker():
+
+class AsyncTelegramSender:
     """
-    Worker thread that sends messages and images from the queue.
+    Sends queued Telegram messages from an asyncio event loop on a
+    background thread, over one pooled HTTP session.
+
+    - Rate limited per chat and globally with token buckets.
+    - Retries 429 and 5xx responses and network errors with exponential backoff.
+    - An image and its detection text go out as one sendPhoto with a caption.
+    - Images queued within MEDIA_GROUP_WINDOW are coalesced into one sendMediaGroup album.
+
+    The idle-mode listener sends its replies with run(), so they share the
+    rate limits with the alerts. Nothing is sent before start().
     """
-    while True:
-        item = send_queue.get()
-        if item is None:
-            break  # Exit signal received
+
+    def __init__(self, token=bot_token, default_chat_id=chat_id, api_url=None, on_sent=store_message_id):
+        self.base_url = f"{api_url or TELEGRAM_API_URL}/bot{token}/"
+        self.chat_id = default_chat_id
+        self.on_sent = on_sent
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="telegram-sender", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+            self._ready.wait()
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._chat_buckets = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._loop.run_until_complete(self._open_session())
+        self._ready.set()
         try:
-            if item['type'] == 'message':
-                if 'reply_markup' in item:
-                    sent_message = bot.send_message(chat_id=chat_id, text=item['content'], reply_markup=item['reply_markup'])
-                else:
-                    sent_message = bot.send_message(chat_id=chat_id, text=item['content'])
-                store_message_id(sent_message.message_id)
-                print("Message sent via Telegram.")
-            elif item['type'] == 'image':
-                with open(item['path'], 'rb') as image_file:
-                    sent_message = bot.send_photo(chat_id=chat_id, photo=image_file)
-                    store_message_id(sent_message.message_id)
-                print("Image sent via Telegram.")
-            elif item['type'] == 'detection_data':
-                sent_message = bot.send_message(chat_id=chat_id, text=item['content'])
-                store_message_id(sent_message.message_id)
-                print("Detection data sent via Telegram.")
-        except Exception as e:
-            print(f"Error sending {item['type']} to Telegram: {e}")
+            self._loop.run_until_complete(self._worker())
         finally:
-            send_queue.task_done()
+            self._loop.run_until_complete(self._session.close())
+            self._loop.close()
+
+    async def _open_session(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+    def enqueue(self, item):
+        """Thread-safe: queue an item ({'type': 'message'|'image'|'video', ...}) for sending."""
+        if item is not None:
+            item['queued_at'] = time.monotonic()
+        # Items queued before start() wait in the loop until it runs
+        self._loop.call_soon_threadsafe(lambda: self._queue.put_nowait(item))
+
+    def run(self, coroutine, timeout=None):
+        """Thread-safe: runs a coroutine (e.g. delete_messages) on the sender loop and returns its result."""
+        if not self._ready.is_set():
+            coroutine.close()
+            raise RuntimeError("The Telegram sender is not running")
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def depth(self):
+        """Items waiting in the send queue."""
+        return self._queue.qsize() if self._ready.is_set() else 0
+
+    def stop(self, timeout=None):
+        """Send everything still queued, then stop the event loop thread."""
+        if self._thread.is_alive():
+            self.enqueue(None)
+            self._thread.join(timeout)
+
+    async def _worker(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if item['type'] == 'image':
+                # Collect other images arriving shortly after this one into an album
+                deadline = self._loop.time() + MEDIA_GROUP_WINDOW
+                while len(batch) < MEDIA_GROUP_MAX:
+                    remaining = deadline - self._loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        extra = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if extra is None:
+                        stopping = True
+                        break
+                    if extra['type'] != 'image':
+                        # Keep the order: send the album first, then this item
+                        await self._send_batch(batch)
+                        batch = [extra]
+                        break
+                    batch.append(extra)
+            await self._send_batch(batch)
+
+    async def _send_batch(self, batch):
+        try:
+            if batch[0]['type'] == 'message':
+                await self.send_message(batch[0]['content'], batch[0].get('reply_markup'))
+            elif batch[0]['type'] == 'video':
+                await self.send_video(batch[0]['data'], batch[0]['filename'], batch[0].get('caption'))
+            elif len(batch) == 1:
+                await self.send_photo(batch[0]['data'], batch[0]['filename'], batch[0].get('caption'))
+            else:
+                await self.send_media_group(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error("Error sending %s to Telegram: %s", batch[0]['type'], e, extra={'items': len(batch)})
+            return
+        now = time.monotonic()
+        latency = delivery_seconds.labels(batch[0]['type'])
+        for item in batch:
+            latency.observe(now - item['queued_at'])
+        logger.info("Sent %d %s(s) via Telegram", len(batch), batch[0]['type'],
+                     extra={'delivery_ms': round((now - batch[0]['queued_at']) * 1000.0)})
 
-# Start the worker thread
-worker_thread = threading.Thread(target=telegram_worker, daemon=True)
-worker_thread.start()
+    def _bucket(self, chat):
+        chat = str(chat)  # The configured ID may be a string, the ID of an update is an int
+        if chat not in self._chat_buckets:
+            self._chat_buckets[chat] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+        return self._chat_buckets[chat]
 
-def send_image_via_telegram(image_path, detection_data=None):
+    async def call(self, method, data=None, files=None, chat=None, per_chat=True):
+        """
+        Calls a Bot API method with rate limiting and retries; returns the result field.
+        per_chat=False skips the per-chat limit, which only applies to messages sent to a chat.
+        """
+        chat = chat if chat is not None else self.chat_id
+        bucket = self._bucket(chat) if per_chat else self._global_bucket
+        for attempt in range(MAX_RETRIES + 1):
+            if per_chat:
+                await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                return await self._request(method, data, files)
+            except TelegramAPIError as e:
+                if not e.retryable or attempt == MAX_RETRIES:
+                    raise
+                self.retries += 1
+                if e.retry_after:
+                    # The bucket makes this chat wait as long as Telegram asked
+                    bucket.pause(e.retry_after)
+                    continue
+                delay = RETRY_BASE_DELAY * 2 ** attempt
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+                self.retries += 1
+                delay = RETRY_BASE_DELAY * 2 ** attempt
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+    async def _request(self, method, data, files):
+        with request_seconds.labels(method).time():
+            return await self._post(method, data, files)
+
+    async def _post(self, method, data, files):
+        if files:
+            form = aiohttp.FormData()
+            for key, value in (data or {}).items():
+                form.add_field(key, value if isinstance(value, str) else json.dumps(value))
+            for field, (filename, content, content_type) in files.items():
+                form.add_field(field, content, filename=filename, content_type=content_type)
+            request = self._session.post(self.base_url + method, data=form)
+        else:
+            request = self._session.post(self.base_url + method, json=data or {})
+        async with request as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = {"ok": False, "description": await response.text()}
+        if not body.get("ok"):
+            retry_after = (body.get("parameters") or {}).get("retry_after")
+            raise TelegramAPIError(method, response.status, body.get("description"), retry_after)
+        return body.get("result")
+
+    def _record(self, result):
+        messages = result if isinstance(result, list) else [result]
+        for message in messages:
+            self.sent += 1
+            if self.on_sent is not None:
+                self.on_sent(message["message_id"])
+        return result
+
+    async def send_message(self, text, reply_markup=None, chat=None):
+        chat = chat if chat is not None else self.chat_id
+        data = {"chat_id": chat, "text": text}
+        if reply_markup is not None:
+            data["reply_markup"] = reply_markup
+        return self._record(await self.call("sendMessage", data, chat=chat))
+
+    async def send_photo(self, content, filename="image.jpg", caption=None, reply_markup=None, chat=None):
+        """Sends encoded image bytes as a photo."""
+        chat = chat if chat is not None else self.chat_id
+        data = {"chat_id": str(chat)}
+        if caption:
+            data["caption"] = caption[:CAPTION_LIMIT]
+        if reply_markup is not None:
+            data["reply_markup"] = reply_markup
+        files = {"photo": (filename, content, "image/jpeg")}
+        return self._record(await self.call("sendPhoto", data, files, chat=chat))
+
+    async def send_document(self, content, filename, content_type="text/csv", chat=None):
+        chat = chat if chat is not None else self.chat_id
+        files = {"document": (filename, content, content_type)}
+        return self._record(await self.call("sendDocument", {"chat_id": str(chat)}, files, chat=chat))
+
+    async def answer_callback_query(self, query_id):
+        """Acknowledges a button press (no message is sent to the chat)."""
+        return await self.call("answerCallbackQuery", {"callback_query_id": query_id}, per_chat=False)
+
+    async def send_video(self, content, filename="clip.mp4", caption=None):
+        """Sends an encoded MP4 clip as a video."""
+        data = {"chat_id": str(self.chat_id), "supports_streaming": "true"}
+        if caption:
+            data["caption"] = caption[:CAPTION_LIMIT]
+        files = {"video": (filename, content, "video/mp4")}
+        return self._record(await self.call("sendVideo", data, files))
+
+    async def send_media_group(self, items):
+        media = []
+        files = {}
+        for i, item in enumerate(items):
+            files[f"photo{i}"] = (item['filename'], item['data'], "image/jpeg")
+            entry = {"type": "photo", "media": f"attach://photo{i}"}
+            if item.get('caption'):
+                entry["caption"] = item['caption'][:CAPTION_LIMIT]
+            media.append(entry)
+        data = {"chat_id": str(self.chat_id), "media": media}
+        return self._record(await self.call("sendMediaGroup", data, files))
+
+    async def delete_messages(self, message_ids):
+        """
+        Deletes messages with deleteMessages, DELETE_BATCH_SIZE IDs per call.
+        A batch that fails is retried as single deleteMessage calls, run
+        concurrently. Returns the IDs that could not be deleted.
+        """
+        failed = []
+        for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            batch = message_ids[i:i + DELETE_BATCH_SIZE]
+            try:
+                await self.call("deleteMessages", {"chat_id": self.chat_id, "message_ids": batch}, per_chat=False)
+            except Exception as e:
+                logger.warning("deleteMessages failed (%s), deleting %d messages one by one", e, len(batch))
+                failed.extend(await self._delete_each(batch))
+        return failed
+
+    async def _delete_each(self, message_ids):
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete(message_id):
+            async with semaphore:
+                try:
+                    await self.call("deleteMessage", {"chat_id": self.chat_id, "message_id": message_id},
+                                    per_chat=False)
+                    return None
+                except Exception as e:
+                    logger.warning("Failed to delete message %s: %s", message_id, e)
+                    return message_id
+
+        results = await asyncio.gather(*(delete(message_id) for message_id in message_ids))
+        return [message_id for message_id in results if message_id is not None]
+
+
+# Shared sender; started by start_telegram_worker() from main()
+sender = AsyncTelegramSender()
+
+registry.counter("telegram_messages_sent_total", "Messages Telegram accepted (an album counts each photo)",
+                 function=lambda: sender.sent)
+registry.counter("telegram_send_failures_total", "Queued items given up on after the retries",
+                 function=lambda: sender.failed)
+registry.counter("telegram_retries_total", "Bot API requests retried after 429, 5xx or network errors",
+                 function=lambda: sender.retries)
+registry.gauge("telegram_queue_depth", "Items waiting in the Telegram send queue",
+               function=lambda: sender.depth())
+
+def send_image_via_telegram(image, detection_data=None, filename="image.jpg"):
     """
-    Queues an image and optional detection data to be sent via Telegram.
+    Queues an image to be sent via Telegram, with the optional detection data as its caption.
+    The image is either encoded JPEG bytes (sent straight from memory) or a file path.
     """
-    if os.path.exists(image_path):
-        # Queue the image for sending
-        send_queue.put({'type': 'image', 'path': image_path})
-        print(f"Queued image {image_path} for sending via Telegram.")
+    if isinstance(image, (bytes, bytearray)):
+        sender.enqueue({'type': 'image', 'data': bytes(image), 'filename': filename, 'caption': detection_data})
+        logger.debug("Queued image %s for sending via Telegram", filename)
+    elif os.path.exists(image):
+        with open(image, 'rb') as image_file:
+            data = image_file.read()
+        sender.enqueue({'type': 'image', 'data': data, 'filename': os.path.basename(image), 'caption': detection_data})
+        logger.debug("Queued image %s for sending via Telegram", image)
+    else:
+        logger.error("Image not found: %s", image)
 
-        # Queue the detection data if provided
-        if detection_data:
-            send_queue.put({'type': 'detection_data', 'content': detection_data})
-            print("Queued detection data for sending via Telegram.")
+def send_video_via_telegram(video, caption=None, filename="clip.mp4"):
+    """
+    Queues an MP4 clip to be sent via Telegram. The video is either the encoded
+    bytes or a file path; a file is read at once, so it can be deleted afterwards.
+    """
+    if isinstance(video, (bytes, bytearray)):
+        sender.enqueue({'type': 'video', 'data': bytes(video), 'filename': filename, 'caption': caption})
+        logger.debug("Queued video %s for sending via Telegram", filename)
+    elif os.path.exists(video):
+        with open(video, 'rb') as video_file:
+            data = video_file.read()
+        sender.enqueue({'type': 'video', 'data': data, 'filename': os.path.basename(video), 'caption': caption})
+        logger.debug("Queued video %s for sending via Telegram", video)
     else:
-        print(f"Image not found: {image_path}")
+        logger.error("Video not found: %s", video)
 
 def send_message_via_telegram(message, with_buttons=False):
     """
     Queues a message to be sent via Telegram. If with_buttons is True, it sends an inline keyboard.
     """
     if with_buttons:
-        keyboard = [
-            [InlineKeyboardButton("Start", callback_data='start'),
-             InlineKeyboardButton("Stop", callback_data='stop')],
-            [InlineKeyboardButton("Status", callback_data='status'),
-             InlineKeyboardButton("Clean", callback_data='clean')],
-            [InlineKeyboardButton("System", callback_data='system'),
-             InlineKeyboardButton("Exit", callback_data='exit')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        send_queue.put({'type': 'message', 'content': message, 'reply_markup': reply_markup})
+        sender.enqueue({'type': 'message', 'content': message, 'reply_markup': COMMAND_KEYBOARD})
     else:
-        send_queue.put({'type': 'message', 'content': message})
-    print("Queued message for sending via Telegram.")
+        sender.enqueue({'type': 'message', 'content': message})
+    logger.debug("Queued message for sending via Telegram")
+
+def reply_via_telegram(chat, text, reply_markup=None):
+    """
+    Sends a reply to a command at once and returns the sent message. Replies
+    go through the sender, so they share its rate limits and retries.
+    """
+    return sender.run(sender.send_message(text, reply_markup, chat=chat))
+
+def reply_photo_via_telegram(chat, image, caption=None, reply_markup=None, filename="image.jpg"):
+    """Sends encoded JPEG bytes as a reply; see reply_via_telegram()."""
+    return sender.run(sender.send_photo(bytes(image), filename, caption, reply_markup, chat=chat))
+
+def reply_document_via_telegram(chat, data, filename, content_type="text/csv"):
+    """Sends a file (e.g. a CSV export) as a reply; see reply_via_telegram()."""
+    return sender.run(sender.send_document(bytes(data), filename, content_type, chat=chat))
+
+def answer_callback_query(query_id):
+    """Acknowledges a button press."""
+    return sender.run(sender.answer_callback_query(query_id))
+
+def delete_all_messages():
+    """
+    Deletes all messages stored in the message log from the chat and removes their IDs.
+    IDs that cannot be deleted (e.g. messages older than 48 hours) are removed as well.
+    """
+    message_ids = message_log.read_all()
+    if not message_ids:
+        logger.info("No stored messages. Nothing to delete.")
+        return
+    # The log is not locked meanwhile: the sender stores new IDs while deleting
+    failed = sender.run(sender.delete_messages(message_ids))
+    message_log.remove(message_ids)
+    logger.info("Deleted %d of %d messages", len(message_ids) - len(failed), len(message_ids))
+
+def start_telegram_worker():
+    """
+    Starts the sender thread. Messages queued before are sent once it runs.
+    """
+    sender.start()
+    logger.info("Telegram worker thread has been started")
 
 def stop_telegram_worker():
     """
-    Stops the worker thread gracefully.
+    Stops the sender thread gracefully after the queued messages are sent.
     """
-    send_queue.put(None)  # Send exit signal to the worker thread
-    worker_thread.join()
-    print("Telegram worker thread has been stopped.")
+    sender.stop()
+    message_log.close()
+    logger.info("Telegram worker thread has been stopped")
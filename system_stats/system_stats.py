@@ -1,53 +1,107 @@
 import os
+import glob
+import logging
 import psutil
 import time
 import threading
 import subprocess
 import re
+import cv2
+import numpy as np
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Root of sysfs; point it at a fake tree to test without Jetson hardware
+SYSFS_ROOT = "/sys"
+FAN_PWM_FILE = "devices/pwm-fan/target_pwm"  # Relative to SYSFS_ROOT
+
+# Proportional fan curve (Celsius): off below FAN_START_TEMP, FAN_MIN_PWM at
+# FAN_START_TEMP rising linearly to full speed (255) at FAN_FULL_TEMP. A running
+# fan stops only once the temperature falls FAN_HYSTERESIS below FAN_START_TEMP.
+FAN_START_TEMP = 45.0
+FAN_FULL_TEMP = 70.0
+FAN_MIN_PWM = 80  # Lowest PWM at which the fan still spins up reliably
+FAN_HYSTERESIS = 3.0
+FAN_PWM_STEP = 10  # Smaller PWM changes are not written
+
+# Thermal zones (by type) that drive the fan and the governor; the others are only
+# recorded as telemetry (the Nano's PMIC-Die, for one, always reads 100C). Boards
+# without any of these zones use their first thermal zone
+CONTROL_ZONES = ("CPU-therm", "GPU-therm")
+
+# Telemetry: one sample every TELEMETRY_INTERVAL seconds, TELEMETRY_HISTORY samples kept (1 hour)
+TELEMETRY_INTERVAL = 1.0
+TELEMETRY_HISTORY = 3600
+# Window of the min/avg/max figures shown by the System button (seconds)
+TELEMETRY_SUMMARY_WINDOW = 300.0
 
 def get_temperature():
-    temp_file = "/sys/class/thermal/thermal_zone0/temp"  # Path to the temperature file
+    temp_file = os.path.join(SYSFS_ROOT, "class/thermal/thermal_zone0/temp")  # Path to the temperature file
     try:
         with open(temp_file, "r") as f:
             temp_str = f.read()
             temp_C = int(temp_str) / 1000.0  # Convert from millidegrees to degrees
             return temp_C
     except FileNotFoundError:
-        print(f"Temperature file {temp_file} not found")
+        logger.warning("Temperature file %s not found", temp_file)
         return None
     except Exception as e:
-        print(f"Error reading temperature: {e}")
+        logger.warning("Error reading temperature: %s", e)
         return None
 
+def fan_curve(temperature, running=False):
+    """PWM value (0-255) for the temperature; running says whether the fan is spinning now."""
+    start_temp = FAN_START_TEMP - FAN_HYSTERESIS if running else FAN_START_TEMP
+    if temperature < start_temp:
+        return 0
+    if temperature >= FAN_FULL_TEMP:
+        return 255
+    fraction = max(0.0, (temperature - FAN_START_TEMP) / (FAN_FULL_TEMP - FAN_START_TEMP))
+    return int(round(FAN_MIN_PWM + fraction * (255 - FAN_MIN_PWM)))
+
+_fan_pwm = None
+
 def control_fan(temperature):
-    fan_on_temp = 60.0  # Temperature to turn the fan on (in Celsius)
-    fan_off_temp = 50.0  # Temperature to turn the fan off (in Celsius)
-    pwm_file = "/sys/devices/pwm-fan/target_pwm"
+    """
+    Sets the fan PWM from the fan curve. Writes only when the value moves by
+    FAN_PWM_STEP or more (or to off / full speed); returns the current PWM.
+    """
+    global _fan_pwm
+    pwm_file = os.path.join(SYSFS_ROOT, FAN_PWM_FILE)
+    pwm = fan_curve(temperature, running=bool(_fan_pwm))
+    if _fan_pwm is not None:
+        if pwm == _fan_pwm or (abs(pwm - _fan_pwm) < FAN_PWM_STEP and pwm not in (0, 255)):
+            return _fan_pwm
 
     try:
-        if temperature >= fan_on_temp:
-            # Turn on the fan at full speed
-            with open(pwm_file, "w") as f:
-                f.write("255")  # Max PWM value (255) for full speed
-            print("Fan ON")
-        elif temperature <= fan_off_temp:
-            # Turn off the fan
-            with open(pwm_file, "w") as f:
-                f.write("0")  # PWM value 0 to turn off
-            print("Fan OFF")
-        else:
-            # Fan state remains unchanged
-            pass
+        with open(pwm_file, "w") as f:
+            f.write(str(pwm))
     except PermissionError:
-        print(f"Permission denied when writing to {pwm_file}. Try running as root or adjust permissions.")
+        logger.error("Permission denied when writing to %s. Try running as root or adjust permissions.", pwm_file)
+        return _fan_pwm
     except Exception as e:
-        print(f"Failed to control fan: {e}")
+        logger.error("Failed to control fan: %s", e)
+        return _fan_pwm
+    if not _fan_pwm and pwm:
+        logger.info("Fan ON (PWM %d, %.1fC)", pwm, temperature)
+    elif _fan_pwm and not pwm:
+        logger.info("Fan OFF (%.1fC)", temperature)
+    _fan_pwm = pwm
+    return pwm
 
 def get_cpu_usage():
+    """
+    Returns the CPU usage in percent without blocking: the latest sample of
+    the telemetry sampler, or the usage since the previous call.
+    """
+    snapshot = telemetry.snapshot()
+    if snapshot:
+        return snapshot["cpu"]
     try:
-        return psutil.cpu_percent(interval=1)
+        return psutil.cpu_percent(interval=None)
     except Exception as e:
-        print(f"Error reading CPU usage: {e}")
+        logger.warning("Error reading CPU usage: %s", e)
         return None
 
 def get_ram_usage():
@@ -55,28 +109,256 @@ def get_ram_usage():
         mem = psutil.virtual_memory()
         return mem.percent
     except Exception as e:
-        print(f"Error reading RAM usage: {e}")
+        logger.warning("Error reading RAM usage: %s", e)
         return None
 
-def temperature_monitor():
+def get_process_rss():
+    """Resident memory of this process in MB."""
+    try:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception as e:
+        logger.warning("Error reading process memory: %s", e)
+        return None
+
+def get_process_uptime():
+    """Seconds since this process was started (including the Python imports)."""
+    try:
+        return time.time() - psutil.Process().create_time()
+    except Exception as e:
+        logger.warning("Error reading process start time: %s", e)
+        return None
+
+def find_thermal_zones(sysfs_root=SYSFS_ROOT):
+    """Returns [(name, temp file)] for every thermal zone, named by its type (e.g. CPU-therm)."""
+    zones = []
+    for zone_dir in sorted(glob.glob(os.path.join(sysfs_root, "class/thermal/thermal_zone*"))):
+        try:
+            with open(os.path.join(zone_dir, "type"), "r") as f:
+                name = f.read().strip()
+        except OSError:
+            name = os.path.basename(zone_dir)
+        zones.append((name, os.path.join(zone_dir, "temp")))
+    return zones
+
+def _read_number(path, scale=1.0):
+    try:
+        with open(path, "r") as f:
+            return int(f.read().strip()) / scale
+    except (OSError, ValueError):
+        return float("nan")
+
+
+class TelemetrySampler:
     """
-    This is for monitoring the system temperature and controlling the fan accordingly.
+    Background sampler of CPU (total and per core), RAM, the temperature of
+    every thermal zone, fan PWM and any extra sources registered with
+    add_source() (e.g. pipeline FPS and inference latency).
+
+    Samples are kept in a preallocated float32 ring buffer, one column per
+    metric, so snapshot() and window_stats() never block and the history
+    can be exported as CSV or rendered to a chart image at any time.
     """
-    while True:
-        temp = get_temperature()
-        if temp is not None:
-            print(f"Current Temperature: {temp:.2f}ºC")
-            control_fan(temp)
-        else:
-            print("Unable to read temperature.")
-        time.sleep(5)
+
+    def __init__(self, interval=TELEMETRY_INTERVAL, capacity=TELEMETRY_HISTORY, sysfs_root=SYSFS_ROOT):
+        self.interval = interval
+        self.capacity = capacity
+        self.sysfs_root = sysfs_root
+        self.fan_pwm_file = os.path.join(sysfs_root, FAN_PWM_FILE)
+        self.zones = find_thermal_zones(sysfs_root)
+        self.cores = psutil.cpu_count() or 1
+        self._sources = []
+        self._listeners = []
+        self.columns = (["cpu"] + [f"cpu{i}" for i in range(self.cores)] + ["ram"]
+                        + [f"temp_{name}" for name, _ in self.zones] + ["fan_pwm"])
+        self._times = None
+        self._values = None
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_source(self, name, read):
+        """Adds a metric read by calling read() at every sample. Call before start()."""
+        if self._thread is not None:
+            raise RuntimeError("Sources must be added before the sampler is started")
+        self._sources.append((name, read))
+        self.columns.append(name)
+
+    def add_listener(self, callback):
+        """Calls callback(sample dict) after every sample, on the sampler thread."""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._thread is None:
+            self._times = np.zeros(self.capacity, dtype=np.float64)
+            self._values = np.full((self.capacity, len(self.columns)), np.nan, dtype=np.float32)
+            psutil.cpu_percent(percpu=True)  # Starts the measurement interval for the first sample
+            self.export_metrics()
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def export_metrics(self):
+        """Exposes the latest sample of every column (except the single cores) as a telemetry gauge."""
+        family = registry.gauge("telemetry", "Latest telemetry sample (see TelemetrySampler.columns)", ("metric",))
+        for name in self.columns:
+            if not (name.startswith("cpu") and name != "cpu"):
+                family.track(lambda name=name: self.snapshot().get(name), name)
+
+    def sample(self):
+        """Reads every metric once; returns the row of values in column order."""
+        # cpu_percent with interval=None reports the usage since the previous call and never sleeps
+        per_core = psutil.cpu_percent(percpu=True)
+        row = [sum(per_core) / len(per_core)] + list(per_core[:self.cores])
+        row += [float("nan")] * (1 + self.cores - len(row))
+        row.append(psutil.virtual_memory().percent)
+        row += [_read_number(path, 1000.0) for _, path in self.zones]
+        row.append(_read_number(self.fan_pwm_file))
+        for name, read in self._sources:
+            try:
+                value = read()
+            except Exception as e:
+                logger.warning("Error reading telemetry source %s: %s", name, e)
+                value = None
+            row.append(float("nan") if value is None else float(value))
+        return row
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            row = self.sample()
+            with self._lock:
+                slot = self._count % self.capacity
+                self._times[slot] = time.time()
+                self._values[slot] = row
+                self._count += 1
+            sample = dict(zip(self.columns, row))
+            for callback in self._listeners:
+                try:
+                    callback(sample)
+                except Exception as e:
+                    logger.exception("Error in telemetry listener")
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def history(self, seconds=None):
+        """Returns (timestamps, values) of the samples of the last seconds (all if None), oldest first."""
+        with self._lock:
+            if self._values is None or self._count == 0:
+                return np.zeros(0), np.zeros((0, len(self.columns)), dtype=np.float32)
+            n = min(self._count, self.capacity)
+            order = (np.arange(self._count - n, self._count)) % self.capacity
+            times = self._times[order]
+            values = self._values[order]
+        if seconds is not None:
+            keep = times >= times[-1] - seconds
+            times, values = times[keep], values[keep]
+        return times, values
+
+    def snapshot(self):
+        """Latest sample as a dict (empty before the first sample)."""
+        with self._lock:
+            if self._values is None or self._count == 0:
+                return {}
+            row = self._values[(self._count - 1) % self.capacity]
+            return {name: float(value) for name, value in zip(self.columns, row)}
+
+    def window_stats(self, seconds):
+        """{metric: (min, avg, max)} over the last seconds, ignoring missing readings."""
+        _, values = self.history(seconds)
+        stats = {}
+        for i, name in enumerate(self.columns):
+            column = values[:, i]
+            column = column[~np.isnan(column)]
+            if len(column):
+                stats[name] = (float(column.min()), float(column.mean()), float(column.max()))
+        return stats
+
+    def to_csv(self, seconds=None):
+        """History as CSV text with a Unix time column."""
+        times, values = self.history(seconds)
+        lines = [",".join(["time"] + self.columns)]
+        for timestamp, row in zip(times, values):
+            lines.append(",".join([f"{timestamp:.1f}"] + ["" if np.isnan(v) else f"{v:.2f}" for v in row]))
+        return "\n".join(lines) + "\n"
+
+    def render_chart(self, seconds=None, metrics=None, width=800, panel_height=110):
+        """
+        Draws one line panel per metric (default: total CPU, RAM, temperatures,
+        fan and the extra sources) and returns the chart as PNG bytes.
+        """
+        times, values = self.history(seconds)
+        if metrics is None:
+            metrics = [name for name in self.columns if not (name.startswith("cpu") and name != "cpu")]
+        sheet = np.full((panel_height * max(1, len(metrics)), width, 3), 255, dtype=np.uint8)
+        left, right = 8, width - 8
+        for p, name in enumerate(metrics):
+            top = p * panel_height
+            cv2.rectangle(sheet, (left, top + 18), (right, top + panel_height - 6), (220, 220, 220), 1)
+            column = values[:, self.columns.index(name)] if len(times) else np.zeros(0)
+            valid = ~np.isnan(column)
+            if valid.sum() == 0:
+                cv2.putText(sheet, f"{name}: no data", (left, top + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 1)
+                continue
+            low, high = float(column[valid].min()), float(column[valid].max())
+            span = max(high - low, 1e-6)
+            t0, t1 = times[0], max(times[-1], times[0] + 1e-6)
+            x = left + (times[valid] - t0) / (t1 - t0) * (right - left)
+            y = (top + panel_height - 8) - (column[valid] - low) / span * (panel_height - 28)
+            points = np.stack([x, y], axis=1).astype(np.int32).reshape(-1, 1, 2)
+            cv2.polylines(sheet, [points], False, (200, 80, 0), 1, cv2.LINE_AA)
+            cv2.putText(sheet, f"{name}: last {column[valid][-1]:.1f}  min {low:.1f}  max {high:.1f}",
+                        (left, top + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 1)
+        ok, buffer = cv2.imencode(".png", sheet)
+        return buffer.tobytes() if ok else None
+
+    def format_summary(self, seconds=TELEMETRY_SUMMARY_WINDOW):
+        """Text for the Telegram System button: current values and min/avg/max over a window."""
+        snapshot = self.snapshot()
+        if not snapshot:
+            return "No telemetry samples yet."
+        stats = self.window_stats(seconds)
+        lines = []
+        for name in self.columns:
+            if name.startswith("cpu") and name != "cpu":
+                continue
+            if name in stats:
+                low, avg, high = stats[name]
+                lines.append(f"{name}: {snapshot[name]:.1f} (min {low:.1f} / avg {avg:.1f} / max {high:.1f})")
+        cores = " ".join(f"{snapshot[f'cpu{i}']:.0f}" for i in range(self.cores) if f"cpu{i}" in stats)
+        lines.append(f"per core: {cores}")
+        return f"System, last {seconds / 60:.0f} min, current (min / avg / max):\n" + "\n".join(lines)
+
+
+# Shared sampler; started by initialize_temperature_monitor()
+telemetry = TelemetrySampler()
+
+def control_columns(columns, zones=CONTROL_ZONES):
+    """The temperature columns among columns that drive the fan and the governor (see CONTROL_ZONES)."""
+    temperatures = [name for name in columns if name.startswith("temp_")]
+    control = [name for name in temperatures if name[len("temp_"):] in zones]
+    return control or temperatures[:1]
+
+def hottest_temperature(sample):
+    """Highest control zone reading of a telemetry sample, or None."""
+    temperatures = [sample[name] for name in control_columns(sample)
+                    if sample[name] is not None and not np.isnan(sample[name])]
+    return max(temperatures) if temperatures else None
+
+def control_fan_on_change(sample):
+    """Fan control from the telemetry samples, following the hottest control zone."""
+    temperature = hottest_temperature(sample)
+    if temperature is not None:
+        control_fan(temperature)
 
 def initialize_temperature_monitor():
     """
-    Initializing the temperature monitor in a separate thread.
+    Starts the telemetry sampler, which also controls the fan.
     """
-    # Start temperature monitoring thread
-    temp_thread = threading.Thread(target=temperature_monitor)
-    temp_thread.daemon = True
-    temp_thread.start()
-    print("Temperature Monitoring thread started")
+    telemetry.add_listener(control_fan_on_change)
+    telemetry.start()
+    logger.info("Telemetry sampler started")
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The modules live in one directory each and import each other by bare name,
+# as with PYTHONPATH set for main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for name in sorted(os.listdir(ROOT)):
+    path = os.path.join(ROOT, name)
+    if os.path.isdir(path) and not name.startswith((".", "_")) and name != "tests":
+        sys.path.insert(0, path)
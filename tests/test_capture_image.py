@@ -0,0 +1,74 @@
+import threading
+import time
+import numpy as np
+from capture_image import FrameRingBuffer, FrameGrabber, SyntheticVideoSource
+
+
+def image(value, shape=(4, 6, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+def test_ring_buffer_keeps_the_latest_frames():
+    ring = FrameRingBuffer(3, (4, 6, 3))
+    assert ring.latest() is None
+    for value in range(5):
+        assert ring.push(image(value), timestamp=float(value)) == value
+    latest = ring.latest()
+    assert latest.seq == 4 and latest.timestamp == 4.0 and latest.image[0, 0, 0] == 4
+    # The two oldest frames were overwritten
+    assert [frame.seq for frame in ring.drain_since(-1.0)] == [2, 3, 4]
+    assert [frame.seq for frame in ring.drain_since(2.5)] == [3, 4]
+
+
+def test_ring_buffer_hands_out_copies():
+    ring = FrameRingBuffer(2, (4, 6, 3))
+    ring.push(image(1))
+    frame = ring.latest()
+    ring.push(image(2))
+    ring.push(image(3))  # Overwrites the slot of the first frame
+    assert frame.image[0, 0, 0] == 1
+
+
+def test_wait_for_frame_times_out_without_a_newer_frame():
+    ring = FrameRingBuffer(2, (4, 6, 3))
+    ring.push(image(1))
+    assert ring.wait_for_frame(after_seq=-1, timeout=0).seq == 0
+    started = time.monotonic()
+    assert ring.wait_for_frame(after_seq=0, timeout=0.05) is None
+    assert time.monotonic() - started >= 0.04
+
+
+def test_wait_for_frame_wakes_up_on_push():
+    ring = FrameRingBuffer(2, (4, 6, 3))
+    ring.push(image(1))
+    threading.Timer(0.05, ring.push, (image(2),)).start()
+    frame = ring.wait_for_frame(after_seq=0, timeout=2)
+    assert frame is not None and frame.seq == 1
+
+
+def test_compressed_ring_buffer_keeps_each_jpeg():
+    ring = FrameRingBuffer(2, (4, 6, 3), compressed=True)
+    data = np.frombuffer(b"\xff\xd8jpeg", dtype=np.uint8)
+    ring.push(data)
+    frame = ring.latest()
+    assert frame.size == (6, 4)
+    assert bytes(frame.jpeg) == b"\xff\xd8jpeg"
+
+
+def test_grabber_with_synthetic_source():
+    source = SyntheticVideoSource(width=64, height=48, num_frames=20, realtime=False)
+    grabber = FrameGrabber(source, buffer_size=4).start()
+    assert grabber.failed.wait(2)  # The source ends after num_frames
+    grabber.stop()
+    assert grabber.frames_grabbed == 20
+    assert grabber.latest().seq == 19
+    assert grabber.latest().image.shape == (48, 64, 3)
+
+
+def test_grabber_skips_decoding_beyond_decode_fps():
+    source = SyntheticVideoSource(width=64, height=48, num_frames=50, realtime=False)
+    grabber = FrameGrabber(source, buffer_size=4, decode_fps=1.0).start()
+    assert grabber.failed.wait(2)
+    grabber.stop()
+    assert grabber.frames_grabbed == 50
+    assert grabber.frames_retrieved < 5
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import torch
+from torchvision.models.detection import ssd300_vgg16
+from detection import (SSD_MIN_INPUT_SIZE, EagerBackend, TorchScriptBackend, create_backend, load_ssd_model,
+                       save_weights)
+from export_model import export_torchscript
+
+
+@pytest.fixture(scope="module")
+def model():
+    # Random weights: the tests check the plumbing, not the accuracy, and need no download
+    torch.manual_seed(0)
+    return ssd300_vgg16(pretrained=False, pretrained_backbone=False).eval()
+
+
+def batch(count=1, size=(300, 300)):
+    torch.manual_seed(1)
+    return torch.rand(count, 3, size[1], size[0])
+
+
+def test_weights_are_loaded_from_the_saved_file(model, tmp_path):
+    weights_file = str(tmp_path / "ssd.pth")
+    save_weights(model, weights_file)
+    loaded = load_ssd_model(weights_file)
+    assert not loaded.training
+    for name, value in model.state_dict().items():
+        assert torch.equal(loaded.state_dict()[name], value)
+
+
+def test_create_backend_errors(tmp_path):
+    with pytest.raises(ValueError):
+        create_backend("tensorrt", device="cpu")
+    with pytest.raises(FileNotFoundError):
+        create_backend("torchscript", device="cpu", model_path=str(tmp_path / "missing.pt"))
+
+
+def test_eager_backend_input_size(model):
+    backend = EagerBackend(model, "cpu")
+    assert backend.set_input_size((320, 320))
+    assert model.transform.fixed_size == (320, 320)
+    with pytest.raises(ValueError):
+        backend.set_input_size((SSD_MIN_INPUT_SIZE[0] - 1, SSD_MIN_INPUT_SIZE[1]))
+    backend.set_input_size((300, 300))
+    predictions = backend.predict(batch(2))
+    assert len(predictions) == 2
+    assert predictions[0]['boxes'].shape[1:] == (4,)
+    assert predictions[0]['boxes'].dtype.name == "float32" and predictions[0]['labels'].dtype.name == "int64"
+
+
+def test_torchscript_backend_matches_eager(model, tmp_path):
+    path = str(tmp_path / "ssd.pt")
+    export_torchscript(model, path)
+    backend = create_backend("torchscript", device="cpu", model_path=path)
+    assert isinstance(backend, TorchScriptBackend)
+    images = batch()
+    scripted, = backend.predict(images)
+    eager, = EagerBackend(model, "cpu").predict(images)
+    assert scripted['boxes'].shape == eager['boxes'].shape
+    assert np.allclose(scripted['boxes'], eager['boxes'], atol=1e-3)
@@ -0,0 +1,103 @@
+import time
+import pytest
+import system_stats
+from system_stats import (TelemetrySampler, fan_curve, control_fan, control_columns, hottest_temperature,
+                          FAN_START_TEMP, FAN_FULL_TEMP, FAN_MIN_PWM, FAN_HYSTERESIS)
+import governor as governor_module
+from governor import Governor, GOVERNOR_LEVELS, STEP_DOWN_AFTER, STEP_UP_AFTER, TEMP_BUDGET
+from simulate_governor import make_sysfs, write_temperatures, read_pwm, PMIC_DIE_TEMP
+
+
+@pytest.fixture
+def sysfs(tmp_path, monkeypatch):
+    """A simulated sysfs tree: CPU-therm, GPU-therm, a PMIC-Die stuck at 100C and the fan PWM file."""
+    root = str(tmp_path)
+    make_sysfs(root)
+    monkeypatch.setattr(system_stats, "SYSFS_ROOT", root)
+    monkeypatch.setattr(system_stats, "_fan_pwm", None)
+    return root
+
+
+def sample_telemetry(root, temperatures, cpu=None):
+    """Runs a sampler on the tree for a few samples; cpu replaces the measured CPU usage."""
+    write_temperatures(root, temperatures)
+    sampler = TelemetrySampler(interval=0.01, sysfs_root=root)
+    if cpu is not None:
+        sampler.columns[0] = "cpu_measured"
+        sampler.add_source("cpu", lambda: cpu)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    return sampler
+
+
+def test_fan_curve():
+    assert fan_curve(FAN_START_TEMP - 1) == 0
+    assert fan_curve(FAN_START_TEMP) == FAN_MIN_PWM
+    assert fan_curve((FAN_START_TEMP + FAN_FULL_TEMP) / 2) == round((FAN_MIN_PWM + 255) / 2)
+    assert fan_curve(FAN_FULL_TEMP) == 255
+    # A running fan keeps spinning until FAN_HYSTERESIS below the start temperature
+    assert fan_curve(FAN_START_TEMP - FAN_HYSTERESIS / 2, running=True) == FAN_MIN_PWM
+    assert fan_curve(FAN_START_TEMP - FAN_HYSTERESIS - 0.1, running=True) == 0
+
+
+def test_control_fan_writes_the_pwm_file(sysfs):
+    assert control_fan(FAN_FULL_TEMP) == 255
+    assert read_pwm(sysfs) == 255
+    # Small changes are not written
+    assert control_fan(FAN_FULL_TEMP - 0.1) == 255
+    assert control_fan(20.0) == 0
+    assert read_pwm(sysfs) == 0
+
+
+def test_control_columns():
+    columns = ["cpu", "temp_AO-therm", "temp_CPU-therm", "temp_GPU-therm", "temp_PMIC-Die", "fan_pwm"]
+    assert control_columns(columns) == ["temp_CPU-therm", "temp_GPU-therm"]
+    # Without any control zone the first zone is used
+    assert control_columns(["cpu", "temp_soc0", "temp_PMIC-Die"]) == ["temp_soc0"]
+    assert control_columns(["cpu", "ram"]) == []
+
+
+def test_pmic_die_does_not_drive_the_fan(sysfs):
+    sample = {"cpu": 10.0, "temp_CPU-therm": 40.0, "temp_GPU-therm": 38.0, "temp_PMIC-Die": 100.0}
+    assert hottest_temperature(sample) == 40.0
+    sampler = sample_telemetry(sysfs, [40.0, 38.0, PMIC_DIE_TEMP])
+    system_stats.control_fan_on_change(sampler.snapshot())
+    assert read_pwm(sysfs) == 0
+
+
+def test_governor_reads_the_control_zones(sysfs, tmp_path):
+    sampler = sample_telemetry(sysfs, [50.0, 48.5, PMIC_DIE_TEMP], cpu=30.0)
+    governor = Governor(sampler, lambda settings: None, window=60, log_file=str(tmp_path / "governor.log"))
+    measurements = governor.measure()
+    assert measurements["temperature"] == pytest.approx(50.0)
+    assert governor.decide(measurements, now=0.0) == (0, "within budget")
+
+
+def test_governor_steps_down_when_hot(sysfs, tmp_path):
+    sampler = sample_telemetry(sysfs, [TEMP_BUDGET + 5, TEMP_BUDGET, PMIC_DIE_TEMP], cpu=30.0)
+    applied = []
+    log_file = str(tmp_path / "governor.log")
+    governor = Governor(sampler, applied.append, window=60, log_file=log_file)
+    record = governor.step(now=100.0)
+    assert record["level"] == 1 and record["reason"].startswith("over budget: temperature")
+    assert applied == [GOVERNOR_LEVELS[1]]
+    assert governor_module.read_decisions(log_file)[-1]["level"] == 1
+
+
+def test_governor_decide_waits_between_changes(tmp_path):
+    governor = Governor(None, lambda settings: None, log_file=str(tmp_path / "governor.log"))
+    hot = {"temperature": TEMP_BUDGET + 1, "latency_ms": None, "cpu": None}
+    cool = {"temperature": TEMP_BUDGET - 20, "latency_ms": 100.0, "cpu": 10.0}
+
+    assert governor.decide(hot, now=0.0)[0] == 1
+    governor.level, governor._last_change = 1, 0.0
+    assert governor.decide(hot, now=STEP_DOWN_AFTER / 2)[0] == 1
+    assert governor.decide(hot, now=STEP_DOWN_AFTER)[0] == 2
+    # Stepping up takes a longer quiet period
+    assert governor.decide(cool, now=STEP_UP_AFTER / 2)[0] == 1
+    assert governor.decide(cool, now=STEP_UP_AFTER)[0] == 0
+
+    governor.level = len(GOVERNOR_LEVELS) - 1
+    level, reason = governor.decide(hot, now=1000.0)
+    assert level == governor.level and reason.startswith("over budget at the lowest level")
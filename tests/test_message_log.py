@@ -0,0 +1,47 @@
+from message_log import MessageLog
+
+
+def test_append_and_read(tmp_path):
+    log = MessageLog(str(tmp_path / "ids.log"))
+    for message_id in (1, 2, 3):
+        log.append(message_id)
+    assert log.read_all() == [1, 2, 3]
+    log.remove([2])
+    log.append(4)
+    assert log.read_all() == [1, 3, 4]
+    log.close()
+
+
+def test_partial_last_line_is_skipped(tmp_path):
+    path = tmp_path / "ids.log"
+    path.write_text("111\n123")
+    assert MessageLog(str(path)).read_all() == [111]
+
+
+def test_append_after_crash_does_not_merge_ids(tmp_path):
+    path = tmp_path / "ids.log"
+    path.write_text("111\n123")
+    log = MessageLog(str(path))
+    log.append(456)
+    assert log.read_all() == [111, 456]
+    log.close()
+    assert path.read_text() == "111\n456\n"
+
+
+def test_partial_only_line(tmp_path):
+    path = tmp_path / "ids.log"
+    path.write_text("12")
+    log = MessageLog(str(path))
+    log.append(7)
+    assert log.read_all() == [7]
+    log.close()
+
+
+def test_import_json(tmp_path):
+    json_path = tmp_path / "message_ids.json"
+    json_path.write_text("[5, 6]")
+    log = MessageLog(str(tmp_path / "ids.log"))
+    assert log.import_json(str(json_path)) == 2
+    assert not json_path.exists()
+    assert log.read_all() == [5, 6]
+    log.close()
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+import pytest
+from pipeline import Pipeline, StageQueue, FairScheduler, DROP_OLDEST, NEVER_DROP
+
+
+def test_drop_oldest_evicts_the_stalest_item():
+    q = StageQueue(2, DROP_OLDEST)
+    for item in range(4):
+        assert q.put(item)
+    assert q.dropped == 2
+    assert [q.get(0), q.get(0)] == [2, 3]
+    with pytest.raises(queue.Empty):
+        q.get(0)
+
+
+def test_never_drop_blocks_until_there_is_room():
+    q = StageQueue(1, NEVER_DROP)
+    q.put("first")
+    threading.Timer(0.1, q.get).start()
+    started = time.monotonic()
+    assert q.put("second")
+    assert time.monotonic() - started >= 0.05
+    assert q.dropped == 0
+    assert q.get(0) == "second"
+
+
+def test_never_drop_gives_up_when_stopping():
+    q = StageQueue(1, NEVER_DROP)
+    q.put("first")
+    stop_event = threading.Event()
+    stop_event.set()
+    assert not q.put("second", stop_event=stop_event)
+    assert q.depth() == 1
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StageQueue(1, "sometimes")
+
+
+def test_stage_keeps_an_item_it_could_not_queue_at_stop():
+    pipeline = Pipeline()
+    frames = StageQueue(4)
+    alerts = StageQueue(1, NEVER_DROP)
+    stage = pipeline.add_stage("alert", lambda item: item, frames, alerts)
+    pipeline.start()
+    for item in range(2):
+        frames.put(item)
+    # The second item waits for room in the full alert queue
+    assert not pipeline.drain(0.3)
+    pipeline.stop()
+    assert stage.held() == 1
+    assert pipeline.stats()["alert"]["held"] == 1
+
+    assert alerts.get(0) == 0
+    pipeline.start()
+    assert alerts.get(2) == 1
+    assert pipeline.drain(2)
+    pipeline.stop()
+    assert stage.held() == 0
+
+
+def test_stage_counts_errors_and_goes_on():
+    pipeline = Pipeline()
+    inputs, outputs = StageQueue(4), StageQueue(4)
+    pipeline.add_stage("divide", lambda x: 1 / x, inputs, outputs)
+    pipeline.start()
+    for x in (0, 2):
+        inputs.put(x)
+    assert outputs.get(2) == 0.5
+    pipeline.stop()
+    assert pipeline.stats()["divide"]["errors"] == 1
+
+
+def frames_of(*cameras):
+    return [{"camera": camera, "score": score} for camera, score in cameras]
+
+
+def test_round_robin_alternates_between_producers():
+    scheduler = FairScheduler(key=lambda item: item["camera"], maxsize_per_key=4)
+    for item in frames_of(("a", 0), ("a", 0), ("a", 0), ("b", 0), ("b", 0)):
+        scheduler.put(item)
+    order = [scheduler.get(0)["camera"] for _ in range(5)]
+    assert order == ["a", "b", "a", "b", "a"]
+
+
+def test_priority_serves_a_starved_producer_after_max_skips():
+    scheduler = FairScheduler(key=lambda item: item["camera"], maxsize_per_key=10,
+                              policy=FairScheduler.PRIORITY, priority=lambda item: item["score"], max_skips=2)
+    for _ in range(6):
+        scheduler.put({"camera": "busy", "score": 10})
+    scheduler.put({"camera": "quiet", "score": 1})
+    order = [scheduler.get(0)["camera"] for _ in range(3)]
+    # Passed over twice, the low-priority camera is served next
+    assert order == ["busy", "busy", "quiet"]
+
+
+def test_scheduler_drops_the_oldest_frame_per_producer():
+    scheduler = FairScheduler(key=lambda item: item["camera"], maxsize_per_key=2)
+    for score in range(3):
+        scheduler.put({"camera": "a", "score": score})
+    assert scheduler.dropped == 1
+    assert scheduler.get(0)["score"] == 1
+
+
+def test_priority_policy_needs_a_priority_function():
+    with pytest.raises(ValueError):
+        FairScheduler(key=lambda item: item, policy=FairScheduler.PRIORITY)
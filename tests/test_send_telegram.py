@@ -0,0 +1,119 @@
+import asyncio
+import socket
+import time
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("telegram")  # bot_config creates a python-telegram-bot Bot
+from fake_bot_api import FakeBotAPI
+from send_telegram import AsyncTelegramSender, TokenBucket
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def api():
+    api = FakeBotAPI(retry_after=1)
+    api.url = api.start(port=free_port())
+    yield api
+    api.stop()
+
+
+def make_sender(api):
+    sent = []
+    sender = AsyncTelegramSender(token="test", default_chat_id="42", api_url=api.url, on_sent=sent.append)
+    return sender, sent
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    async def acquire_all(bucket, count):
+        started = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert run(acquire_all(TokenBucket(rate=20.0, capacity=3), 3)) < 0.05
+    # Three tokens in the bucket, three more at 20 per second
+    assert run(acquire_all(TokenBucket(rate=20.0, capacity=3), 6)) >= 0.14
+
+
+def test_token_bucket_pause():
+    async def paused():
+        bucket = TokenBucket(rate=100.0, capacity=5)
+        bucket.pause(0.2)
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert run(paused()) >= 0.18
+
+
+def test_sender_waits_for_retry_after(api):
+    api.rate_limit_every = 2
+    sender, sent = make_sender(api)
+    sender.start()
+    sender.enqueue({'type': 'message', 'content': "one"})
+    sender.enqueue({'type': 'message', 'content': "two"})
+    sender.stop(10)
+    calls = api.calls("sendMessage")
+    assert [fields["text"] for _, _, fields in calls] == ["one", "two", "two"]
+    # The second request got a 429 with retry_after=1
+    assert calls[2][0] - calls[1][0] >= 0.9
+    assert sender.retries == 1 and sender.failed == 0
+    assert sent == [1, 2]
+
+
+def test_images_are_coalesced_into_an_album(api):
+    sender, sent = make_sender(api)
+    sender.start()
+    for i in range(3):
+        sender.enqueue({'type': 'image', 'data': b"jpeg", 'filename': f"{i}.jpg", 'caption': f"camera {i}"})
+    sender.enqueue({'type': 'message', 'content': "after the album"})
+    sender.stop(10)
+    methods = [method for _, method, _ in api.calls()]
+    assert methods == ["sendMediaGroup", "sendMessage"]
+    assert sender.sent == 4 and len(sent) == 4
+
+
+def test_single_image_is_sent_as_photo(api):
+    sender, _ = make_sender(api)
+    sender.start()
+    sender.enqueue({'type': 'image', 'data': b"jpeg", 'filename': "a.jpg", 'caption': "Person detected"})
+    sender.stop(10)
+    (_, method, fields), = api.calls()
+    assert method == "sendPhoto" and fields["caption"] == "Person detected"
+
+
+def test_items_queued_before_start_are_sent(api):
+    sender, _ = make_sender(api)
+    sender.enqueue({'type': 'message', 'content': "early"})
+    with pytest.raises(RuntimeError):
+        sender.run(sender.send_message("not running"))
+    sender.start()
+    assert sender.run(sender.send_message("reply", chat=7))["message_id"] == 2
+    sender.stop(10)
+    assert [(fields["chat_id"], fields["text"]) for _, _, fields in api.calls("sendMessage")] == \
+        [("42", "early"), (7, "reply")]
+
+
+def test_delete_falls_back_to_single_deletes(api):
+    api.bulk_delete = False
+    sender, _ = make_sender(api)
+    sender.start()
+    failed = sender.run(sender.delete_messages([1, 2, 3]))
+    sender.stop(10)
+    assert failed == []
+    assert api.deleted == {1, 2, 3}
+    assert len(api.calls("deleteMessage")) == 3
@@ -0,0 +1,44 @@
+from tracker import PersonTracker
+
+
+def test_a_person_walking_is_one_track():
+    tracker = PersonTracker()
+    assert len(tracker.update([[100, 100, 200, 300]], [0.9], timestamp=0.0)) == 1
+    for step in range(1, 10):
+        x = 100 + 30 * step
+        assert tracker.update([[x, 100, x + 100, 300]], [0.9], timestamp=step * 0.2) == []
+    assert len(tracker.tracks) == 1 and tracker.tracks[0].hits == 10
+    assert tracker.alerts == 1
+
+
+def test_two_people_alert_separately():
+    tracker = PersonTracker()
+    new = tracker.update([[0, 0, 100, 200], [400, 0, 500, 200]], [0.9, 0.8], timestamp=0.0)
+    assert [track.track_id for track in new] == [1, 2]
+
+
+def test_reentry_within_the_cooldown_does_not_alert_again():
+    tracker = PersonTracker(max_age=1.0, reentry_cooldown=10.0)
+    box = [100, 100, 200, 300]
+    assert len(tracker.update([box], [0.9], timestamp=0.0)) == 1
+    # The person leaves, the track expires and they come back nearby
+    tracker.update([], [], timestamp=2.0)
+    assert tracker.tracks == []
+    assert tracker.update([[120, 100, 220, 300]], [0.9], timestamp=5.0) == []
+    assert tracker.suppressed == 1 and tracker.alerts == 1
+
+
+def test_reentry_after_the_cooldown_alerts():
+    tracker = PersonTracker(max_age=1.0, reentry_cooldown=10.0)
+    box = [100, 100, 200, 300]
+    tracker.update([box], [0.9], timestamp=0.0)
+    tracker.update([], [], timestamp=2.0)
+    assert len(tracker.update([box], [0.9], timestamp=13.0)) == 1
+    assert tracker.alerts == 2 and tracker.suppressed == 0
+
+
+def test_a_new_person_elsewhere_alerts_during_the_cooldown():
+    tracker = PersonTracker(max_age=1.0, reentry_cooldown=10.0)
+    tracker.update([[100, 100, 200, 300]], [0.9], timestamp=0.0)
+    tracker.update([], [], timestamp=2.0)
+    assert len(tracker.update([[1000, 100, 1100, 300]], [0.9], timestamp=3.0)) == 1
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+from capture_image import MOTION_WEIGHT_UNIT
+from zones import CameraZones, ZoneStore, rasterize, mask_from_drawing, MASK_EXCLUDE, MASK_UNCHANGED
+
+LEFT_HALF = [(0.0, 0.0), (0.5, 0.0), (0.5, 1.0), (0.0, 1.0)]
+TOP_LEFT = [(0.0, 0.0), (0.25, 0.0), (0.25, 0.5), (0.0, 0.5)]
+
+
+def detections(*boxes):
+    return {'boxes': np.array(boxes, dtype=np.float32), 'labels': np.ones(len(boxes), dtype=np.int64),
+            'scores': np.full(len(boxes), 0.9, dtype=np.float32)}
+
+
+def test_rasterize_without_include_watches_everything_but_exclusions():
+    watched, weights = rasterize([{"name": "tv", "type": "exclude", "polygon": TOP_LEFT}], (100, 100))
+    assert watched[10, 10] == 0 and watched[90, 90] == 255
+    assert weights[90, 90] == MOTION_WEIGHT_UNIT
+
+
+def test_rasterize_include_with_sensitivity():
+    zones = [{"name": "door", "type": "include", "polygon": LEFT_HALF, "sensitivity": 2.0},
+             {"name": "tv", "type": "exclude", "polygon": TOP_LEFT}]
+    watched, weights = rasterize(zones, (100, 100))
+    # Only the include zone is watched, minus the exclusion inside it
+    assert watched[75, 25] == 255 and watched[50, 90] == 0 and watched[10, 10] == 0
+    assert weights[75, 25] == 2 * MOTION_WEIGHT_UNIT
+
+
+def test_filter_detections_drops_boxes_outside_the_watched_area():
+    camera = CameraZones("a", [{"name": "door", "type": "include", "polygon": LEFT_HALF}])
+    frame_size = (640, 480)
+    inside, outside, straddling = [20, 100, 220, 400], [420, 100, 620, 400], [220, 100, 420, 400]
+    kept = camera.filter_detections(detections(inside, outside, straddling), frame_size)
+    assert kept['boxes'].tolist() == [inside, straddling]
+    assert len(kept['scores']) == 2 and camera.detections_ignored == 1
+    overlap = camera.box_overlap([inside, outside, straddling], frame_size)
+    assert np.allclose(overlap, [1.0, 0.0, 0.5], atol=0.02)
+
+
+def test_camera_without_zones_keeps_every_detection():
+    camera = CameraZones("a")
+    found = detections([0, 0, 10, 10])
+    assert camera.masks((100, 100)) is None
+    assert camera.filter_detections(found, (640, 480)) is found
+
+
+def test_mask_from_drawing():
+    image = np.full((60, 80, 3), 128, dtype=np.uint8)
+    assert mask_from_drawing(image) is None
+    image[:, :20] = (0, 0, 255)  # Red paint
+    labels = mask_from_drawing(image)
+    assert labels[30, 5] == MASK_EXCLUDE and labels[30, 60] == MASK_UNCHANGED
+
+
+def test_zone_store_saves_and_reloads(tmp_path):
+    path = str(tmp_path / "zones.json")
+    store = ZoneStore(path=path, mask_dir=str(tmp_path / "masks"), defaults={})
+    camera = store.camera("a")
+    store.set_zones("a", [{"name": "door", "type": "include", "polygon": LEFT_HALF}])
+    assert store.camera("a") is camera and len(camera.zones) == 1
+
+    drawing = np.full((60, 80), 255, dtype=np.uint8)
+    drawing[:, 40:] = 0
+    store.set_drawn_mask("a", cv2.cvtColor(drawing, cv2.COLOR_GRAY2BGR))
+
+    reloaded = ZoneStore(path=path, mask_dir=str(tmp_path / "masks"), defaults={}).camera("a")
+    assert [zone['type'] for zone in reloaded.zones] == ["include", "mask"]
+    watched, _ = reloaded.masks((80, 60))
+    assert watched[30, 10] == 255 and watched[30, 70] == 0
+
+
+def test_invalid_zones_are_ignored(tmp_path):
+    defaults = {"a": [{"name": "bad", "type": "include", "polygon": [(0, 0), (2, 0), (0, 1)]},
+                      {"name": "odd", "type": "circle"}]}
+    store = ZoneStore(path=str(tmp_path / "zones.json"), defaults=defaults)
+    assert store.camera("a").zones == []
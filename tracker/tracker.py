@@ -0,0 +1,146 @@
+import threading
+import numpy as np
+from detection import box_iou
+
+# A detection is matched to a track if their IoU is at least this
+IOU_THRESHOLD = 0.3
+# ...or, failing that, if their centers are closer than this many track diagonals
+CENTROID_DISTANCE = 0.5
+# Tracks not seen for this long are removed (seconds)
+MAX_TRACK_AGE = 3.0
+# A new track close to one removed less than this long ago is treated as the
+# same person re-entering and does not alert again (seconds)
+REENTRY_COOLDOWN = 30.0
+
+
+class Track:
+    """One tracked person."""
+
+    def __init__(self, track_id, box, score, timestamp):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.score = float(score)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+
+    def predict(self, timestamp):
+        """Box expected at timestamp under constant velocity."""
+        return self.box + self.velocity * (timestamp - self.last_seen)
+
+    def update(self, box, score, timestamp):
+        box = np.asarray(box, dtype=np.float32)
+        dt = timestamp - self.last_seen
+        if dt > 0:
+            # Smooth the velocity so a single jittery box does not throw the prediction off
+            self.velocity = 0.5 * self.velocity + 0.5 * (box - self.box) / dt
+        self.box = box
+        self.score = float(score)
+        self.last_seen = timestamp
+        self.hits += 1
+
+
+def _centers(boxes):
+    return (boxes[:, :2] + boxes[:, 2:]) / 2.0
+
+
+class PersonTracker:
+    """
+    SORT-style IoU/centroid tracker for the person boxes of one camera.
+
+    update() associates the detections of a frame with the existing tracks
+    (greedy on a vectorized IoU matrix, then on normalized centroid
+    distance), starts tracks for unmatched detections and drops tracks that
+    were not seen for max_age seconds. It returns the tracks that deserve an
+    alert: new tracks that are not a recently lost person re-entering.
+    """
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, centroid_distance=CENTROID_DISTANCE,
+                 max_age=MAX_TRACK_AGE, reentry_cooldown=REENTRY_COOLDOWN):
+        self.iou_threshold = iou_threshold
+        self.centroid_distance = centroid_distance
+        self.max_age = max_age
+        self.reentry_cooldown = reentry_cooldown
+        self.tracks = []
+        self._removed = []  # (box, removed_at) of recently expired tracks
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.alerts = 0
+        self.suppressed = 0
+
+    def _associate(self, predicted, boxes):
+        """Returns a list of (track index, detection index) pairs."""
+        if len(predicted) == 0 or len(boxes) == 0:
+            return []
+        pairs = []
+        iou = box_iou(predicted, boxes)
+        while iou.size and iou.max() >= self.iou_threshold:
+            t, d = np.unravel_index(np.argmax(iou), iou.shape)
+            pairs.append((t, d))
+            iou[t, :] = -1.0
+            iou[:, d] = -1.0
+
+        # Fall back to centroid distance for fast movers whose boxes no longer overlap
+        matched_tracks = {t for t, _ in pairs}
+        matched_detections = {d for _, d in pairs}
+        diagonals = np.linalg.norm(predicted[:, 2:] - predicted[:, :2], axis=1)
+        distance = np.linalg.norm(_centers(predicted)[:, None, :] - _centers(boxes)[None, :, :], axis=2)
+        distance /= np.maximum(diagonals[:, None], 1.0)
+        distance[list(matched_tracks), :] = np.inf
+        distance[:, list(matched_detections)] = np.inf
+        while distance.size and distance.min() <= self.centroid_distance:
+            t, d = np.unravel_index(np.argmin(distance), distance.shape)
+            pairs.append((t, d))
+            distance[t, :] = np.inf
+            distance[:, d] = np.inf
+        return pairs
+
+    def _is_reentry(self, box, timestamp):
+        self._removed = [(b, t) for b, t in self._removed if timestamp - t < self.reentry_cooldown]
+        if not self._removed:
+            return False
+        removed = np.array([b for b, _ in self._removed], dtype=np.float32)
+        diagonals = np.linalg.norm(removed[:, 2:] - removed[:, :2], axis=1)
+        distance = np.linalg.norm(_centers(removed) - _centers(box[None, :]), axis=1)
+        return bool(np.any(distance <= 2.0 * np.maximum(diagonals, 1.0)))
+
+    def update(self, boxes, scores, timestamp):
+        """Feed the person boxes of one frame; returns the new tracks to alert on."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        with self._lock:
+            predicted = np.array([track.predict(timestamp) for track in self.tracks],
+                                 dtype=np.float32).reshape(-1, 4)
+            pairs = self._associate(predicted, boxes)
+            for t, d in pairs:
+                self.tracks[t].update(boxes[d], scores[d], timestamp)
+
+            # Expire tracks that have not been seen for a while
+            alive = []
+            for track in self.tracks:
+                if timestamp - track.last_seen > self.max_age:
+                    self._removed.append((track.box, timestamp))
+                else:
+                    alive.append(track)
+            self.tracks = alive
+
+            new_tracks = []
+            matched = {d for _, d in pairs}
+            for d in range(len(boxes)):
+                if d in matched:
+                    continue
+                track = Track(self._next_id, boxes[d], scores[d], timestamp)
+                self._next_id += 1
+                self.tracks.append(track)
+                if self._is_reentry(track.box, timestamp):
+                    self.suppressed += 1
+                else:
+                    self.alerts += 1
+                    new_tracks.append(track)
+            return new_tracks
+
+    def format_stats(self):
+        with self._lock:
+            return (f"tracker: {len(self.tracks)} active tracks, {self._next_id - 1} total, "
+                    f"{self.alerts} alerts, {self.suppressed} re-entries suppressed")
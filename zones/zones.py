@@ -0,0 +1,334 @@
+import os
+import logging
+import json
+import threading
+import cv2
+import numpy as np
+from capture_image import MOTION_WEIGHT_UNIT
+
+logger = logging.getLogger(__name__)
+
+# Zones per camera name. A zone is a polygon in normalized coordinates (0..1, so
+# it does not depend on the capture or motion resolution):
+#   "include": only motion and people inside include zones count (if a camera has
+#              any); "sensitivity" weights the changed pixels of the zone (2.0: a
+#              change counts twice, 0.5: half)
+#   "exclude": motion and people in the zone are ignored (windows, TV, curtains)
+# Zones saved in ZONES_FILE (e.g. drawn in Telegram with /zones) replace these.
+# Example:
+#   ZONES = {"camera": [
+#       {"name": "door", "type": "include", "polygon": [(0.0, 0.2), (0.35, 0.2), (0.35, 1.0), (0.0, 1.0)],
+#        "sensitivity": 2.0},
+#       {"name": "window", "type": "exclude", "polygon": [(0.6, 0.0), (1.0, 0.0), (1.0, 0.45), (0.6, 0.45)]},
+#   ]}
+ZONES = {}
+
+# Zones edited at runtime, and the masks drawn in Telegram (label images: 0 excluded,
+# 255 included, anything else unchanged; see mask_from_drawing())
+ZONES_FILE = "zone_config/zones.json"
+ZONE_MASK_DIR = "zone_config/masks"
+
+# A detection is kept if at least this fraction of its box lies in the watched area
+ZONE_MIN_OVERLAP = 0.3
+
+# Resolution of the mask the detection boxes are checked against (the SSD input size)
+ZONE_DETECTOR_RESOLUTION = (300, 300)
+
+# Colors painted on a /zones snapshot (HSV, OpenCV hue 0..180): red marks areas to
+# ignore, green the areas to watch. The snapshot is sent in gray, so only the paint
+# is saturated; JPEG artifacts at the edges of strokes stay below the saturation limit
+PAINT_MIN_SATURATION = 100
+PAINT_MIN_VALUE = 60
+PAINT_RED_HUES = ((0, 12), (168, 180))
+PAINT_GREEN_HUES = ((35, 90),)
+# Less paint than this fraction of the image is taken as color noise, not as zones
+PAINT_MIN_AREA = 0.002
+
+ZONE_TYPES = ("include", "exclude", "mask")
+MASK_EXCLUDE = 0
+MASK_INCLUDE = 255
+MASK_UNCHANGED = 128
+
+
+def _polygon_points(polygon, resolution):
+    width, height = resolution
+    points = np.asarray(polygon, dtype=np.float32) * np.float32((width, height))
+    return [np.round(points).astype(np.int32)]
+
+
+def _load_mask(zone, resolution):
+    """The label image of a "mask" zone resized to resolution, or None if the file is missing."""
+    mask = cv2.imread(zone['file'], cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        logger.warning("Zone mask %s can not be read; ignoring it", zone['file'])
+        return None
+    return cv2.resize(mask, tuple(resolution), interpolation=cv2.INTER_NEAREST)
+
+
+def sensitivity_weight(sensitivity):
+    """Weight map value of a zone: MOTION_WEIGHT_UNIT per unit of sensitivity (1..255)."""
+    return int(np.clip(round(MOTION_WEIGHT_UNIT * float(sensitivity)), 1, 255))
+
+
+def rasterize(zones, resolution):
+    """
+    Rasterizes the zones of a camera at resolution (width, height). Returns
+    (watched, weights): watched is 255 where motion and people count and 0
+    elsewhere; weights holds the per-pixel sensitivity for MotionDetector
+    (MOTION_WEIGHT_UNIT for sensitivity 1, 0 outside the watched area).
+    """
+    width, height = resolution
+    masks = {index: _load_mask(zone, resolution) for index, zone in enumerate(zones) if zone['type'] == "mask"}
+    has_include = any(zone['type'] == "include" for zone in zones) or any(
+        mask is not None and (mask == MASK_INCLUDE).any() for mask in masks.values())
+    weights = np.full((height, width), 0 if has_include else MOTION_WEIGHT_UNIT, dtype=np.uint8)
+
+    # Include areas first, the more sensitive ones last so they win where zones overlap
+    includes = [(index, zone) for index, zone in enumerate(zones) if zone['type'] in ("include", "mask")]
+    for index, zone in sorted(includes, key=lambda item: item[1].get('sensitivity', 1.0)):
+        weight = sensitivity_weight(zone.get('sensitivity', 1.0))
+        if zone['type'] == "include":
+            cv2.fillPoly(weights, _polygon_points(zone['polygon'], resolution), weight)
+        elif masks[index] is not None:
+            weights[masks[index] == MASK_INCLUDE] = weight
+    # Exclusions override everything
+    for index, zone in enumerate(zones):
+        if zone['type'] == "exclude":
+            cv2.fillPoly(weights, _polygon_points(zone['polygon'], resolution), 0)
+        elif zone['type'] == "mask" and masks[index] is not None:
+            weights[masks[index] == MASK_EXCLUDE] = 0
+    watched = cv2.compare(weights, 0, cv2.CMP_GT)
+    return watched, weights
+
+
+def _paint(hsv, hue_ranges):
+    paint = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    for low, high in hue_ranges:
+        paint |= cv2.inRange(hsv, (low, PAINT_MIN_SATURATION, PAINT_MIN_VALUE), (high, 255, 255))
+    return paint
+
+
+def mask_from_drawing(image):
+    """
+    Converts a snapshot painted in a phone editor (BGR) into a label image:
+    red paint is excluded, green paint included, everything else unchanged.
+    An image without paint is taken as a plain black and white mask: white is
+    watched, black excluded. Returns None if the image is neither.
+    """
+    if image.ndim == 3:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        # A small opening removes isolated pixels of color noise
+        kernel = np.ones((3, 3), dtype=np.uint8)
+        red = cv2.morphologyEx(_paint(hsv, PAINT_RED_HUES), cv2.MORPH_OPEN, kernel)
+        green = cv2.morphologyEx(_paint(hsv, PAINT_GREEN_HUES), cv2.MORPH_OPEN, kernel)
+        if np.count_nonzero(red | green) >= PAINT_MIN_AREA * red.size:
+            labels = np.full(image.shape[:2], MASK_UNCHANGED, dtype=np.uint8)
+            labels[green > 0] = MASK_INCLUDE
+            labels[red > 0] = MASK_EXCLUDE
+            return labels
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    black = gray < 64
+    white = gray > 192
+    # A photo is not a mask: nearly every pixel must be black or white
+    if not black.any() or black.all() or np.count_nonzero(black | white) < 0.95 * gray.size:
+        return None
+    # White areas are watched as they are (not included: that would ignore the rest)
+    return np.where(black, MASK_EXCLUDE, MASK_UNCHANGED).astype(np.uint8)
+
+
+class CameraZones:
+    """
+    The zones of one camera, rasterized once per resolution and cached.
+
+    masks(resolution) returns the (watched, weights) pair that MotionDetector
+    applies to its motion mask, or None when the camera has no zones (so an
+    unzoned camera costs nothing). filter_detections() drops the detections
+    whose box lies mostly outside the watched area, using an integral image
+    of the mask at ZONE_DETECTOR_RESOLUTION: one lookup per box corner.
+    """
+
+    def __init__(self, name, zones=()):
+        self.name = name
+        self.zones = list(zones)
+        self._cache = {}  # resolution -> (watched, weights)
+        self._integral = None
+        self._lock = threading.Lock()
+        self.motion_ignored = 0  # Frames whose motion was all outside the watched area (set by MotionDetector)
+        self.detections_ignored = 0
+
+    def set_zones(self, zones):
+        with self._lock:
+            self.zones = list(zones)
+            self._cache = {}
+            self._integral = None
+
+    def masks(self, resolution):
+        """(watched, weights) at resolution (width, height), or None without zones."""
+        if not self.zones:
+            return None
+        resolution = tuple(resolution)
+        entry = self._cache.get(resolution)
+        if entry is None:
+            with self._lock:
+                entry = self._cache.get(resolution)
+                if entry is None and self.zones:
+                    entry = rasterize(self.zones, resolution)
+                    self._cache[resolution] = entry
+        return entry
+
+    def box_overlap(self, boxes, frame_size):
+        """Fraction of each box (N x 4, frame pixels) that lies in the watched area."""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        masks = self.masks(ZONE_DETECTOR_RESOLUTION)
+        if masks is None or len(boxes) == 0:
+            return np.ones(len(boxes), dtype=np.float32)
+        integral = self._integral
+        if integral is None:
+            integral = self._integral = cv2.integral(masks[0] // 255)
+        width, height = ZONE_DETECTOR_RESOLUTION
+        scale = np.float32((width / frame_size[0], height / frame_size[1]) * 2)
+        scaled = np.round(boxes * scale).astype(np.int64)
+        x1, x2 = np.clip(scaled[:, 0], 0, width), np.clip(scaled[:, 2], 0, width)
+        y1, y2 = np.clip(scaled[:, 1], 0, height), np.clip(scaled[:, 3], 0, height)
+        inside = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        area = np.maximum((x2 - x1) * (y2 - y1), 1)
+        return inside / area
+
+    def filter_detections(self, detections, frame_size, min_overlap=ZONE_MIN_OVERLAP):
+        """The detections (boxes/labels/scores) with at least min_overlap of their box in the watched area."""
+        if not self.zones or len(detections['boxes']) == 0:
+            return detections
+        keep = self.box_overlap(detections['boxes'], frame_size) >= min_overlap
+        if keep.all():
+            return detections
+        self.detections_ignored += int(np.count_nonzero(~keep))
+        return {key: np.asarray(value)[keep] for key, value in detections.items()}
+
+    def describe(self):
+        """One line per zone, for /zones."""
+        if not self.zones:
+            return f"{self.name}: no zones, the whole frame is watched"
+        lines = [f"{self.name}:"]
+        for zone in self.zones:
+            sensitivity = f", sensitivity {zone.get('sensitivity', 1.0):g}" if zone['type'] != "exclude" else ""
+            lines.append(f"  {zone['name']} ({zone['type']}{sensitivity})")
+        watched, _ = self.masks((160, 120))
+        lines.append(f"  {cv2.countNonZero(watched) / watched.size:.0%} of the frame watched")
+        return "\n".join(lines)
+
+    def render(self, image):
+        """The image in gray with the outline of the watched area in white, to paint zones on."""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        snapshot = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        masks = self.masks(snapshot.shape[1::-1])
+        if masks is not None:
+            contours, _ = cv2.findContours(masks[0], cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+            cv2.drawContours(snapshot, contours, -1, (255, 255, 255), 2)
+        return snapshot
+
+    def format_stats(self):
+        return (f"zones {self.name}: {len(self.zones)} zones, {self.motion_ignored} motion frames "
+                f"ignored, {self.detections_ignored} detections outside the zones")
+
+
+def _valid_zone(camera, zone):
+    if zone.get('type') not in ZONE_TYPES:
+        logger.warning("Zone %s of %s: unknown type %s; ignoring it", zone.get('name'), camera, zone.get('type'))
+        return False
+    if zone['type'] == "mask":
+        return 'file' in zone
+    polygon = zone.get('polygon') or []
+    if len(polygon) < 3 or any(not (0.0 <= value <= 1.0) for point in polygon for value in point):
+        logger.warning("Zone %s of %s: polygon needs 3 or more points in 0..1; ignoring it",
+                       zone.get('name'), camera)
+        return False
+    return True
+
+
+class ZoneStore:
+    """
+    The CameraZones of every camera: ZONES, with the cameras edited in
+    Telegram replaced by their entry in ZONES_FILE. camera(name) always
+    returns the same object, so edits take effect in the running pipeline.
+    """
+
+    def __init__(self, path=ZONES_FILE, mask_dir=ZONE_MASK_DIR, defaults=None):
+        self.path = path
+        self.mask_dir = mask_dir
+        self.defaults = ZONES if defaults is None else defaults
+        self._cameras = {}
+        self._saved = None
+        self._lock = threading.Lock()
+        self.snapshot_source = None  # Callable(name) -> current BGR frame of a camera or None (set by main.py)
+
+    def _load_saved(self):
+        if self._saved is None:
+            self._saved = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        self._saved = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error("Can not read the zones file %s: %s", self.path, e)
+        return self._saved
+
+    def camera(self, name):
+        with self._lock:
+            zones = self._cameras.get(name)
+            if zones is None:
+                configured = self._load_saved().get(name, self.defaults.get(name, []))
+                zones = self._cameras[name] = CameraZones(
+                    name, [zone for zone in configured if _valid_zone(name, zone)])
+            return zones
+
+    def names(self):
+        with self._lock:
+            return list(self._cameras)
+
+    def set_zones(self, name, zones):
+        """Replaces the zones of a camera and saves them in the zones file."""
+        camera = self.camera(name)
+        camera.set_zones(zones)
+        with self._lock:
+            self._load_saved()[name] = camera.zones
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self._saved, f, indent=2)
+            os.replace(temp_path, self.path)
+        return camera
+
+    def set_drawn_mask(self, name, image, sensitivity=1.0):
+        """
+        Replaces the drawn mask of a camera (see mask_from_drawing()); the
+        configured polygons stay. Returns the CameraZones, or None if the
+        image holds no mask.
+        """
+        labels = mask_from_drawing(image)
+        if labels is None:
+            return None
+        os.makedirs(self.mask_dir, exist_ok=True)
+        path = os.path.join(self.mask_dir, f"{name}.png")
+        cv2.imwrite(path, labels)
+        zones = [zone for zone in self.camera(name).zones if zone['type'] != "mask"]
+        zones.append({"name": "drawn", "type": "mask", "file": path, "sensitivity": float(sensitivity)})
+        return self.set_zones(name, zones)
+
+    def clear(self, name):
+        """Removes every zone of a camera, so the whole frame is watched."""
+        path = os.path.join(self.mask_dir, f"{name}.png")
+        if os.path.exists(path):
+            os.remove(path)
+        return self.set_zones(name, [])
+
+    def snapshot(self, name):
+        """The current frame of a camera with its zones outlined, or None if the camera is not running."""
+        image = self.snapshot_source(name) if self.snapshot_source is not None else None
+        if image is None:
+            return None
+        return self.camera(name).render(image)
+
+
+zone_store = ZoneStore()